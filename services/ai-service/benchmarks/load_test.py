@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест и бенчмарк латентности AI Service.
+
+Гоняет конкурентную нагрузку по каждому эндпоинту и считает пропускную
+способность и перцентили латентности p50/p95/p99. Цели:
+- asgi     - приложение в процессе через httpx ASGI transport (сеть не нужна)
+- uvicorn  - локальный uvicorn, запускаемый самим бенчмарком
+- http://… - уже запущенный сервис
+
+Результаты сохраняются в JSON; при указании --baseline прогон сравнивается
+с сохраненным и завершается с кодом 1 при регрессии.
+
+Использование (из каталога services/ai-service):
+    python -m benchmarks.load_test --target asgi --requests 500 --concurrency 16 \\
+        --output bench.json --baseline baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+DEVICE_ID = "benchmark-device"
+
+SEARCH_QUERIES = ["кирпич", "цемент м500", "доска сосна", "утеплитель 50 мм", "арматура", "штукатурка", None]
+CATEGORIES = [None, "Кирпич", "Цемент", "Строительные материалы"]
+PROJECT_TYPES = ["жилой дом", "гараж", "баня", "ремонт квартиры"]
+COMPLEXITY = ["низкая", "средняя", "высокая"]
+
+
+def _recommendations(rnd: random.Random, unique: bool) -> Tuple[str, str, Optional[dict]]:
+    return "POST", "/recommendations", {
+        "user_id": f"bench-{rnd.randrange(10000)}",
+        "search_query": rnd.choice(SEARCH_QUERIES),
+        "category": rnd.choice(CATEGORIES),
+        "budget": rnd.choice([None, 500.0, 50000.0]),
+    }
+
+
+def _recommendations_batch(rnd: random.Random, unique: bool) -> Tuple[str, str, Optional[dict]]:
+    return "POST", "/recommendations/batch", {
+        "requests": [_recommendations(rnd, unique)[2] for _ in range(64)]
+    }
+
+
+def _price_prediction(rnd: random.Random, unique: bool) -> Tuple[str, str, Optional[dict]]:
+    # Без --unique используется небольшой набор историй, как у повторно опрашивающих клиентов
+    seed = rnd.randrange(1 << 30) if unique else rnd.randrange(20)
+    series = random.Random(seed)
+    history = [round(1000 + i * series.uniform(-5, 15) + series.uniform(-30, 30), 2) for i in range(series.randint(5, 60))]
+    return "POST", "/price-prediction", {
+        "product_id": f"prod-{seed}",
+        "market_data": {"demand": series.choice(["high", "low", "normal"])},
+        "historical_prices": history,
+    }
+
+
+def _construction_estimate(rnd: random.Random, unique: bool) -> Tuple[str, str, Optional[dict]]:
+    area = round(rnd.uniform(10, 400), 1) if unique else float(rnd.choice([36, 100, 150]))
+    return "POST", "/construction-estimate", {
+        "project_type": rnd.choice(PROJECT_TYPES),
+        "area": area,
+        "materials": [],
+        "complexity": rnd.choice(COMPLEXITY),
+    }
+
+
+def _market_analysis(rnd: random.Random, unique: bool) -> Tuple[str, str, Optional[dict]]:
+    return "GET", "/market-analysis", None
+
+
+def _health(rnd: random.Random, unique: bool) -> Tuple[str, str, Optional[dict]]:
+    return "GET", "/health", None
+
+
+WORKLOADS: Dict[str, Callable[[random.Random, bool], Tuple[str, str, Optional[dict]]]] = {
+    "health": _health,
+    "recommendations": _recommendations,
+    "recommendations_batch": _recommendations_batch,
+    "price_prediction": _price_prediction,
+    "construction_estimate": _construction_estimate,
+    "market_analysis": _market_analysis,
+}
+
+
+async def run_workload(
+    client: httpx.AsyncClient,
+    name: str,
+    total: int,
+    concurrency: int,
+    unique: bool,
+    seed: int,
+) -> dict:
+    """Выполняет total запросов к одному эндпоинту с заданной конкурентностью"""
+    rnd = random.Random(seed)
+    requests = [WORKLOADS[name](rnd, unique) for _ in range(total)]
+    latencies = np.zeros(total, dtype=np.float64)
+    statuses: Dict[int, int] = {}
+    errors = 0
+    cursor = 0
+
+    async def worker():
+        nonlocal cursor, errors
+        while cursor < total:
+            i = cursor
+            cursor += 1
+            method, path, body = requests[i]
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body, headers={"x-device-id": DEVICE_ID})
+                status = response.status_code
+            except httpx.HTTPError:
+                status = 0
+            latencies[i] = time.perf_counter() - start
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 0 or status >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, total))))
+    elapsed = time.perf_counter() - started
+
+    ms = latencies * 1000
+    return {
+        "requests": total,
+        "errors": errors,
+        "status_counts": {str(k): v for k, v in sorted(statuses.items())},
+        "duration_s": round(elapsed, 4),
+        "throughput_rps": round(total / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "mean": round(float(ms.mean()), 3),
+            "p50": round(float(np.percentile(ms, 50)), 3),
+            "p95": round(float(np.percentile(ms, 95)), 3),
+            "p99": round(float(np.percentile(ms, 99)), 3),
+            "max": round(float(ms.max()), 3),
+        },
+    }
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 60.0, process: Optional[subprocess.Popen] = None) -> None:
+    """Ждет окончания прогрева моделей (/ready), чтобы не мерить ответы 503"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get("/ready")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        if time.monotonic() > deadline or (process is not None and process.poll() is not None):
+            raise RuntimeError("service did not become ready")
+        await asyncio.sleep(0.05)
+
+
+@asynccontextmanager
+async def asgi_client():
+    # Приложение в процессе, lifespan запускается вручную (загрузка моделей).
+    # Все запросы идут с одним x-device-id, поэтому ограничение частоты выключено
+    os.environ.setdefault("RATE_LIMIT_RPS", "0")
+    from src.main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            await wait_ready(client)
+            yield client
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@asynccontextmanager
+async def uvicorn_client(startup_timeout: float = 60.0):
+    port = _free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env={**os.environ, "LOG_SAMPLE_RATE": os.getenv("LOG_SAMPLE_RATE", "0"), "RATE_LIMIT_RPS": os.getenv("RATE_LIMIT_RPS", "0")},
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=30.0) as client:
+            await wait_ready(client, startup_timeout, process)
+            yield client
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+@asynccontextmanager
+async def http_client(base_url: str):
+    async with httpx.AsyncClient(base_url=base_url, timeout=30.0) as client:
+        await wait_ready(client)
+        yield client
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """Список регрессий относительно базового прогона"""
+    regressions = []
+    for name, current in results["endpoints"].items():
+        base = baseline.get("endpoints", {}).get(name)
+        if not base:
+            continue
+        if base["throughput_rps"] > 0 and current["throughput_rps"] < base["throughput_rps"] * (1 - threshold):
+            regressions.append(
+                f"{name}: throughput {current['throughput_rps']} rps < baseline {base['throughput_rps']} rps"
+            )
+        for q in ("p95", "p99"):
+            if base["latency_ms"][q] > 0 and current["latency_ms"][q] > base["latency_ms"][q] * (1 + threshold):
+                regressions.append(
+                    f"{name}: {q} {current['latency_ms'][q]} ms > baseline {base['latency_ms'][q]} ms"
+                )
+        if current["errors"] > base["errors"]:
+            regressions.append(f"{name}: errors {current['errors']} > baseline {base['errors']}")
+    return regressions
+
+
+def print_report(results: dict) -> None:
+    print(f"{'endpoint':<24}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, r in results["endpoints"].items():
+        lat = r["latency_ms"]
+        print(f"{name:<24}{r['throughput_rps']:>10}{lat['p50']:>10}{lat['p95']:>10}{lat['p99']:>10}{r['errors']:>8}")
+
+
+async def main_async(args) -> int:
+    if args.target == "asgi":
+        client_context = asgi_client()
+    elif args.target == "uvicorn":
+        client_context = uvicorn_client()
+    else:
+        client_context = http_client(args.target)
+
+    endpoints = args.endpoints or list(WORKLOADS)
+    results = {
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "target": args.target,
+        "concurrency": args.concurrency,
+        "requests_per_endpoint": args.requests,
+        "unique_payloads": args.unique,
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "endpoints": {},
+    }
+    async with client_context as client:
+        for name in endpoints:
+            # Прогрев: первые запросы не попадают в статистику
+            await run_workload(client, name, min(args.warmup, args.requests), args.concurrency, args.unique, args.seed + 1)
+            results["endpoints"][name] = await run_workload(
+                client, name, args.requests, args.concurrency, args.unique, args.seed
+            )
+
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print("No regressions against baseline")
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="AI Service load test and latency benchmark")
+    parser.add_argument("--target", default="asgi", help="asgi | uvicorn | http://host:port")
+    parser.add_argument("--endpoints", nargs="*", choices=list(WORKLOADS), help="workloads to run (default: all)")
+    parser.add_argument("--requests", type=int, default=500, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=20, help="warm-up requests per endpoint")
+    parser.add_argument("--unique", action="store_true", help="unique payloads (bypass response caches)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write JSON results to this file")
+    parser.add_argument("--baseline", help="compare against a stored JSON result")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative regression (0.2 = 20%%)")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main_async(parse_args())))
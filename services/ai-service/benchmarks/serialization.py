@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк сериализации ответов AI Service.
+
+Сравнивает стоимость одного ответа на типичных данных:
+- before - модель ответа pydantic из словарей, повторная валидация по
+  response_model (путь FastAPI serialize_response) и json stdlib (JSONResponse)
+- after  - готовый словарь, orjson (FastJSONResponse), без валидации
+
+Использование (из каталога services/ai-service):
+    python -m benchmarks.serialization --repeat 2000 --output serialization.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+os.environ.setdefault("AI_SERVICE_LOG_FILE", "")
+
+from src.main import (  # noqa: E402
+    BulkPricePredictionResponse,
+    ConstructionEstimateResponse,
+    FastJSONResponse,
+    ProductRecommendationBatchResponse,
+    ProductRecommendationResponse,
+)
+
+TRENDS = ["increasing", "stable", "decreasing"]
+
+
+def _item(rnd: random.Random, i: int, location: bool) -> dict:
+    item = {
+        "product_id": f"prod-{i}",
+        "name": f"Кирпич керамический полнотелый М{100 + i}",
+        "category": "Кирпич",
+        "price": round(rnd.uniform(10, 5000), 2),
+        "confidence": round(rnd.random(), 4),
+        "reason": "Соответствует вашему запросу",
+    }
+    if location:
+        item.update({
+            "warehouse_id": "wh-msk",
+            "distance_km": round(rnd.uniform(1, 900), 1),
+            "delivery_cost": round(rnd.uniform(0, 300), 2),
+            "total_price": round(rnd.uniform(10, 5300), 2),
+        })
+    return item
+
+
+def _recommendations(rnd: random.Random) -> dict:
+    items = [_item(rnd, i, location=True) for i in range(20)]
+    return {"success": True, "message": "Рекомендации товаров получены", "deviceId": "bench",
+            "recommendations": items, "confidence": items[0]["confidence"]}
+
+
+def _recommendations_batch(rnd: random.Random) -> dict:
+    results = []
+    for u in range(64):
+        items = [_item(rnd, i, location=False) for i in range(10)]
+        results.append({"user_id": f"user-{u}", "recommendations": items, "confidence": items[0]["confidence"]})
+    return {"success": True, "message": "Рекомендации товаров получены", "deviceId": "bench", "results": results}
+
+
+def _bulk_forecasts(rnd: random.Random) -> dict:
+    forecasts = [
+        {"product_id": f"prod-{i}", "predicted_price": round(rnd.uniform(10, 5000), 2),
+         "confidence": rnd.random(), "trend": rnd.choice(TRENDS)}
+        for i in range(1000)
+    ]
+    return {"success": True, "message": "Прогноз цен рассчитан", "deviceId": "bench", "forecasts": forecasts}
+
+
+def _construction_estimate(rnd: random.Random) -> dict:
+    breakdown = [
+        {"material": f"Материал {i}", "quantity": rnd.randint(1, 5000), "unit": "шт",
+         "unit_price": round(rnd.uniform(10, 5000), 2), "cost": round(rnd.uniform(1000, 500000), 2),
+         "delivery_cost": round(rnd.uniform(0, 20000), 2)}
+        for i in range(10)
+    ]
+    return {"success": True, "message": "Смета строительства рассчитана", "deviceId": "bench",
+            "total_estimate": 1191800.0, "materials_breakdown": breakdown, "labor_estimate": 350000.0,
+            "timeline_days": 90, "delivery_estimate": 42000.0}
+
+
+CASES = {
+    "recommendations": (ProductRecommendationResponse, _recommendations),
+    "recommendations_batch": (ProductRecommendationBatchResponse, _recommendations_batch),
+    "price_prediction_bulk": (BulkPricePredictionResponse, _bulk_forecasts),
+    "construction_estimate": (ConstructionEstimateResponse, _construction_estimate),
+}
+
+
+def _complete(coroutine):
+    """Результат корутины без await внутри (serialize_response для async-обработчика) без event loop"""
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("coroutine suspended")
+
+
+def _strip_none(value):
+    # Типизированные модели дописывают null для необязательных полей, которых нет в словаре
+    if isinstance(value, dict):
+        return {k: _strip_none(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_strip_none(v) for v in value]
+    return value
+
+
+def _before(model, payload: dict) -> Callable[[], bytes]:
+    field = create_response_field(name=f"Response_{model.__name__}", type_=model)
+
+    def run() -> bytes:
+        # Обработчик строит модель, FastAPI валидирует ее по response_model и кодирует json stdlib
+        content = _complete(serialize_response(field=field, response_content=model(**payload)))
+        return JSONResponse(content).body
+    return run
+
+
+def _after(model, payload: dict) -> Callable[[], bytes]:
+    def run() -> bytes:
+        return FastJSONResponse(payload).body
+    return run
+
+
+def measure(run: Callable[[], bytes], repeat: int) -> Dict[str, float]:
+    run()
+    samples: List[float] = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - started) * 1e6)
+    samples.sort()
+    return {
+        "mean_us": round(statistics.fmean(samples), 1),
+        "p50_us": round(samples[len(samples) // 2], 1),
+        "p95_us": round(samples[int(len(samples) * 0.95)], 1),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="AI Service response serialization micro-benchmark")
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args(argv)
+
+    results = {
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "repeat": args.repeat,
+        "python": platform.python_version(),
+        "cases": {},
+    }
+    print(f"{'case':<24}{'bytes':>9}{'before p50 us':>15}{'after p50 us':>14}{'speedup':>9}")
+    for name, (model, build) in CASES.items():
+        payload = build(random.Random(args.seed))
+        before, after = _before(model, payload), _after(model, payload)
+        # Оба пути должны давать один и тот же документ
+        if _strip_none(json.loads(before())) != json.loads(after()):
+            print(f"{name}: before and after responses differ")
+            return 1
+        stats = {"bytes": len(after()), "before": measure(before, args.repeat), "after": measure(after, args.repeat)}
+        stats["speedup"] = round(stats["before"]["p50_us"] / max(stats["after"]["p50_us"], 1e-3), 1)
+        results["cases"][name] = stats
+        print(f"{name:<24}{stats['bytes']:>9}{stats['before']['p50_us']:>15}{stats['after']['p50_us']:>14}{stats['speedup']:>8}x")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Results saved to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк холодного старта AI Service.
+
+Меряет в отдельных процессах:
+- import   - время импорта src.main (тяжелые библиотеки моделей не должны в него входить)
+- health   - время от запуска uvicorn до первого ответа 200 на /health
+- ready    - время от запуска uvicorn до 200 на /ready (модели загружены)
+
+Каждая величина сравнивается с бюджетом; при превышении скрипт завершается
+с кодом 1, что позволяет держать бюджет старта в CI и опираться на него
+при настройке автоскейлера.
+
+Использование (из каталога services/ai-service):
+    python -m benchmarks.startup --runs 5 --import-budget 2.0 --ready-budget 10 --output startup.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.load_test import _free_port
+
+IMPORT_PROBE = (
+    "import sys, time\n"
+    "t = time.perf_counter()\n"
+    "import src.main\n"
+    "print(time.perf_counter() - t, int('numpy' in sys.modules))\n"
+)
+
+
+def measure_import() -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE],
+        env={**os.environ, "AI_SERVICE_LOG_FILE": ""},
+        capture_output=True, text=True, check=True
+    ).stdout.split()
+    return {"seconds": float(output[0]), "numpy_imported": bool(int(output[1]))}
+
+
+def measure_server(timeout: float = 120.0) -> Dict[str, Optional[float]]:
+    """Время до первого ответа /health и до готовности /ready от запуска процесса"""
+    port = _free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env={**os.environ, "AI_SERVICE_LOG_FILE": "", "LOG_SAMPLE_RATE": "0"},
+    )
+    result: Dict[str, Optional[float]] = {"health": None, "ready": None}
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=5.0) as client:
+            while result["ready"] is None:
+                for probe in ("health", "ready"):
+                    if result[probe] is not None:
+                        continue
+                    try:
+                        if client.get(f"/{probe}").status_code == 200:
+                            result[probe] = time.perf_counter() - started
+                    except httpx.HTTPError:
+                        pass
+                if time.perf_counter() - started > timeout or process.poll() is not None:
+                    raise RuntimeError("service did not become ready")
+                time.sleep(0.005)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+    return result
+
+
+def summarize(values: List[float]) -> dict:
+    return {
+        "median": round(statistics.median(values), 4),
+        "max": round(max(values), 4),
+        "min": round(min(values), 4),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="AI Service cold start benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget", type=float, default=2.0, help="seconds, median import of src.main")
+    parser.add_argument("--health-budget", type=float, default=3.0, help="seconds, median time to first /health")
+    parser.add_argument("--ready-budget", type=float, default=float(os.getenv("STARTUP_BUDGET_SECONDS", "10")),
+                        help="seconds, median time to /ready")
+    parser.add_argument("--output", help="write JSON results to this file")
+    args = parser.parse_args(argv)
+
+    imports = [measure_import() for _ in range(args.runs)]
+    servers = [measure_server() for _ in range(args.runs)]
+    results = {
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "runs": args.runs,
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "import_s": summarize([r["seconds"] for r in imports]),
+        "numpy_imported_eagerly": any(r["numpy_imported"] for r in imports),
+        "health_s": summarize([r["health"] for r in servers]),
+        "ready_s": summarize([r["ready"] for r in servers]),
+        "budgets_s": {"import": args.import_budget, "health": args.health_budget, "ready": args.ready_budget},
+    }
+
+    print(f"{'phase':<10}{'median s':>10}{'max s':>10}{'budget s':>10}")
+    violations = []
+    for phase in ("import", "health", "ready"):
+        stats = results[f"{phase}_s"]
+        budget = results["budgets_s"][phase]
+        print(f"{phase:<10}{stats['median']:>10}{stats['max']:>10}{budget:>10}")
+        if stats["median"] > budget:
+            violations.append(f"{phase}: median {stats['median']}s > budget {budget}s")
+    if results["numpy_imported_eagerly"]:
+        violations.append("import: numpy is imported by src.main, model libraries must load during warm-up")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Results saved to {args.output}")
+
+    if violations:
+        print("Startup budget exceeded:")
+        for line in violations:
+            print(f"  - {line}")
+        return 1
+    print("Startup within budget")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
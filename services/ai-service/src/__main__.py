@@ -0,0 +1,41 @@
+"""
+Запуск сервиса: python -m src
+
+Отдельный тонкий модуль входа нужен пулу инференса (INFERENCE_MODE=process):
+процессы пула стартуют через spawn и заново импортируют __main__ родителя.
+Модуль __main__ пакета multiprocessing не импортирует, поэтому процессы пула
+загружают только модули моделей, а не src.main с FastAPI, логированием в файл,
+кэшами и ограничителем частоты.
+"""
+
+import os
+
+
+def main() -> None:
+    import uvicorn
+
+    from src.main import app, logger
+
+    logger.info("🚀 AI Service запущен")
+    logger.info("📱 Device ID tracking: включен")
+    logger.info("🤖 Рекомендации: /recommendations")
+    logger.info("💰 Прогноз цен: /price-prediction")
+    logger.info("🏗️ Смета строительства: /construction-estimate")
+    logger.info("📊 Анализ рынка: /market-analysis")
+    logger.info("📚 Документация: /docs")
+
+    # Production-запуск без --reload. Несколько воркеров uvicorn дублируют модели
+    # в каждом процессе, поэтому для многоядерного инференса рекомендуется
+    # один воркер API и INFERENCE_MODE=process
+    workers = int(os.getenv("UVICORN_WORKERS", "1"))
+    uvicorn.run(
+        "src.main:app" if workers > 1 else app,
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "3005")),
+        workers=workers,
+        log_level="info"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+Синхронизация каталога событиями catalog-service.
+
+Изменения товаров (Product), цен и остатков (WarehouseProduct) приходят
+событиями с возрастающим sequence - вебхуком POST /catalog/events или
+строками NDJSON-файла, который сервис читает сам (заглушка очереди).
+Событие несет полное новое состояние записи, поэтому повторное применение
+безопасно, а дубликаты отсекаются по sequence.
+
+Примененные события дописываются в журнал (NDJSON). После рестарта или
+подмены версии моделей события журнала новее снимка каталога применяются
+к индексам заново, а источник продолжает отправку с last_sequence + 1.
+Процессы пула инференса читают тот же журнал и догоняют главный процесс
+перед каждой задачей.
+
+Журнал периодически сжимается (fold_events): события товара и события цены
+и остатка одного предложения сливаются до нескольких на запись. Итоговое
+состояние индексов при повторном применении то же, а размер журнала
+ограничен числом товаров и предложений. Сжатый журнал атомарно подменяет
+старый файл, поэтому читатели журнала следят за его inode (read_journal).
+
+Формат события:
+    {"sequence": 42, "type": "product", "product": {...запись Product...}}
+    {"sequence": 43, "type": "price", "product_id": "...", "warehouse_id": "...", "unit_price": 950.0}
+    {"sequence": 44, "type": "stock", "product_id": "...", "warehouse_id": "...", "available": 120}
+"""
+
+import json
+import math
+import os
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from src.estimator import ConstructionEstimator
+    from src.market import MarketAnalytics
+    from src.recommender import CatalogUpdate, RecommendationIndex
+
+EVENT_TYPES = ("product", "price", "stock")
+# Журнал сжимается, когда в нем больше max(COMPACT_MIN_EVENTS, 2 x событий после прошлого сжатия)
+COMPACT_MIN_EVENTS = 10000
+# Поля товара, которые событие без них не меняет (название, вес)
+STICKY_PRODUCT_FIELDS = ("name", "weight")
+
+
+class JournalPosition(NamedTuple):
+    """Позиция читателя в журнале: файл (inode) и смещение в нем"""
+    inode: int = 0
+    offset: int = 0
+
+
+def _parse_events(data: bytes) -> List[dict]:
+    events = []
+    for line in data.splitlines():
+        try:
+            event = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(event, dict) and isinstance(event.get("sequence"), int) and event.get("type") in EVENT_TYPES:
+            events.append(event)
+    return events
+
+
+def read_events(path: str, offset: int = 0) -> Tuple[List[dict], int]:
+    """
+    События NDJSON-файла начиная с байта offset и смещение после последней полной строки.
+
+    Недописанная последняя строка остается до следующего чтения, строки с
+    ошибками разбора пропускаются. Файла нет или он стал короче (ротация) -
+    чтение с начала.
+    """
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return [], 0
+    if size < offset:
+        offset = 0
+    if size == offset:
+        return [], offset
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(size - offset)
+    end = data.rfind(b"\n") + 1
+    return _parse_events(data[:end]), offset + end
+
+
+def read_journal(path: str, position: JournalPosition = JournalPosition()) -> Tuple[List[dict], JournalPosition]:
+    """
+    Новые события журнала после позиции position.
+
+    Если файл подменен сжатием (другой inode), он читается с начала: уже
+    примененные события отсекаются по sequence при применении.
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return [], JournalPosition()
+    with f:
+        stat = os.fstat(f.fileno())
+        offset = position.offset if stat.st_ino == position.inode and stat.st_size >= position.offset else 0
+        f.seek(offset)
+        data = f.read(stat.st_size - offset)
+    end = data.rfind(b"\n") + 1
+    return _parse_events(data[:end]), JournalPosition(stat.st_ino, offset + end)
+
+
+def _carries(product: dict, field: str) -> bool:
+    return product.get(field) not in (None, "")
+
+
+def fold_events(events: Sequence[dict]) -> List[dict]:
+    """
+    Сжимает события так, что их применение дает то же состояние индексов.
+
+    Результат не должен зависеть от состояния, к которому журнал применяется
+    (снимок версии моделей), поэтому сжатие повторяет правила
+    RecommendationIndex.apply_events:
+
+    - событие товара заменяет запись целиком, кроме полей STICKY_PRODUCT_FIELDS:
+      без них прежние значения остаются. От товара остаются последнее событие
+      и последние события, несущие каждое из этих полей;
+    - событие предложения без цены применяется, только если предложение уже
+      есть. Такие события до первой цены сливаются отдельно (последний
+      остаток), события с первой цены - в одно с последними ценой и остатком.
+
+    Слитое событие получает sequence последнего из исходных.
+    """
+    products: Dict[str, Dict[str, dict]] = {}
+    offers: Dict[tuple, List[dict]] = {}
+    folded: List[dict] = []
+    for event in events:
+        if event["type"] == "product":
+            product = event.get("product") or {}
+            product_id = event.get("product_id") or product.get("id")
+            if not product_id:
+                folded.append(event)
+                continue
+            kept = products.setdefault(product_id, {})
+            kept["last"] = event
+            for field in STICKY_PRODUCT_FIELDS:
+                if _carries(product, field):
+                    kept[field] = event
+            continue
+        # [события до первой цены, события с первой цены]
+        pair = offers.setdefault((event.get("product_id"), event.get("warehouse_id")), [None, None])
+        part = 0 if pair[1] is None and event.get("unit_price") is None else 1
+        pair[part] = _merge_offer(pair[part], event)
+    for kept in products.values():
+        folded.extend({id(e): e for e in kept.values()}.values())
+    for pair in offers.values():
+        folded.extend(e for e in pair if e is not None)
+    return sorted(folded, key=lambda e: e["sequence"])
+
+
+def _merge_offer(merged: Optional[dict], event: dict) -> dict:
+    merged = dict(merged or {})
+    merged.update({field: value for field, value in event.items() if value is not None})
+    return merged
+
+
+class CatalogEventLog:
+    """Журнал примененных событий каталога (дописывание и периодическое сжатие)"""
+
+    def __init__(self, path: str, compact_min_events: int = COMPACT_MIN_EVENTS):
+        self.path = path
+        self.compact_min_events = compact_min_events
+        self.last_sequence = 0
+        self.events = 0
+        self.compacted_events = 0
+        self.compactions = 0
+
+    def read(self) -> List[dict]:
+        """Все события журнала; заодно восстанавливает last_sequence после рестарта"""
+        events, _ = read_events(self.path)
+        self.events = len(events)
+        self.last_sequence = max([self.last_sequence] + [e["sequence"] for e in events])
+        return events
+
+    def fresh(self, events: Sequence[dict]) -> List[dict]:
+        """Новые события пачки по возрастанию sequence, без уже примененных и повторов"""
+        unique = {e["sequence"]: e for e in events if e["sequence"] > self.last_sequence}
+        return [unique[sequence] for sequence in sorted(unique)]
+
+    def append(self, events: Sequence[dict]) -> None:
+        """Дописывает события и сбрасывает их на диск до применения к индексам"""
+        if not events:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        data = "".join(json.dumps(e, ensure_ascii=False, separators=(",", ":")) + "\n" for e in events)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.events += len(events)
+        self.last_sequence = max(self.last_sequence, events[-1]["sequence"])
+
+    def needs_compaction(self) -> bool:
+        return self.compact_min_events > 0 and self.events > max(self.compact_min_events, 2 * self.compacted_events)
+
+    def compact(self) -> int:
+        """
+        Переписывает журнал сжатыми событиями (fold_events), возвращает их число.
+
+        Вызывается после применения событий и без параллельных append: новый
+        файл сбрасывается на диск и атомарно подменяет старый.
+        """
+        events, _ = read_events(self.path)
+        folded = fold_events(events)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("".join(json.dumps(e, ensure_ascii=False, separators=(",", ":")) + "\n" for e in folded))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.events = self.compacted_events = len(folded)
+        self.compactions += 1
+        return len(folded)
+
+
+def apply_events(
+    index: "RecommendationIndex",
+    estimator: "ConstructionEstimator",
+    events: Sequence[dict],
+    market: Optional["MarketAnalytics"] = None,
+) -> "CatalogUpdate":
+    """Применяет события к индексу рекомендаций, ценам смет и (опционально) аналитике рынка"""
+    update = index.apply_events(events)
+    if not update.products:
+        return update
+    # Цена материала сметы - минимальная цена товара среди складов с остатком;
+    # обновление цен меняет prices_version и ключи кэша смет
+    materials = set(estimator.material_product_ids)
+    if materials.intersection(update.products):
+        prices = {}
+        for product_id in update.products:
+            price = float(index.price[index.product_positions[product_id]])
+            if product_id in materials and math.isfinite(price):
+                prices[product_id] = price
+        estimator.update_prices(prices)
+    if market is not None:
+        market.apply_events(
+            {"type": "stock", "product_id": product_id, "available": float(index.stock[index.product_positions[product_id]])}
+            for product_id in update.products
+        )
+    return update
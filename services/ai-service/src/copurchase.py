@@ -0,0 +1,193 @@
+"""
+Матрица совместных покупок товаров.
+
+Элемент (i, j) - число заказов, в которых товары i и j куплены вместе,
+диагональ - число заказов с товаром. Матрица строится по истории заказов
+инкрементально, пачками строк заказов: память зависит от числа различных пар
+товаров, а не от длины истории.
+
+Для ответа "с этим товаром покупают" у каждого товара заранее отобраны top-k
+соседей (CSR по строкам, соседи отсортированы по убыванию скора), поэтому
+запрос по одному товару - срез массива, а по корзине - сложение нескольких
+коротких срезов.
+"""
+
+import json
+import os
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+
+# Соседей на товар и минимум совместных заказов для пары
+DEFAULT_TOP_K = 20
+DEFAULT_MIN_COUNT = 2
+
+NEIGHBOR_FIELDS = ("indptr", "indices", "scores", "support")
+
+
+class CoPurchaseMatrix:
+    """Разреженная матрица совместных покупок N x N (CSR) и top-k соседей товаров"""
+
+    def __init__(self, product_ids: Sequence[str], counts: sparse.csr_matrix, orders: int = 0):
+        self.product_ids: List[str] = list(product_ids)
+        self.positions = {pid: i for i, pid in enumerate(self.product_ids)}
+        self.counts = counts
+        self.orders = orders
+        self.top_k = 0
+        self.min_count = DEFAULT_MIN_COUNT
+        # Соседи товара i: indices[indptr[i]:indptr[i + 1]], по убыванию scores
+        self.indptr = np.zeros(len(self.product_ids) + 1, dtype=np.int64)
+        self.indices = np.empty(0, dtype=np.int32)
+        self.scores = np.empty(0, dtype=np.float32)
+        self.support = np.empty(0, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.product_ids)
+
+    def materialize(self, top_k: int = DEFAULT_TOP_K, min_count: int = DEFAULT_MIN_COUNT) -> None:
+        """
+        Отбирает top_k соседей каждого товара.
+
+        Скор пары - доля заказов товара i, в которых куплен и j (c_ij / c_ii),
+        при равенстве выше пара с большим числом совместных заказов.
+        Пары реже min_count заказов не учитываются.
+        """
+        counts = self.counts.tocoo()
+        rows, cols, support = counts.row, counts.col, counts.data.astype(np.int64)
+        diagonal = self.counts.diagonal().astype(np.float64)
+        keep = (rows != cols) & (support >= min_count)
+        rows, cols, support = rows[keep], cols[keep], support[keep]
+        scores = support / np.maximum(diagonal[rows], 1.0)
+
+        order = np.lexsort((cols, -support, -scores, rows))
+        rows, cols, support, scores = rows[order], cols[order], support[order], scores[order]
+        # Ранг соседа внутри строки: позиция минус начало строки
+        starts = np.searchsorted(rows, np.arange(len(self.product_ids)))
+        rank = np.arange(len(rows)) - starts[rows]
+        keep = rank < top_k
+        rows, cols, support, scores = rows[keep], cols[keep], support[keep], scores[keep]
+
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(self.product_ids)))]).astype(np.int64)
+        self.indices = cols.astype(np.int32)
+        self.scores = scores.astype(np.float32)
+        self.support = support.astype(np.int32)
+        self.top_k, self.min_count = top_k, min_count
+
+    def neighbors(self, position: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Соседи товара и их скоры (срезы без копирования)"""
+        start, end = self.indptr[position], self.indptr[position + 1]
+        return self.indices[start:end], self.scores[start:end]
+
+    def complements(
+        self, positions: Sequence[int], limit: int, available: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Дополняющие товары для набора товаров (корзины).
+
+        Скор кандидата - среднее по товарам набора (для товара вне списка его
+        соседей - 0), товары самого набора исключаются. available - маска
+        товаров, которые можно предлагать (например, в наличии).
+        """
+        positions = np.unique(np.asarray(positions, dtype=np.int64))
+        if not len(positions):
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        if len(positions) == 1:
+            indices, scores = self.neighbors(int(positions[0]))
+            if available is not None:
+                keep = available[indices]
+                indices, scores = indices[keep], scores[keep]
+            return indices[:limit], scores[:limit]
+        parts = [self.neighbors(int(p)) for p in positions]
+        indices = np.concatenate([p[0] for p in parts])
+        scores = np.concatenate([p[1] for p in parts])
+        candidates, inverse = np.unique(indices, return_inverse=True)
+        totals = np.bincount(inverse, weights=scores) / len(positions)
+        keep = ~np.isin(candidates, positions)
+        if available is not None:
+            keep &= available[candidates]
+        candidates, totals = candidates[keep], totals[keep]
+        top = np.lexsort((candidates, -totals))[:limit]
+        return candidates[top], totals[top].astype(np.float32)
+
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        for part in ("data", "indices", "indptr"):
+            np.save(os.path.join(directory, f"counts.{part}.npy"), getattr(self.counts, part))
+        for name in NEIGHBOR_FIELDS:
+            np.save(os.path.join(directory, f"neighbors.{name}.npy"), getattr(self, name))
+        meta = {"product_ids": self.product_ids, "orders": self.orders, "top_k": self.top_k, "min_count": self.min_count}
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory: str, mmap_mode: Optional[str] = "r") -> "CoPurchaseMatrix":
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        n = len(meta["product_ids"])
+        parts = [np.load(os.path.join(directory, f"counts.{part}.npy"), mmap_mode=mmap_mode) for part in ("data", "indices", "indptr")]
+        matrix = cls(meta["product_ids"], sparse.csr_matrix(tuple(parts), shape=(n, n), copy=False), meta["orders"])
+        for name in NEIGHBOR_FIELDS:
+            setattr(matrix, name, np.load(os.path.join(directory, f"neighbors.{name}.npy"), mmap_mode=mmap_mode))
+        matrix.top_k, matrix.min_count = meta["top_k"], meta["min_count"]
+        return matrix
+
+
+class CoPurchaseBuilder:
+    """
+    Инкрементальное построение матрицы по пачкам строк заказов.
+
+    Строки одного заказа должны идти подряд (выгрузка упорядочена по заказу),
+    но могут попасть в соседние пачки: строки последнего заказа пачки
+    откладываются до следующей.
+    """
+
+    def __init__(self, product_ids: Sequence[str]):
+        self.product_ids = list(product_ids)
+        n = len(self.product_ids)
+        self.counts = sparse.csr_matrix((n, n), dtype=np.int64)
+        self.orders = 0
+        self._pending_orders = np.empty(0, dtype=object)
+        self._pending_items = np.empty(0, dtype=np.int64)
+
+    def add_chunk(self, order_ids: np.ndarray, items: np.ndarray) -> None:
+        """order_ids - ключи заказов строк, items - позиции товаров (-1 для неизвестных)"""
+        order_ids = np.concatenate([self._pending_orders, np.asarray(order_ids, dtype=object)])
+        items = np.concatenate([self._pending_items, np.asarray(items, dtype=np.int64)])
+        if not len(order_ids):
+            return
+        # Последний заказ пачки может продолжиться в следующей
+        last = order_ids[-1]
+        tail = len(order_ids)
+        while tail > 0 and order_ids[tail - 1] == last:
+            tail -= 1
+        self._pending_orders, self._pending_items = order_ids[tail:], items[tail:]
+        self._add_baskets(order_ids[:tail], items[:tail])
+
+    def finish(self, top_k: int = DEFAULT_TOP_K, min_count: int = DEFAULT_MIN_COUNT) -> CoPurchaseMatrix:
+        self._add_baskets(self._pending_orders, self._pending_items)
+        self._pending_orders = np.empty(0, dtype=object)
+        self._pending_items = np.empty(0, dtype=np.int64)
+        matrix = CoPurchaseMatrix(self.product_ids, self.counts.tocsr().astype(np.int32), self.orders)
+        matrix.materialize(top_k, min_count)
+        return matrix
+
+    def _add_baskets(self, order_ids: np.ndarray, items: np.ndarray) -> None:
+        if not len(order_ids):
+            return
+        # Номер корзины меняется на границе заказа (строки заказа идут подряд)
+        boundary = np.ones(len(order_ids), dtype=bool)
+        boundary[1:] = order_ids[1:] != order_ids[:-1]
+        baskets = np.cumsum(boundary) - 1
+        n_baskets = int(baskets[-1]) + 1
+        known = items >= 0
+        incidence = sparse.csr_matrix(
+            (np.ones(int(known.sum()), dtype=np.int64), (baskets[known], items[known])),
+            shape=(n_baskets, len(self.product_ids))
+        )
+        # Повтор товара в заказе считается одной покупкой
+        incidence.sum_duplicates()
+        incidence.data[:] = 1
+        self.counts = self.counts + (incidence.T @ incidence).tocsr()
+        self.orders += n_baskets
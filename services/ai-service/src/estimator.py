@@ -0,0 +1,318 @@
+"""
+Расчет смет строительства по нормам расхода.
+
+Таблицы норм (расход материалов на м² по типу проекта, ставки работ,
+коэффициенты сложности) один раз при старте загружаются в компактные
+массивы NumPy. Смета считается поиском индексов и поэлементным умножением,
+цены материалов берутся из кэшированного снимка цен каталога. С адресом
+объекта цены берутся на ближайших складах с остатком и добавляется доставка.
+
+Неопределенность сметы оценивается Monte Carlo: колебания цен материалов до
+закупки, отклонение расхода от нормы (отходы) и производительность бригады
+разыгрываются сразу для тысяч сценариев массивами NumPy, по ним считаются
+квантили P10/P50/P90 стоимости и сроков.
+"""
+
+import json
+import math
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.geo import DEFAULT_RATE_PER_TON_KM, WarehouseIndex, delivery_cost
+
+
+# Параметры неопределенности, если в нормах нет блока uncertainty (или поля материала)
+DEFAULT_UNCERTAINTY = {
+    "price_volatility": 0.08,         # σ логарифма цены материала до закупки
+    "waste": [-0.02, 0.0, 0.10],      # отклонение расхода от нормы: треугольное (мин, мода, макс)
+    "productivity_volatility": 0.15,  # σ логарифма производительности бригады
+}
+# Сценарии разыгрываются блоками, между блоками проверяется бюджет времени
+SIMULATION_CHUNK = 4096
+QUANTILES = (0.1, 0.5, 0.9)
+
+Band = Tuple[float, float, float]
+
+
+class EstimateError(ValueError):
+    """Некорректные параметры сметы (неизвестный тип проекта, сложность, площадь)"""
+
+
+@dataclass(frozen=True)
+class Estimate:
+    total_estimate: float
+    materials_breakdown: List[dict]
+    labor_estimate: float
+    timeline_days: int
+    delivery_estimate: Optional[float] = None
+
+
+@dataclass(frozen=True)
+class EstimateBands:
+    """Квантили P10/P50/P90 по сценариям Monte Carlo"""
+    draws: int
+    truncated: bool  # бюджет времени исчерпан раньше, чем разыграны все сценарии
+    total_estimate: Band
+    materials_estimate: Band
+    labor_estimate: Band
+    timeline_days: Tuple[int, int, int]
+
+
+def load_norms(path: str) -> dict:
+    """Загружает таблицы норм расхода (JSON)"""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def catalog_prices(catalog: dict) -> Dict[str, float]:
+    """Снимок цен каталога: минимальная цена товара среди складов с остатком"""
+    prices: Dict[str, float] = {}
+    for product in catalog.get("products", []):
+        offers = [float(w["unitPrice"]) for w in product.get("warehouses", []) if w.get("available", 0) > 0]
+        if offers:
+            prices[product["id"]] = min(offers)
+    return prices
+
+
+class ConstructionEstimator:
+    """Нормативный калькулятор смет на предвычисленных массивах"""
+
+    def __init__(self, norms: dict, prices: Optional[Dict[str, float]] = None):
+        materials = norms["materials"]
+        project_types = norms["project_types"]
+        complexity = norms["complexity"]
+
+        self.material_names: List[str] = [m["name"] for m in materials]
+        self.material_units: List[str] = [m["unit"] for m in materials]
+        self.material_product_ids: List[Optional[str]] = [m.get("product_id") for m in materials]
+        self.integral = np.array([m.get("integral", False) for m in materials], dtype=bool)
+        self.default_prices = np.array([m["default_price"] for m in materials], dtype=np.float64)
+        material_pos = {m["key"]: i for i, m in enumerate(materials)}
+        self._material_lookup = self._aliases(materials)
+
+        # Расход на м² площади: P x M
+        self.consumption = np.zeros((len(project_types), len(materials)), dtype=np.float64)
+        for p, project in enumerate(project_types):
+            for key, rate in project["consumption"].items():
+                self.consumption[p, material_pos[key]] = rate
+        self.labor_rate = np.array([p["labor_rate"] for p in project_types], dtype=np.float64)
+        self.days_per_m2 = np.array([p["days_per_m2"] for p in project_types], dtype=np.float64)
+        self.min_days = np.array([p["min_days"] for p in project_types], dtype=np.float64)
+        self._project_lookup = self._aliases(project_types)
+        self.project_type_names: List[str] = [p["name"] for p in project_types]
+
+        self.material_factor = np.array([c["material_factor"] for c in complexity], dtype=np.float64)
+        self.labor_factor = np.array([c["labor_factor"] for c in complexity], dtype=np.float64)
+        self._complexity_lookup = self._aliases(complexity)
+        self.complexity_names: List[str] = [c["aliases"][0] for c in complexity]
+
+        uncertainty = {**DEFAULT_UNCERTAINTY, **norms.get("uncertainty", {})}
+        self.price_volatility = np.array(
+            [m.get("price_volatility", uncertainty["price_volatility"]) for m in materials], dtype=np.float64
+        )
+        # M x 3: минимум, мода и максимум отклонения расхода
+        self.waste = np.array([m.get("waste", uncertainty["waste"]) for m in materials], dtype=np.float64)
+        self.productivity_volatility = float(uncertainty["productivity_volatility"])
+
+        self.unit_prices = self.default_prices.copy()
+        self.prices_version = 0
+        self.update_prices(prices or {})
+
+    @staticmethod
+    def _aliases(rows: Sequence[dict]) -> Dict[str, int]:
+        lookup: Dict[str, int] = {}
+        for i, row in enumerate(rows):
+            for alias in [row["key"], row.get("name", "")] + list(row.get("aliases", [])):
+                if alias:
+                    lookup[alias.lower()] = i
+        return lookup
+
+    def update_prices(self, prices: Dict[str, float]) -> None:
+        """Подменяет снимок цен: новый массив собирается целиком и заменяется атомарно"""
+        unit_prices = self.unit_prices.copy()
+        for i, product_id in enumerate(self.material_product_ids):
+            if product_id in prices:
+                unit_prices[i] = prices[product_id]
+        self.unit_prices = unit_prices
+        self.prices_version += 1
+
+    def local_offers(
+        self,
+        geo: WarehouseIndex,
+        product_positions: Dict[str, int],
+        latitude: float,
+        longitude: float,
+        rate_per_ton_km: float = DEFAULT_RATE_PER_TON_KM,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Цены материалов на ближайших к объекту складах с остатком и доставка единицы.
+
+        Просматриваются только склады с предложениями товаров материалов. Для
+        материала без предложений остается цена снимка и доставка не считается.
+        """
+        positions = np.array(
+            [product_positions.get(pid, -1) if pid else -1 for pid in self.material_product_ids], dtype=np.int64
+        )
+        warehouse, distance, price = geo.product_offers(positions, latitude, longitude)
+        found = warehouse >= 0
+        weight = np.where(positions >= 0, geo.weight[np.maximum(positions, 0)], 0.0)
+        unit_prices = np.where(found, np.round(price.astype(np.float64), 2), self.unit_prices)
+        delivery = np.where(found, delivery_cost(weight, np.nan_to_num(distance), rate_per_ton_km), 0.0)
+        return unit_prices.astype(np.float64), delivery.astype(np.float64)
+
+    def _material_mask(self, materials: Sequence[str]) -> np.ndarray:
+        # Пустой список означает все материалы, предусмотренные нормами
+        if not materials:
+            return np.ones(len(self.material_names), dtype=bool)
+        mask = np.zeros(len(self.material_names), dtype=bool)
+        unknown = []
+        for material in materials:
+            pos = self._material_lookup.get(material.strip().lower())
+            if pos is None:
+                unknown.append(material)
+            else:
+                mask[pos] = True
+        if unknown:
+            raise EstimateError(
+                f"Неизвестные материалы: {', '.join(unknown)}. Доступные: {', '.join(self.material_names)}"
+            )
+        return mask
+
+    def estimate(
+        self,
+        project_type: str,
+        area: float,
+        materials: Sequence[str],
+        complexity: str,
+        unit_prices: Optional[np.ndarray] = None,
+        delivery_per_unit: Optional[np.ndarray] = None,
+    ) -> Estimate:
+        """Смета; unit_prices и delivery_per_unit - цены и доставка материалов из local_offers"""
+        p, c = self._resolve(project_type, complexity, area)
+        if unit_prices is None:
+            unit_prices = self.unit_prices
+        quantity = self.consumption[p] * (area * self.material_factor[c])
+        quantity = np.where(self.integral, np.ceil(quantity), np.round(quantity, 2))
+        cost = quantity * unit_prices
+        selected = np.flatnonzero(self._material_mask(materials) & (quantity > 0))
+
+        labor = float(self.labor_rate[p] * area * self.labor_factor[c])
+        timeline = max(self.min_days[p], self.days_per_m2[p] * area * self.labor_factor[c])
+        materials_total = float(cost[selected].sum())
+        delivery = quantity * delivery_per_unit if delivery_per_unit is not None else None
+        delivery_total = float(delivery[selected].sum()) if delivery is not None else 0.0
+
+        breakdown = [
+            {
+                "material": self.material_names[i],
+                "quantity": int(quantity[i]) if self.integral[i] else float(quantity[i]),
+                "unit": self.material_units[i],
+                "unit_price": float(unit_prices[i]),
+                "cost": round(float(cost[i]), 2),
+            }
+            for i in selected
+        ]
+        if delivery is not None:
+            for item, i in zip(breakdown, selected):
+                item["delivery_cost"] = round(float(delivery[i]), 2)
+        return Estimate(
+            total_estimate=round(materials_total + delivery_total + labor, 2),
+            materials_breakdown=breakdown,
+            labor_estimate=round(labor, 2),
+            timeline_days=int(math.ceil(timeline)),
+            delivery_estimate=round(delivery_total, 2) if delivery is not None else None,
+        )
+
+    def simulate(
+        self,
+        project_type: str,
+        area: float,
+        materials: Sequence[str],
+        complexity: str,
+        draws: int,
+        seed: int,
+        unit_prices: Optional[np.ndarray] = None,
+        delivery_per_unit: Optional[np.ndarray] = None,
+        budget_seconds: Optional[float] = None,
+    ) -> EstimateBands:
+        """
+        Квантили стоимости и сроков по draws сценариям Monte Carlo.
+
+        В каждом сценарии цена материала - текущая цена с логнормальным
+        множителем (медиана - текущая цена), расход - норма с треугольным
+        отклонением, производительность бригады - логнормальный множитель
+        трудозатрат и срока. Генератор с seed разыгрывает блоки по порядку,
+        поэтому полный результат воспроизводим. При исчерпании budget_seconds
+        квантили считаются по уже разыгранным блокам (первый блок - всегда):
+        их число зависит от времени, и такой результат (truncated) не
+        воспроизводим.
+        """
+        p, c = self._resolve(project_type, complexity, area)
+        if unit_prices is None:
+            unit_prices = self.unit_prices
+        norm = self.consumption[p] * (area * self.material_factor[c])
+        selected = np.flatnonzero(self._material_mask(materials) & (norm > 0))
+        norm, integral = norm[selected], self.integral[selected]
+        prices = np.asarray(unit_prices, dtype=np.float64)[selected]
+        delivery = delivery_per_unit[selected] if delivery_per_unit is not None else np.zeros(len(selected))
+        volatility = self.price_volatility[selected]
+        low, mode, high = self.waste[selected].T
+        width = high - low
+        peak = np.divide(mode - low, width, out=np.zeros_like(width), where=width > 0)
+
+        labor = self.labor_rate[p] * area * self.labor_factor[c]
+        days = self.days_per_m2[p] * area * self.labor_factor[c]
+
+        rng = np.random.default_rng(seed)
+        started = time.perf_counter()
+        results = np.empty((3, draws), dtype=np.float64)  # материалы с доставкой, работы, дни
+        done = 0
+        while done < draws:
+            n = min(SIMULATION_CHUNK, draws - done)
+            # Отклонение расхода: обратная функция треугольного распределения
+            u = rng.random((n, len(selected)))
+            waste = np.where(
+                u < peak,
+                low + np.sqrt(u * width * (mode - low)),
+                high - np.sqrt((1.0 - u) * width * (high - mode)),
+            )
+            quantity = norm * (1.0 + waste)
+            quantity = np.where(integral, np.ceil(quantity), np.round(quantity, 2))
+            price = prices * np.exp(volatility * rng.standard_normal((n, len(selected))))
+            productivity = np.exp(self.productivity_volatility * rng.standard_normal(n))
+            results[0, done:done + n] = (quantity * (price + delivery)).sum(axis=1)
+            results[1, done:done + n] = labor * productivity
+            results[2, done:done + n] = np.maximum(self.min_days[p], days * productivity)
+            done += n
+            if budget_seconds is not None and time.perf_counter() - started > budget_seconds:
+                break
+
+        results = results[:, :done]
+        bands = np.quantile(np.vstack([results[0] + results[1], results]), QUANTILES, axis=1).T
+        return EstimateBands(
+            draws=done,
+            truncated=done < draws,
+            total_estimate=tuple(round(float(v), 2) for v in bands[0]),
+            materials_estimate=tuple(round(float(v), 2) for v in bands[1]),
+            labor_estimate=tuple(round(float(v), 2) for v in bands[2]),
+            timeline_days=tuple(int(math.ceil(v)) for v in bands[3]),
+        )
+
+    def _resolve(self, project_type: str, complexity: str, area: float) -> Tuple[int, int]:
+        p = self._project_lookup.get(project_type.strip().lower())
+        if p is None:
+            raise EstimateError(
+                f"Неизвестный тип проекта: {project_type}. Доступные: {', '.join(self.project_type_names)}"
+            )
+        c = self._complexity_lookup.get(complexity.strip().lower())
+        if c is None:
+            raise EstimateError(
+                f"Неизвестная сложность: {complexity}. Доступные: {', '.join(self.complexity_names)}"
+            )
+        # JSON допускает Infinity и NaN: такая площадь дошла бы до int() сроков
+        if not math.isfinite(area) or area <= 0:
+            raise EstimateError("Площадь должна быть конечным числом больше нуля")
+        return p, c
@@ -0,0 +1,334 @@
+"""
+Прогнозирование цен по истории.
+
+Модель - линейная регрессия с экспоненциально затухающими весами (свежие точки
+важнее старых), считается в NumPy в замкнутом виде сразу для матрицы историй
+(B x T с маской), одиночный прогноз - пачка из одной строки. Тренд определяется
+по относительному наклону; экстраполяция падающего тренда не уходит ниже нуля.
+Подобранные параметры кэшируются по product_id в ограниченном LRU, ключом
+служит хеш истории: повторный опрос того же товара с той же историей не
+вызывает переобучения.
+"""
+
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Коэффициент затухания весов: вес точки t равен DECAY ** (n - 1 - t)
+DECAY = 0.9
+
+# Порог относительного наклона (доля среднего уровня за шаг) для тренда
+TREND_THRESHOLD = 0.005
+
+# Массивы обученной модели, сохраняемые в .npy для отображения в память (mmap)
+FORECAST_FIELDS = ("intercept", "slope", "level", "n", "confidence")
+
+# Поправки прогноза по рыночным данным запроса
+MARKET_ADJUSTMENTS: Dict[str, Dict[str, float]] = {
+    "demand": {"high": 0.02, "low": -0.02},
+    "supply": {"low": 0.02, "deficit": 0.03, "high": -0.02, "surplus": -0.03},
+}
+
+
+@dataclass(frozen=True)
+class ForecastParams:
+    """Параметры подобранной модели"""
+    intercept: float
+    slope: float
+    level: float
+    n: int
+    confidence: float
+    trend: str
+
+    def predict(self, horizon: int = 1) -> float:
+        """Прогноз на horizon шагов вперед после последней точки"""
+        return max(self.intercept + self.slope * (self.n - 1 + horizon), 0.0)
+
+
+def trend_labels(slope: np.ndarray, level: np.ndarray) -> np.ndarray:
+    """Тренд по наклону относительно среднего уровня: increasing, decreasing или stable"""
+    slope = np.asarray(slope, dtype=np.float64)
+    level = np.abs(np.asarray(level, dtype=np.float64))
+    relative = np.divide(slope, level, out=np.zeros_like(slope), where=level > 0)
+    labels = np.full(relative.shape, "stable", dtype=object)
+    labels[relative > TREND_THRESHOLD] = "increasing"
+    labels[relative < -TREND_THRESHOLD] = "decreasing"
+    return labels
+
+
+def pad_flat(flat: np.ndarray, lengths: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Раскладывает склеенные истории (flat + длины) в матрицу B x T и маску заполненных точек"""
+    lengths = np.asarray(lengths, dtype=np.int64)
+    width = int(lengths.max()) if lengths.size else 0
+    mask = np.arange(width)[None, :] < lengths[:, None]
+    values = np.zeros((lengths.size, width), dtype=np.float64)
+    values[mask] = np.asarray(flat, dtype=np.float64)
+    return values, mask
+
+
+def pad_histories(histories: Sequence[Sequence[float]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Упаковывает рваный список историй в матрицу B x T и маску заполненных точек.
+
+    Пропуски (NaN, бесконечности) исключаются так же, как при загрузке файла
+    (finite_histories).
+    """
+    lengths = np.fromiter((len(h) for h in histories), dtype=np.int64, count=len(histories))
+    if not lengths.sum():
+        return pad_flat(np.empty(0), lengths)
+    return finite_histories(*pad_flat(np.concatenate([np.asarray(h, dtype=np.float64) for h in histories]), lengths))
+
+
+def left_align(values: np.ndarray, mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Сдвигает заполненные точки каждой строки к левому краю с сохранением порядка (как ждет fit_batch)"""
+    if mask.size == 0 or not (mask[:, 1:] & ~mask[:, :-1]).any():
+        return values, mask
+    order = np.argsort(~mask, axis=1, kind="stable")
+    return np.take_along_axis(values, order, axis=1), np.take_along_axis(mask, order, axis=1)
+
+
+def finite_histories(values: np.ndarray, mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Исключает из маски пропуски (NaN, бесконечности) и сдвигает оставшиеся точки к левому краю"""
+    return left_align(values, mask & np.isfinite(values))
+
+
+def load_histories_file(data: bytes, filename: str) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """
+    Читает истории цен из загруженного файла.
+
+    Поддерживаются NPZ (product_ids и values B x T с mask или lengths) и
+    Parquet/Arrow/Feather (колонки product_id и prices типа list<double>).
+    Для Parquet/Arrow нужен pyarrow. Пропуски исключаются из маски,
+    оставшиеся точки строки сдвигаются к левому краю (finite_histories).
+    """
+    product_ids, values, mask = _read_histories_file(data, filename)
+    return (product_ids, *finite_histories(values, mask))
+
+
+def _read_histories_file(data: bytes, filename: str) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    name = filename.lower()
+    if name.endswith(".npz"):
+        with np.load(io.BytesIO(data), allow_pickle=False) as archive:
+            product_ids = [str(p) for p in archive["product_ids"]]
+            values = np.asarray(archive["values"], dtype=np.float64)
+            if "mask" in archive:
+                mask = np.asarray(archive["mask"], dtype=bool)
+            elif "lengths" in archive:
+                mask = np.arange(values.shape[1])[None, :] < archive["lengths"][:, None]
+            else:
+                mask = np.isfinite(values)
+        return product_ids, values, mask
+
+    if name.endswith((".parquet", ".arrow", ".feather", ".ipc")):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            import pyarrow.feather as feather
+        except ImportError:
+            raise ValueError("pyarrow is required for Parquet/Arrow uploads")
+        if name.endswith(".parquet"):
+            table = pq.read_table(pa.BufferReader(data), columns=["product_id", "prices"])
+        else:
+            table = feather.read_table(pa.BufferReader(data), columns=["product_id", "prices"])
+        prices = table.column("prices").combine_chunks()
+        lengths = prices.value_lengths().fill_null(0).to_numpy(zero_copy_only=False)
+        values, mask = pad_flat(prices.flatten().to_numpy(zero_copy_only=False), lengths)
+        return table.column("product_id").to_pylist(), values, mask
+
+    raise ValueError(f"Unsupported file format: {filename}")
+
+
+@dataclass(frozen=True)
+class BatchForecast:
+    """Параметры моделей для пачки историй, по одному элементу массива на товар"""
+    intercept: np.ndarray
+    slope: np.ndarray
+    level: np.ndarray
+    n: np.ndarray
+    confidence: np.ndarray
+
+    def predict(self, horizon: int = 1) -> np.ndarray:
+        return np.maximum(self.intercept + self.slope * (self.n - 1 + horizon), 0.0)
+
+    def trends(self) -> np.ndarray:
+        return trend_labels(self.slope, self.level)
+
+
+def fit_batch(values: np.ndarray, mask: np.ndarray) -> BatchForecast:
+    """
+    Подбирает взвешенные регрессии сразу для всех строк матрицы B x T.
+
+    Истории выровнены по левому краю, mask отмечает заполненные точки.
+    Строки без точек получают нулевые параметры и нулевую уверенность.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    mask = np.asarray(mask, dtype=bool)
+    y = np.where(mask, values, 0.0)
+    n = mask.sum(axis=1)
+    t = np.broadcast_to(np.arange(values.shape[1], dtype=np.float64), values.shape)
+    # Степень затухания отсчитывается от последней точки каждой строки
+    w = np.where(mask, DECAY ** np.maximum(n[:, None] - 1 - t, 0), 0.0)
+    w_sum = w.sum(axis=1)
+    safe_sum = np.where(w_sum > 0, w_sum, 1.0)
+    t_mean = (w * t).sum(axis=1) / safe_sum
+    y_mean = (w * y).sum(axis=1) / safe_sum
+    dt = t - t_mean[:, None]
+    t_var = (w * dt ** 2).sum(axis=1)
+    cov = (w * dt * (y - y_mean[:, None])).sum(axis=1)
+    slope = np.divide(cov, t_var, out=np.zeros_like(cov), where=t_var > 0)
+    intercept = y_mean - slope * t_mean
+
+    # Уверенность падает с относительным разбросом остатков и растет с длиной истории
+    residuals = np.where(mask, y - (intercept[:, None] + slope[:, None] * t), 0.0)
+    spread = np.sqrt((w * residuals ** 2).sum(axis=1) / safe_sum)
+    abs_mean = np.abs(y_mean)
+    relative_spread = np.divide(spread, abs_mean, out=np.ones_like(spread), where=abs_mean > 0)
+    confidence = np.clip(1.0 - relative_spread, 0.0, 1.0) * n / (n + 2)
+
+    return BatchForecast(
+        intercept=intercept,
+        slope=slope,
+        level=y_mean,
+        n=n,
+        confidence=np.round(confidence, 4),
+    )
+
+
+def fit(prices: Sequence[float]) -> ForecastParams:
+    """Подбирает взвешенную линейную регрессию по истории цен"""
+    if len(prices) == 0:
+        raise ValueError("historical_prices is empty")
+    batch = fit_batch(*pad_histories([prices]))
+    return ForecastParams(
+        intercept=float(batch.intercept[0]),
+        slope=float(batch.slope[0]),
+        level=float(batch.level[0]),
+        n=int(batch.n[0]),
+        confidence=float(batch.confidence[0]),
+        trend=batch.trends()[0],
+    )
+
+
+class ForecastModel:
+    """
+    Обученные параметры прогноза по товарам (артефакт реестра моделей).
+
+    Параметры подбираются офлайн по истории цен и хранятся массивами по товарам,
+    сервис отвечает по ним без переобучения, когда клиент не передал историю.
+    """
+
+    def __init__(self, product_ids: Sequence[str], batch: BatchForecast):
+        self.product_ids: List[str] = list(product_ids)
+        self._positions = {product_id: i for i, product_id in enumerate(self.product_ids)}
+        for name in FORECAST_FIELDS:
+            setattr(self, name, getattr(batch, name))
+
+    @classmethod
+    def from_histories(cls, product_ids: Sequence[str], values: np.ndarray, mask: np.ndarray) -> "ForecastModel":
+        return cls(product_ids, fit_batch(values, mask))
+
+    def __len__(self) -> int:
+        return len(self.product_ids)
+
+    def get(self, product_id: str) -> Optional[ForecastParams]:
+        i = self._positions.get(product_id)
+        if i is None:
+            return None
+        return ForecastParams(
+            intercept=float(self.intercept[i]),
+            slope=float(self.slope[i]),
+            level=float(self.level[i]),
+            n=int(self.n[i]),
+            confidence=float(self.confidence[i]),
+            trend=trend_labels(self.slope[i:i + 1], self.level[i:i + 1])[0],
+        )
+
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        for name in FORECAST_FIELDS:
+            np.save(os.path.join(directory, f"{name}.npy"), np.asarray(getattr(self, name)))
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"product_ids": self.product_ids}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory: str, mmap_mode: Optional[str] = "r") -> "ForecastModel":
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode) for name in FORECAST_FIELDS}
+        return cls(meta["product_ids"], BatchForecast(**arrays))
+
+
+def market_adjustment(market_data: Optional[dict]) -> float:
+    """Мультипликатор прогноза по рыночным данным"""
+    factor = 1.0
+    for key, value in (market_data or {}).items():
+        factor += MARKET_ADJUSTMENTS.get(key, {}).get(str(value).lower(), 0.0)
+    return factor
+
+
+def history_hash(prices: Sequence[float]) -> str:
+    return hashlib.blake2b(np.asarray(prices, dtype=np.float64).tobytes(), digest_size=16).hexdigest()
+
+
+class ForecastCache:
+    """LRU подобранных моделей по product_id с проверкой хеша истории"""
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self._items: "OrderedDict[str, Tuple[str, ForecastParams]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.fits = 0
+        self.fit_time_total = 0.0
+        self.fit_time_max = 0.0
+
+    def get_or_fit(self, product_id: str, prices: Sequence[float]) -> Tuple[ForecastParams, bool]:
+        """Возвращает параметры модели и признак попадания в кэш"""
+        key_hash = history_hash(prices)
+        with self._lock:
+            cached = self._items.get(product_id)
+            if cached is not None and cached[0] == key_hash:
+                self._items.move_to_end(product_id)
+                self.hits += 1
+                return cached[1], True
+            self.misses += 1
+
+        start = time.perf_counter()
+        params = fit(prices)
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.fits += 1
+            self.fit_time_total += elapsed
+            self.fit_time_max = max(self.fit_time_max, elapsed)
+            self._items[product_id] = (key_hash, params)
+            self._items.move_to_end(product_id)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+        return params, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._items),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "fits": self.fits,
+                "fit_latency_avg_ms": round(self.fit_time_total / self.fits * 1000, 4) if self.fits else 0.0,
+                "fit_latency_max_ms": round(self.fit_time_max * 1000, 4),
+            }
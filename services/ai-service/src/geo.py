@@ -0,0 +1,347 @@
+"""
+Пространственный индекс складов и стоимость доставки.
+
+Координаты складов (WarehouseLocation из catalog-service) переводятся в точки
+единичной сферы, по ним строится KD-дерево: ближайшие к покупателю склады
+находятся за O(log W), расстояние по хорде монотонно расстоянию по
+поверхности. Остатки и цены товаров по складам хранятся разреженной
+матрицей, поэтому поиск ближайшего склада с остатком затрагивает только
+строки ближайших складов или предложения нужных товаров, а не все склады.
+
+Доставка оценивается по весу товара, расстоянию по дорогам (расстояние по
+сфере с коэффициентом извилистости) и тарифу за тонно-километр.
+
+Изменения цен и остатков из событий каталога (src.catalog_sync) пишутся в
+дельта-сегмент: строки измененных товаров заменяются целиком, а основная
+матрица пересобирается, когда дельта вырастает.
+"""
+
+import json
+import os
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS_KM = 6371.0
+
+# Дорога длиннее расстояния по прямой
+ROAD_FACTOR = 1.3
+
+# Тариф грузоперевозки по умолчанию, руб. за тонно-километр
+DEFAULT_RATE_PER_TON_KM = 8.0
+
+# Сколько ближайших складов просматривается при ранжировании всего каталога
+NEAREST_WAREHOUSES = 16
+
+GEO_ARRAYS = ("points", "weight")
+
+# Дельта сливается с основной матрицей, когда заменено больше строк
+COMPACT_MIN_ROWS = 1000
+COMPACT_FRACTION = 0.05
+
+
+def unit_vectors(latitude, longitude) -> np.ndarray:
+    """Точки единичной сферы для широт и долгот в градусах"""
+    lat = np.radians(np.asarray(latitude, dtype=np.float64))
+    lon = np.radians(np.asarray(longitude, dtype=np.float64))
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def chord_to_km(chord: np.ndarray) -> np.ndarray:
+    """Расстояние по поверхности Земли по длине хорды единичной сферы"""
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2.0, 0.0, 1.0))
+
+
+def delivery_cost(weight_kg, distance_km, rate_per_ton_km: float = DEFAULT_RATE_PER_TON_KM):
+    """Стоимость доставки единицы товара со склада на расстоянии distance_km (по прямой)"""
+    return np.asarray(weight_kg) / 1000.0 * np.asarray(distance_km) * ROAD_FACTOR * rate_per_ton_km
+
+
+class OfferChange(NamedTuple):
+    """Изменение предложения товара на складе; None - поле не меняется"""
+    product: int
+    warehouse: int
+    price: Optional[float]
+    available: Optional[float]
+
+
+class _Delta(NamedTuple):
+    """Замененные строки предложений (все известные предложения измененных товаров)"""
+    rows: np.ndarray       # позиция товара
+    cols: np.ndarray       # позиция склада
+    price: np.ndarray
+    available: np.ndarray
+    stale: np.ndarray      # маска товаров, чьи строки основной матрицы заменены
+
+
+def _offer_matrix(rows, cols, prices, available, shape) -> Tuple[sparse.csr_matrix, np.ndarray]:
+    """CSR цен предложений и выровненный с ее data массив остатков"""
+    # Номера предложений проходят через конвертацию в CSR вместо значений,
+    # по ним остатки переставляются в порядок data
+    numbers = sparse.csr_matrix(
+        (np.arange(1, len(rows) + 1, dtype=np.int64), (np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64))),
+        shape=shape
+    )
+    order = numbers.data - 1
+    offers = sparse.csr_matrix(
+        (np.asarray(prices, dtype=np.float32)[order], numbers.indices, numbers.indptr), shape=shape
+    )
+    return offers, np.asarray(available, dtype=np.float32)[order]
+
+
+class WarehouseIndex:
+    """KD-дерево складов и разреженная матрица предложений товаров по складам"""
+
+    def __init__(self, warehouses: Sequence[dict], products: Sequence[dict]):
+        located = [w for w in warehouses if w.get("location")]
+        self.warehouse_ids: List[str] = [w["id"] for w in located]
+        self.warehouse_cities: List[Optional[str]] = [w.get("city") for w in located]
+        self.points = unit_vectors(
+            [float(w["location"]["latitude"]) for w in located],
+            [float(w["location"]["longitude"]) for w in located],
+        ).reshape(-1, 3)
+        warehouse_pos = {wid: i for i, wid in enumerate(self.warehouse_ids)}
+
+        # Предложения товаров N x W: цена на складе и остаток (в том числе нулевой,
+        # чтобы событие пополнения остатка не теряло цену)
+        rows: List[int] = []
+        cols: List[int] = []
+        prices: List[float] = []
+        available: List[float] = []
+        for i, p in enumerate(products):
+            for offer in p.get("warehouses", []):
+                w = warehouse_pos.get(offer.get("warehouseId"))
+                if w is not None:
+                    rows.append(i)
+                    cols.append(w)
+                    prices.append(float(offer["unitPrice"]))
+                    available.append(float(offer.get("available", 0)))
+        self.offers, self.available = _offer_matrix(rows, cols, prices, available, (len(products), len(self.warehouse_ids)))
+        self.weight = np.array([float(p.get("weight") or 0.0) for p in products], dtype=np.float32)
+        self.auto_compact = True
+        self._build()
+
+    def _build(self, offers_t: Optional[sparse.csr_matrix] = None) -> None:
+        # Транспонированная матрица W x N номеров предложений (1..nnz): строки
+        # ближайших складов без конвертации формата, цена и остаток - по номеру.
+        # Сохраненная матрица отображается из хранилища, а не строится в каждом процессе
+        if offers_t is None:
+            numbers = np.arange(1, self.offers.nnz + 1, dtype=np.int64)
+            offers_t = sparse.csr_matrix((numbers, self.offers.indices, self.offers.indptr), shape=self.offers.shape).T.tocsr()
+        self.offers_t = offers_t
+        self.tree = cKDTree(self.points) if len(self.points) else None
+        self.warehouse_positions: Dict[str, int] = {wid: i for i, wid in enumerate(self.warehouse_ids)}
+        self._delta = _Delta(
+            rows=np.empty(0, dtype=np.int64),
+            cols=np.empty(0, dtype=np.int64),
+            price=np.empty(0, dtype=np.float32),
+            available=np.empty(0, dtype=np.float32),
+            stale=np.zeros(self.offers.shape[0], dtype=bool),
+        )
+
+    def __len__(self) -> int:
+        return len(self.warehouse_ids)
+
+    @property
+    def pending(self) -> int:
+        """Число товаров с предложениями в дельта-сегменте"""
+        return int(np.count_nonzero(self._delta.stale)) if len(self._delta.rows) else 0
+
+    def needs_compaction(self) -> bool:
+        return self.pending > max(COMPACT_MIN_ROWS, COMPACT_FRACTION * self.offers.shape[0])
+
+    def product_row(self, position: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Все предложения товара: позиции складов, цены и остатки (с учетом дельты)"""
+        delta = self._delta
+        if delta.stale[position]:
+            selected = delta.rows == position
+            return delta.cols[selected], delta.price[selected], delta.available[selected]
+        start, end = self.offers.indptr[position], self.offers.indptr[position + 1]
+        return (
+            np.asarray(self.offers.indices[start:end], dtype=np.int64),
+            np.asarray(self.offers.data[start:end]),
+            np.asarray(self.available[start:end]),
+        )
+
+    def update_offers(self, changes: Sequence[OfferChange]) -> Tuple[List[int], int]:
+        """
+        Применяет изменения цен и остатков по порядку; строки товаров заменяются в дельте.
+
+        Новое предложение без цены пропускается. Стоимость - O(предложений
+        измененных товаров), без обхода матрицы. Возвращает позиции товаров
+        с изменившимися предложениями и число пропущенных изменений.
+        """
+        rows: Dict[int, Dict[int, List[float]]] = {}
+        skipped = 0
+        for change in changes:
+            row = rows.get(change.product)
+            if row is None:
+                cols, prices, available = self.product_row(change.product)
+                row = rows[change.product] = {
+                    int(w): [float(price), float(stock)] for w, price, stock in zip(cols, prices, available)
+                }
+            offer = row.get(change.warehouse)
+            if offer is None:
+                if change.price is None:
+                    skipped += 1
+                    continue
+                offer = row[change.warehouse] = [change.price, 0.0]
+            if change.price is not None:
+                offer[0] = float(change.price)
+            if change.available is not None:
+                offer[1] = float(change.available)
+        if not rows:
+            return [], skipped
+
+        positions = np.fromiter(rows, dtype=np.int64, count=len(rows))
+        delta = self._delta
+        # Повторное изменение товара заменяет его прежнюю строку в дельте
+        keep = ~np.isin(delta.rows, positions)
+        offers = [(i, w, price, stock) for i, row in rows.items() for w, (price, stock) in row.items()]
+        stale = delta.stale.copy()
+        stale[positions] = True
+        self._delta = _Delta(
+            rows=np.concatenate([delta.rows[keep], np.array([o[0] for o in offers], dtype=np.int64)]),
+            cols=np.concatenate([delta.cols[keep], np.array([o[1] for o in offers], dtype=np.int64)]),
+            price=np.concatenate([delta.price[keep], np.array([o[2] for o in offers], dtype=np.float32)]),
+            available=np.concatenate([delta.available[keep], np.array([o[3] for o in offers], dtype=np.float32)]),
+            stale=stale,
+        )
+        if self.auto_compact and self.needs_compaction():
+            self.compact()
+        return positions.tolist(), skipped
+
+    def compact(self) -> None:
+        """Сливает дельта-сегмент с основной матрицей предложений (O(nnz))"""
+        delta = self._delta
+        if not len(delta.rows):
+            return
+        base = self.offers.tocoo()
+        keep = ~delta.stale[base.row]
+        rows = np.concatenate([base.row[keep], delta.rows])
+        cols = np.concatenate([base.col[keep], delta.cols])
+        prices = np.concatenate([base.data[keep], delta.price])
+        available = np.concatenate([np.asarray(self.available)[keep], delta.available])
+        self.offers, self.available = _offer_matrix(rows, cols, prices, available, self.offers.shape)
+        self._build()
+
+    def nearest_warehouses(self, latitude: float, longitude: float, k: int = NEAREST_WAREHOUSES) -> Tuple[np.ndarray, np.ndarray]:
+        """Позиции k ближайших складов и расстояния до них (км), по возрастанию"""
+        k = min(k, len(self))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        chord, positions = self.tree.query(unit_vectors(latitude, longitude), k=k)
+        return np.atleast_1d(positions).astype(np.int64), chord_to_km(np.atleast_1d(chord))
+
+    def nearest_stock(
+        self, latitude: float, longitude: float, k: int = NEAREST_WAREHOUSES
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Для всех товаров: ближайший из k ближайших складов с остатком, расстояние (км) и цена.
+
+        Товары без остатка на этих складах получают склад -1, цену inf и
+        расстояние до самого дальнего из просмотренных складов (нижняя оценка).
+        """
+        n = self.offers.shape[0]
+        warehouse = np.full(n, -1, dtype=np.int32)
+        distance = np.zeros(n, dtype=np.float32)
+        price = np.full(n, np.inf, dtype=np.float32)
+        positions, km = self.nearest_warehouses(latitude, longitude, k)
+        if not len(positions):
+            return warehouse, distance, price
+        distance[:] = km[-1]
+        # Строки ближайших складов по возрастанию расстояния: первая строка
+        # с предложением товара - ближайший склад с остатком
+        block = self.offers_t[positions].tocoo()
+        numbers = block.data - 1
+        rows, cols, prices = block.row, block.col, self.offers.data[numbers]
+        keep = self.available[numbers] > 0
+        delta = self._delta
+        if len(delta.rows):
+            # Строки товаров из дельты заменяют строки основной матрицы
+            keep &= ~delta.stale[cols]
+            rank = np.full(len(self), -1, dtype=np.int64)
+            rank[positions] = np.arange(len(positions))
+            delta_rows = rank[delta.cols]
+            selected = (delta_rows >= 0) & (delta.available > 0)
+            rows = np.concatenate([rows[keep], delta_rows[selected]])
+            cols = np.concatenate([cols[keep], delta.rows[selected]])
+            prices = np.concatenate([prices[keep], delta.price[selected]])
+        else:
+            rows, cols, prices = rows[keep], cols[keep], prices[keep]
+        order = np.lexsort((rows, cols))
+        cols, first = np.unique(cols[order], return_index=True)
+        rows = rows[order][first]
+        warehouse[cols] = positions[rows]
+        distance[cols] = km[rows]
+        price[cols] = prices[order][first]
+        return warehouse, distance, price
+
+    def product_offers(
+        self, product_positions: Sequence[int], latitude: float, longitude: float
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Для нескольких товаров: ближайший склад с остатком среди всех их предложений.
+
+        Перебираются только предложения этих товаров (строки матрицы), а не все склады.
+        """
+        product_positions = np.asarray(product_positions, dtype=np.int64)
+        warehouse = np.full(len(product_positions), -1, dtype=np.int32)
+        distance = np.full(len(product_positions), np.nan, dtype=np.float32)
+        price = np.full(len(product_positions), np.inf, dtype=np.float32)
+        origin = unit_vectors(latitude, longitude)
+        for j, i in enumerate(product_positions):
+            if i < 0:
+                continue
+            candidates, prices, available = self.product_row(int(i))
+            stocked = available > 0
+            if not stocked.any():
+                continue
+            candidates, prices = candidates[stocked], prices[stocked]
+            km = chord_to_km(np.linalg.norm(self.points[candidates] - origin, axis=1))
+            best = int(np.argmin(km))
+            warehouse[j] = candidates[best]
+            distance[j] = km[best]
+            price[j] = prices[best]
+        return warehouse, distance, price
+
+    def save(self, directory: str) -> None:
+        self.compact()
+        os.makedirs(directory, exist_ok=True)
+        for name in GEO_ARRAYS:
+            np.save(os.path.join(directory, f"geo.{name}.npy"), getattr(self, name))
+        for part in ("data", "indices", "indptr"):
+            np.save(os.path.join(directory, f"geo.offers.{part}.npy"), getattr(self.offers, part))
+        np.save(os.path.join(directory, "geo.offers.available.npy"), self.available)
+        for part in ("data", "indices", "indptr"):
+            np.save(os.path.join(directory, f"geo.offers_t.{part}.npy"), getattr(self.offers_t, part))
+        meta = {
+            "warehouse_ids": self.warehouse_ids,
+            "warehouse_cities": self.warehouse_cities,
+            "shape": list(self.offers.shape),
+        }
+        with open(os.path.join(directory, "geo.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory: str, mmap_mode: Optional[str] = "r") -> "WarehouseIndex":
+        with open(os.path.join(directory, "geo.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls.__new__(cls)
+        for name in GEO_ARRAYS:
+            setattr(index, name, np.load(os.path.join(directory, f"geo.{name}.npy"), mmap_mode=mmap_mode))
+        parts = [np.load(os.path.join(directory, f"geo.offers.{part}.npy"), mmap_mode=mmap_mode) for part in ("data", "indices", "indptr")]
+        index.offers = sparse.csr_matrix(tuple(parts), shape=tuple(meta["shape"]), copy=False)
+        index.available = np.load(os.path.join(directory, "geo.offers.available.npy"), mmap_mode=mmap_mode)
+        index.warehouse_ids = meta["warehouse_ids"]
+        index.warehouse_cities = meta["warehouse_cities"]
+        offers_t = None
+        if os.path.exists(os.path.join(directory, "geo.offers_t.data.npy")):
+            parts = [np.load(os.path.join(directory, f"geo.offers_t.{part}.npy"), mmap_mode=mmap_mode) for part in ("data", "indices", "indptr")]
+            offers_t = sparse.csr_matrix(tuple(parts), shape=tuple(reversed(meta["shape"])), copy=False)
+        # Отображенный индекс не сливается сам, см. RecommendationIndex.compact
+        index.auto_compact = mmap_mode is None
+        index._build(offers_t)
+        return index
@@ -0,0 +1,70 @@
+"""
+Неблокирующий конвейер логирования.
+
+Обработчики запросов только кладут запись в ограниченную очередь
+(QueueHandler), запись в stdout и файл выполняет отдельный поток
+QueueListener. При переполнении очереди записи отбрасываются и считаются,
+а не блокируют обработку запроса.
+"""
+
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import List, Optional
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler, который не блокируется и не форматирует запись в потоке запроса"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Очередь внутрипроцессная, поэтому форматирование откладывается до потока listener
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    """Очередь логов и поток, который пишет записи в конечные обработчики"""
+
+    def __init__(self, level: int = logging.INFO, log_file: Optional[str] = None, queue_size: int = 10000):
+        formatter = logging.Formatter(LOG_FORMAT)
+        targets: List[logging.Handler] = [logging.StreamHandler(sys.stdout)]
+        if log_file:
+            targets.append(logging.FileHandler(log_file))
+        for handler in targets:
+            handler.setFormatter(formatter)
+
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.handler = DroppingQueueHandler(self.queue)
+        self.listener = QueueListener(self.queue, *targets, respect_handler_level=True)
+
+        root = logging.getLogger()
+        root.setLevel(level)
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(self.handler)
+        self.start()
+
+    def start(self) -> None:
+        if self.listener._thread is None:
+            self.listener.start()
+
+    @property
+    def dropped(self) -> int:
+        return self.handler.dropped
+
+    def stop(self) -> None:
+        """Дописывает оставшиеся записи и останавливает поток"""
+        if self.listener._thread is not None:
+            self.listener.stop()
@@ -1,31 +1,455 @@
-from fastapi import FastAPI, HTTPException, Header, Request
+import time
+
+# Начало импорта приложения: от этой отметки считается бюджет холодного старта
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import Depends, FastAPI, HTTPException, Header, Request, UploadFile, File
+from fastapi.exception_handlers import http_exception_handler
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.routing import Match
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Optional, List
+from typing import TYPE_CHECKING, AsyncIterator, Literal, Optional, List, Tuple
+import asyncio
+import dataclasses
+import functools
+import hmac
 import os
 import logging
-import sys
+import math
+import random
+import signal
+
+import orjson
 
-# Настройка логирования
-logging.basicConfig(
+from src.catalog_sync import CatalogEventLog, read_events
+from src.log_pipeline import LogPipeline
+from src.metrics import MetricsRegistry, request_timer, start_request_timer
+from src.profiling import SamplingProfiler, SlowRequestRecorder
+from src.rate_limit import SingleFlight, TokenBucketLimiter, client_address, parse_networks
+from src.response_cache import CachedResponse, ResponseCache
+
+# Модули моделей тянут numpy и scipy и импортируются при прогреве (load_models),
+# чтобы процесс API поднимался и отвечал на /health без них
+if TYPE_CHECKING:
+    from src.copurchase import CoPurchaseMatrix
+    from src.estimator import ConstructionEstimator
+    from src.forecaster import ForecastCache, ForecastModel
+    from src.market import MarketAnalytics
+    from src.model_registry import ModelBundle
+    from src.recommender import CatalogUpdate, RecommendationIndex
+    from src.workers import InferencePool
+
+# Настройка логирования: записи уходят в очередь, stdout и файл пишет отдельный поток
+log_pipeline = LogPipeline(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('ai_service.log')
-    ]
+    log_file=os.getenv("AI_SERVICE_LOG_FILE", "ai_service.log") or None,
+    queue_size=int(os.getenv("LOG_QUEUE_SIZE", "10000"))
 )
 logger = logging.getLogger(__name__)
 
+# Доля запросов, для которых пишутся строки Request/Response (ошибки пишутся всегда)
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+
+# Пул для CPU-bound скоринга, чтобы не занимать event loop и общий threadpool
+scoring_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SCORING_WORKERS", str(os.cpu_count() or 1))),
+    thread_name_prefix="scoring"
+)
+
+async def run_scoring(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(scoring_executor, functools.partial(func, *args, **kwargs))
+
+# Кэш ответов /price-prediction, /construction-estimate и /market-analysis
+response_cache = ResponseCache(
+    maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", "10000")),
+    max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+)
+# Аналитика рынка меняется с событиями, поэтому живет в кэше недолго
+MARKET_ANALYSIS_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_MARKET_TTL", "10"))
+
+# Потоковые ответы NDJSON (Accept: application/x-ndjson): результаты считаются
+# и отправляются частями по STREAM_CHUNK_SIZE, память не растет с размером ответа
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", "500"))
+
+# Ограничение частоты запросов к эндпоинтам моделей по x-device-id (без заголовка -
+# по IP клиента): в среднем RATE_LIMIT_RPS в секунду, всплеск до RATE_LIMIT_BURST;
+# RATE_LIMIT_RPS=0 отключает ограничение. Запросы с x-admin-token (внутренние
+# сервисы, например оформление заказа) не ограничиваются
+rate_limiter = TokenBucketLimiter(
+    rate=float(os.getenv("RATE_LIMIT_RPS", "10")),
+    burst=int(os.getenv("RATE_LIMIT_BURST", "20")),
+    max_keys=int(os.getenv("RATE_LIMIT_MAX_DEVICES", "100000"))
+)
+# Прокси, чьему X-Forwarded-For можно верить (адреса и CIDR через запятую)
+RATE_LIMIT_TRUSTED_PROXIES = parse_networks(
+    os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "127.0.0.0/8,::1,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16")
+)
+# Одинаковые запросы рекомендаций, поиска и смет, пришедшие во время расчета, ждут его результат
+inflight_requests = SingleFlight()
+
+# Режим инференса: thread - пул потоков в процессе API, process - пул процессов
+# с массивами моделей в общем хранилище .npy (mmap, одна копия на все ядра)
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "thread")
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(os.cpu_count() or 1)))
+MODEL_STORE_DIR = os.getenv("MODEL_STORE_DIR") or None
+inference_pool: Optional["InferencePool"] = None
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+# Снимок каталога из catalog-service (Product, Category, ProductAttribute, WarehouseProduct)
+CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH", os.path.join(DATA_DIR, "catalog.json"))
+
+# Нормы расхода материалов и ставки работ для смет
+ESTIMATOR_NORMS_PATH = os.getenv("ESTIMATOR_NORMS_PATH", os.path.join(DATA_DIR, "estimator_norms.json"))
+# Monte Carlo для смет (simulation в запросе): предел числа сценариев и бюджет
+# времени на расчет, по исчерпании квантили считаются по разыгранным сценариям
+ESTIMATE_SIMULATION_MAX_DRAWS = int(os.getenv("ESTIMATE_SIMULATION_MAX_DRAWS", "20000"))
+ESTIMATE_SIMULATION_BUDGET_MS = float(os.getenv("ESTIMATE_SIMULATION_BUDGET_MS", "50"))
+
+# Реестр версий моделей (recommender, forecaster, estimator) с mmap-загрузкой.
+# Без реестра модели строятся в памяти по снимку каталога и нормам
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR") or None
+
+# Тариф грузоперевозки для оценки доставки со склада, руб. за тонно-километр
+DELIVERY_RATE_PER_TON_KM = float(os.getenv("DELIVERY_RATE_PER_TON_KM", "8"))
+
+# Синхронизация каталога событиями catalog-service (src.catalog_sync): журнал
+# примененных событий повторно применяется к снимку после рестарта и подмены
+# версии; файл-очередь событий сервис читает сам (без нее - только вебхук)
+CATALOG_EVENTS_LOG = os.getenv("CATALOG_EVENTS_LOG", os.path.join(DATA_DIR, "catalog_events.ndjson"))
+CATALOG_EVENTS_INBOX = os.getenv("CATALOG_EVENTS_INBOX") or None
+CATALOG_EVENTS_POLL_SECONDS = float(os.getenv("CATALOG_EVENTS_POLL_SECONDS", "1.0"))
+# Журнал сжимается, когда в нем больше max(порога, 2 x событий после прошлого сжатия); 0 - не сжимать
+CATALOG_EVENTS_COMPACT_MIN = int(os.getenv("CATALOG_EVENTS_COMPACT_MIN", "10000"))
+catalog_events = CatalogEventLog(CATALOG_EVENTS_LOG, CATALOG_EVENTS_COMPACT_MIN)
+catalog_sync_lock = asyncio.Lock()
+
+# Токен администратора для /admin/*; без токена администрирование отключено
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN") or None
+
+# Профилирование: сэмплирующий профилировщик по запросу администратора (не дольше
+# PROFILER_MAX_SECONDS) и профили запросов дольше SLOW_REQUEST_THRESHOLD_MS
+# (0 отключает) в кольцевом буфере на SLOW_REQUEST_BUFFER запросов
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "300"))
+profiler = SamplingProfiler()
+slow_requests = SlowRequestRecorder(
+    threshold=float(os.getenv("SLOW_REQUEST_THRESHOLD_MS", "1000")) / 1000,
+    capacity=int(os.getenv("SLOW_REQUEST_BUFFER", "100")),
+    interval=float(os.getenv("SLOW_REQUEST_SAMPLE_MS", "10")) / 1000
+)
+
+# Активная версия моделей: индекс рекомендаций, калькулятор смет, обученные
+# параметры прогноза цен и матрица совместных покупок подменяются вместе
+# при перезагрузке версии
+model_version: Optional[str] = None
+recommendation_index: Optional["RecommendationIndex"] = None
+construction_estimator: Optional["ConstructionEstimator"] = None
+forecast_model: Optional["ForecastModel"] = None
+copurchase_matrix: Optional["CoPurchaseMatrix"] = None
+models_reload_lock = asyncio.Lock()
+
+# Инкрементальные агрегаты рынка по событиям заказов и каталога
+market_analytics: Optional["MarketAnalytics"] = None
+
+# Кэш подобранных моделей прогноза цен по product_id
+FORECAST_CACHE_SIZE = int(os.getenv("FORECAST_CACHE_SIZE", "10000"))
+# Предел числа точек истории в одиночном /price-prediction
+PRICE_HISTORY_MAX_POINTS = int(os.getenv("PRICE_HISTORY_MAX_POINTS", "10000"))
+forecast_cache: Optional["ForecastCache"] = None
+
+# Прогрев моделей: background - в фоне после старта (/health отвечает сразу,
+# /ready - после загрузки), blocking - до приема запросов
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "background")
+# Бюджет холодного старта (импорт + загрузка моделей), секунды
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "10"))
+startup_state = {
+    "status": "starting",  # starting | ready | failed
+    "import_seconds": None,
+    "warmup_seconds": None,
+    "error": None
+}
+
+# Метрики Prometheus (/metrics): латентность по маршрутам, запросы в работе,
+# ошибки и время этапов обработки (валидация, логирование, скоринг, сериализация)
+metrics = MetricsRegistry()
+http_request_duration = metrics.histogram(
+    "ai_http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")
+)
+http_requests_in_flight = metrics.gauge(
+    "ai_http_requests_in_flight", "HTTP requests currently being processed", ("method", "route")
+)
+http_exceptions = metrics.counter(
+    "ai_http_exceptions_total", "Exceptions turned into 5xx responses by handlers or the global handler", ("route", "exception")
+)
+request_stage_duration = metrics.histogram(
+    "ai_request_stage_duration_seconds", "Time spent in each request processing stage", ("route", "stage")
+)
+response_cache_entries = metrics.gauge("ai_response_cache_entries", "Entries in the response cache")
+response_cache_bytes = metrics.gauge("ai_response_cache_bytes", "Bytes held by the response cache")
+response_cache_lookups = metrics.counter("ai_response_cache_lookups_total", "Response cache lookups", ("result",))
+forecast_cache_entries = metrics.gauge("ai_forecast_cache_entries", "Fitted forecast models in the cache")
+log_records_dropped = metrics.counter("ai_log_records_dropped_total", "Log records dropped on a full log queue")
+models_ready = metrics.gauge("ai_models_ready", "1 when model artifacts are loaded and the service is ready")
+startup_seconds = metrics.gauge("ai_startup_seconds", "Cold start duration by phase", ("phase",))
+rate_limited = metrics.counter("ai_rate_limited_total", "Requests rejected by the per-device rate limiter", ("route",))
+rate_limit_buckets = metrics.gauge("ai_rate_limit_buckets", "Per-device token buckets held in memory")
+coalesced_requests = metrics.counter("ai_coalesced_requests_total", "Requests that shared an identical in-flight computation")
+slow_requests_captured = metrics.counter("ai_slow_requests_total", "Requests slower than the slow request threshold", ("route",))
+
+def collect_runtime_metrics() -> None:
+    stats = response_cache.stats()
+    response_cache_entries.set(stats["entries"])
+    response_cache_bytes.set(stats["bytes"])
+    response_cache_lookups.set(stats["hits"], "hit")
+    response_cache_lookups.set(stats["misses"], "miss")
+    if forecast_cache is not None:
+        forecast_cache_entries.set(forecast_cache.stats()["size"])
+    log_records_dropped.set(log_pipeline.dropped)
+    rate_limit_buckets.set(rate_limiter.stats()["buckets"])
+    coalesced_requests.set(inflight_requests.shared)
+    models_ready.set(1 if startup_state["status"] == "ready" else 0)
+    for phase in ("import", "warmup"):
+        if startup_state[f"{phase}_seconds"] is not None:
+            startup_seconds.set(startup_state[f"{phase}_seconds"], phase)
+
+metrics.add_collector(collect_runtime_metrics)
+
+def prepare_models(version: Optional[str] = None) -> Tuple["ModelBundle", Optional["InferencePool"]]:
+    """Загружает версию моделей (из реестра или по снимку каталога) и поднимает для нее пул процессов"""
+    from src.estimator import load_norms
+    from src.model_registry import ModelRegistry, RegistryError, bundle_from_catalog
+    from src.recommender import load_catalog
+    
+    registry = ModelRegistry(MODEL_REGISTRY_DIR) if MODEL_REGISTRY_DIR else None
+    if registry is not None and (version or registry.current_version()):
+        bundle = registry.load(version)
+        source = registry.version_dir(bundle.version)
+    elif version:
+        raise RegistryError("MODEL_REGISTRY_DIR is not configured")
+    else:
+        bundle = bundle_from_catalog(load_catalog(CATALOG_SNAPSHOT_PATH), load_norms(ESTIMATOR_NORMS_PATH))
+        source = CATALOG_SNAPSHOT_PATH
+    logger.info(f"Models loaded - Version: {bundle.version}, Products: {len(bundle.index)}, Source: {source}")
+    
+    pool = None
+    if INFERENCE_MODE == "process":
+        from src.workers import InferencePool
+        if bundle.index_dir:
+            # Версия из реестра уже на диске: процессы пула отображают ее массивы напрямую
+            pool = InferencePool(None, workers=INFERENCE_WORKERS, store_dir=bundle.index_dir, events_path=CATALOG_EVENTS_LOG)
+        else:
+            store_dir = os.path.join(MODEL_STORE_DIR, bundle.version) if MODEL_STORE_DIR else None
+            pool = InferencePool(bundle.index, workers=INFERENCE_WORKERS, store_dir=store_dir, events_path=CATALOG_EVENTS_LOG)
+            # Главный процесс тоже читает индекс из хранилища, а не держит копию в куче
+            bundle = dataclasses.replace(bundle, index=pool.load_index(), index_dir=pool.store_dir)
+        logger.info(f"Inference pool started - Workers: {INFERENCE_WORKERS}, Store: {pool.store_dir}")
+    return bundle, pool
+
+def replay_catalog_events(bundle: "ModelBundle", market: Optional["MarketAnalytics"] = None) -> "CatalogUpdate":
+    """Применяет к версии моделей события журнала новее ее снимка каталога"""
+    from src.catalog_sync import apply_events
+    update = apply_events(bundle.index, bundle.estimator, catalog_events.read(), market)
+    # Снимок может быть новее журнала: источник продолжает с большего sequence
+    catalog_events.last_sequence = max(catalog_events.last_sequence, bundle.index.sequence)
+    if update.applied:
+        logger.info(f"Catalog events replayed - Version: {bundle.version}, Applied: {update.applied}, Sequence: {bundle.index.sequence}")
+    return update
+
+def activate_models(bundle: "ModelBundle", pool: Optional["InferencePool"]) -> Optional["InferencePool"]:
+    """Подменяет активную версию моделей, возвращает пул предыдущей версии"""
+    global model_version, recommendation_index, construction_estimator, forecast_model, copurchase_matrix, inference_pool
+    # Присваивания выполняются без await между ними: обработчики видят либо старую
+    # версию, либо новую. Запросы в работе дорабатывают на старых объектах,
+    # их mmap освобождается после завершения последнего запроса
+    previous_pool = inference_pool
+    model_version, recommendation_index, construction_estimator, forecast_model, copurchase_matrix, inference_pool = (
+        bundle.version, bundle.index, bundle.estimator, bundle.forecasts, bundle.copurchase, pool
+    )
+    return previous_pool
+
+def publish_index(index: "RecommendationIndex") -> "InferencePool":
+    """Сохраняет индекс с примененными событиями в новое хранилище и поднимает на нем пул"""
+    from src.workers import InferencePool
+    store_dir = os.path.join(MODEL_STORE_DIR, f"{model_version}-{index.sequence}") if MODEL_STORE_DIR else None
+    return InferencePool(index, workers=INFERENCE_WORKERS, store_dir=store_dir, events_path=CATALOG_EVENTS_LOG)
+
+def load_models() -> None:
+    """Импорт библиотек моделей и загрузка артефактов (выполняется в потоке прогрева)"""
+    global market_analytics, forecast_cache
+    from src.forecaster import ForecastCache
+    from src.market import MarketAnalytics
+    from src.recommender import load_catalog
+    
+    market_analytics = MarketAnalytics.from_catalog(load_catalog(CATALOG_SNAPSHOT_PATH))
+    bundle, pool = prepare_models()
+    replay_catalog_events(bundle, market_analytics)
+    activate_models(bundle, pool)
+    logger.info(f"Construction norms loaded - Project types: {len(construction_estimator.project_type_names)}")
+    forecast_cache = ForecastCache(maxsize=FORECAST_CACHE_SIZE)
+
+async def reload_models(version: Optional[str] = None) -> str:
+    """Горячая подмена версии моделей без остановки приема запросов"""
+    async with models_reload_lock:
+        started = time.perf_counter()
+        bundle, pool = await asyncio.to_thread(prepare_models, version)
+        # События, пришедшие во время загрузки, не должны пройти мимо новой версии
+        async with catalog_sync_lock:
+            await asyncio.to_thread(replay_catalog_events, bundle)
+            previous_pool = activate_models(bundle, pool)
+        logger.info(f"Models swapped - Version: {bundle.version}, Load time: {time.perf_counter() - started:.3f}s")
+    if previous_pool is not None:
+        # Пул старой версии дорабатывает принятые задачи и останавливается
+        await asyncio.to_thread(previous_pool.shutdown, False)
+    return bundle.version
+
+def handle_reload_signal() -> None:
+    async def reload():
+        try:
+            await reload_models()
+        except Exception as e:
+            logger.error(f"Model reload error: {str(e)}")
+    asyncio.ensure_future(reload())
+
+async def sync_catalog(events: List[dict]) -> dict:
+    """Журналирует и применяет новые события каталога; пачки применяются по одной"""
+    from src.catalog_sync import apply_events
+    async with catalog_sync_lock:
+        fresh = catalog_events.fresh(events)
+        applied = skipped = 0
+        if fresh:
+            if fresh[0]["sequence"] > catalog_events.last_sequence + 1:
+                logger.warning(f"Catalog event sequence gap - Expected: {catalog_events.last_sequence + 1}, Received: {fresh[0]['sequence']}")
+            await asyncio.to_thread(catalog_events.append, fresh)
+            update = await run_scoring(apply_events, recommendation_index, construction_estimator, fresh, market_analytics)
+            applied, skipped = update.applied, update.skipped
+            if catalog_events.needs_compaction():
+                kept = await asyncio.to_thread(catalog_events.compact)
+                logger.info(f"Catalog journal compacted - Events: {kept}, Sequence: {catalog_events.last_sequence}")
+            if recommendation_index.needs_compaction():
+                previous_pool = await compact_index()
+                if previous_pool is not None:
+                    await asyncio.to_thread(previous_pool.shutdown, False)
+        return {
+            "received": len(events),
+            "duplicates": len(events) - len(fresh),
+            "applied": applied,
+            "skipped": skipped,
+            "last_sequence": catalog_events.last_sequence
+        }
+
+async def compact_index() -> Optional["InferencePool"]:
+    """
+    Сливает дельта-сегменты индекса (вызывается под catalog_sync_lock).
+
+    Индекс, отображенный из хранилища, сам не сливается: слияние скопировало бы
+    матрицы в память каждого процесса. В режиме процессов индекс публикуется в
+    новое хранилище, пул пересоздается на нем, а копии, сделанные событиями,
+    освобождаются вместе со старым индексом. Возвращает пул для остановки.
+    """
+    global recommendation_index, inference_pool
+    started = time.perf_counter()
+    if inference_pool is None:
+        await run_scoring(recommendation_index.compact)
+        logger.info(f"Catalog index compacted - Sequence: {recommendation_index.sequence}, Time: {time.perf_counter() - started:.3f}s")
+        return None
+    pool = await run_scoring(publish_index, recommendation_index)
+    index = await asyncio.to_thread(pool.load_index)
+    previous_pool = inference_pool
+    recommendation_index, inference_pool = index, pool
+    logger.info(f"Catalog index republished - Sequence: {index.sequence}, Store: {pool.store_dir}, Time: {time.perf_counter() - started:.3f}s")
+    return previous_pool
+
+async def consume_catalog_inbox() -> None:
+    """Читает новые строки файла-очереди событий каталога (CATALOG_EVENTS_INBOX)"""
+    offset = 0
+    while True:
+        await asyncio.sleep(CATALOG_EVENTS_POLL_SECONDS)
+        if startup_state["status"] != "ready":
+            continue
+        try:
+            events, next_offset = await asyncio.to_thread(read_events, CATALOG_EVENTS_INBOX, offset)
+            if events:
+                result = await sync_catalog(events)
+                logger.info(f"Catalog inbox events - Received: {result['received']}, Applied: {result['applied']}, Sequence: {result['last_sequence']}")
+            # Смещение сдвигается только после применения: при ошибке строки перечитываются
+            offset = next_offset
+        except Exception as e:
+            logger.error(f"Catalog inbox error: {str(e)}")
+
+async def warm_up_models() -> None:
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(load_models)
+    except Exception as e:
+        startup_state["status"] = "failed"
+        startup_state["error"] = str(e)
+        logger.error(f"Model warm-up failed: {str(e)}")
+        return
+    startup_state["warmup_seconds"] = round(time.perf_counter() - started, 4)
+    startup_state["status"] = "ready"
+    total = startup_state["import_seconds"] + startup_state["warmup_seconds"]
+    logger.info(f"Models ready - Import: {startup_state['import_seconds']}s, Warm-up: {startup_state['warmup_seconds']}s")
+    if total > STARTUP_BUDGET_SECONDS:
+        logger.warning(f"Startup budget exceeded - Total: {total:.3f}s, Budget: {STARTUP_BUDGET_SECONDS}s")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global inference_pool
+    log_pipeline.start()
+    slow_requests.start()
+    if startup_state["import_seconds"] is None:
+        startup_state["import_seconds"] = round(time.perf_counter() - IMPORT_STARTED, 4)
+    startup_state.update(status="starting", warmup_seconds=None, error=None)
+    warm_up = asyncio.create_task(warm_up_models())
+    if MODEL_WARMUP == "blocking":
+        await warm_up
+    # SIGHUP перечитывает активную версию из реестра (kill -HUP <pid>)
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, handle_reload_signal)
+    except (NotImplementedError, RuntimeError, ValueError, AttributeError):
+        logger.info("SIGHUP model reload is not available in this environment")
+    inbox = asyncio.create_task(consume_catalog_inbox()) if CATALOG_EVENTS_INBOX else None
+    yield
+    if inbox is not None:
+        inbox.cancel()
+    # Поток прогрева нельзя прервать: дожидаемся его, чтобы корректно остановить пул
+    await warm_up
+    try:
+        asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+    except (NotImplementedError, RuntimeError, ValueError, AttributeError):
+        pass
+    if inference_pool is not None:
+        inference_pool.shutdown()
+        inference_pool = None
+    profiler.stop()
+    slow_requests.stop()
+    log_pipeline.stop()
+
+class FastJSONResponse(ORJSONResponse):
+    """orjson вместо json stdlib; скаляры NumPy из результатов моделей кодируются как числа"""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+
 # Создание FastAPI приложения
 app = FastAPI(
     title="TUTUU MARKET AI Service",
     description="AI-powered service for construction materials ecosystem",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan,
+    # Ответы кодируются orjson; обработчики моделей возвращают FastJSONResponse
+    # с готовыми словарями, минуя повторную валидацию по response_model
+    default_response_class=FastJSONResponse
 )
 
 # CORS middleware
@@ -46,24 +470,87 @@ class HealthResponse(BaseModel):
     version: str
     status: str
 
+class Location(BaseModel):
+    latitude: float = Field(ge=-90, le=90)
+    longitude: float = Field(ge=-180, le=180)
+
+    def as_tuple(self) -> Tuple[float, float]:
+        return (self.latitude, self.longitude)
+
 class ProductRecommendationRequest(BaseModel):
     user_id: str
     search_query: Optional[str] = None
     category: Optional[str] = None
     budget: Optional[float] = None
-    location: Optional[dict] = None
+    location: Optional[Location] = None  # адрес доставки: цены с ближайших складов и доставка
+    limit: int = 10
+
+class ProductItem(BaseModel):
+    product_id: str
+    name: str
+    category: Optional[str] = None
+    price: Optional[float] = None  # None - нет в наличии (поиск)
+    confidence: float
+    reason: str
+
+class RecommendationItem(ProductItem):
+    # С местоположением покупателя: ближайший склад с остатком и доставка
+    warehouse_id: Optional[str] = None
+    distance_km: Optional[float] = None
+    delivery_cost: Optional[float] = None
+    total_price: Optional[float] = None
+
+class SearchItem(ProductItem):
+    in_stock: bool
 
 class ProductRecommendationResponse(BaseModel):
     success: bool
     message: str
     deviceId: str
-    recommendations: List[dict]
+    recommendations: List[RecommendationItem]
     confidence: float
 
+class ProductRecommendationBatchRequest(BaseModel):
+    requests: List[ProductRecommendationRequest]
+
+class ProductRecommendationResult(BaseModel):
+    user_id: str
+    recommendations: List[RecommendationItem]
+    confidence: float
+
+class ProductRecommendationBatchResponse(BaseModel):
+    success: bool
+    message: str
+    deviceId: str
+    results: List[ProductRecommendationResult]
+
+class SearchResponse(BaseModel):
+    success: bool
+    message: str
+    deviceId: str
+    query: str
+    products: List[SearchItem]
+
+class CartItem(BaseModel):
+    product_id: str
+    quantity: float = 1.0
+
+class ComplementsRequest(BaseModel):
+    product_ids: List[str] = []
+    cart: List[CartItem] = []
+    limit: int = 10
+
+class ComplementsResponse(BaseModel):
+    success: bool
+    message: str
+    deviceId: str
+    complements: List[ProductItem]
+    unknown_product_ids: List[str]
+
 class PricePredictionRequest(BaseModel):
     product_id: str
     market_data: dict
-    historical_prices: List[float]
+    historical_prices: List[float] = Field(max_length=PRICE_HISTORY_MAX_POINTS)
 
 class PricePredictionResponse(BaseModel):
     success: bool
@@ -73,43 +560,253 @@ class PricePredictionResponse(BaseModel):
     confidence: float
     trend: str
 
+class BulkPricePredictionRequest(BaseModel):
+    product_ids: List[str]
+    historical_prices: List[List[float]]
+    market_data: dict = {}
+
+class PriceForecast(BaseModel):
+    product_id: str
+    predicted_price: Optional[float] = None  # null для пустой истории, причина - в error
+    confidence: Optional[float] = None
+    trend: Optional[str] = None
+    error: Optional[str] = None
+
+class BulkPricePredictionResponse(BaseModel):
+    success: bool
+    message: str
+    deviceId: str
+    forecasts: List[PriceForecast]
+
+class MarketEvent(BaseModel):
+    type: str  # order | stock
+    product_id: str
+    category: Optional[str] = None
+    quantity: float = 0.0
+    unit_price: Optional[float] = None
+    available: Optional[float] = None
+    timestamp: Optional[float] = None  # unix time, секунды
+
+class MarketEventsRequest(BaseModel):
+    events: List[MarketEvent]
+
+class CatalogEvent(BaseModel):
+    sequence: int = Field(ge=1)
+    type: Literal["product", "price", "stock"]
+    product: Optional[dict] = None  # type=product: полная запись Product из catalog-service
+    product_id: Optional[str] = None
+    warehouse_id: Optional[str] = None
+    unit_price: Optional[float] = Field(None, gt=0)
+    available: Optional[float] = Field(None, ge=0)
+
+class CatalogEventsRequest(BaseModel):
+    events: List[CatalogEvent]
+
+class ModelReloadRequest(BaseModel):
+    version: Optional[str] = None  # по умолчанию - активная версия реестра (CURRENT)
+
+class ProfilerRequest(BaseModel):
+    seconds: float = Field(10, gt=0)  # не больше PROFILER_MAX_SECONDS
+    interval_ms: float = Field(10, ge=1, le=1000)
+
 class ConstructionEstimateRequest(BaseModel):
     project_type: str
     area: float
     materials: List[str]
     complexity: str
+    location: Optional[Location] = None  # адрес объекта: цены с ближайших складов и доставка
+    simulation: Optional["EstimateSimulation"] = None  # Monte Carlo: квантили стоимости и сроков
+
+class EstimateSimulation(BaseModel):
+    draws: int = Field(2000, ge=100, le=100000)
+    seed: int = Field(0, ge=0)  # одинаковый seed - одинаковые квантили
+
+class QuantileBand(BaseModel):
+    p10: float
+    p50: float
+    p90: float
+
+class EstimateUncertainty(BaseModel):
+    draws: int
+    seed: int
+    truncated: bool
+    total_estimate: QuantileBand
+    materials_estimate: QuantileBand  # материалы с доставкой
+    labor_estimate: QuantileBand
+    timeline_days: QuantileBand
+
+class MaterialItem(BaseModel):
+    material: str
+    quantity: float
+    unit: str
+    unit_price: float
+    cost: float
+    delivery_cost: Optional[float] = None  # с адресом объекта
 
 class ConstructionEstimateResponse(BaseModel):
     success: bool
     message: str
     deviceId: str
     total_estimate: float
-    materials_breakdown: List[dict]
+    materials_breakdown: List[MaterialItem]
     labor_estimate: float
     timeline_days: int
+    delivery_estimate: Optional[float] = None
+    uncertainty: Optional[EstimateUncertainty] = None  # при simulation в запросе
+
+ConstructionEstimateRequest.model_rebuild()
 
 # Helper function to get device ID
 def get_device_id(device_id: Optional[str] = Header(None)) -> str:
     return device_id or "unknown"
 
-# Middleware для логирования запросов
+async def score_recommendations(search_queries, categories, budgets, limits, locations=None) -> List[List[dict]]:
+    if inference_pool is not None:
+        return await inference_pool.recommend_batch(
+            search_queries, categories, budgets, limits, locations, DELIVERY_RATE_PER_TON_KM
+        )
+    return await run_scoring(
+        recommendation_index.recommend_batch, search_queries, categories, budgets, limits, locations, DELIVERY_RATE_PER_TON_KM
+    )
+
+async def fit_forecasts(values, mask):
+    from src.forecaster import fit_batch
+    if inference_pool is not None:
+        return await inference_pool.fit_batch(values, mask)
+    return await run_scoring(fit_batch, values, mask)
+
+async def require_admin(
+    device_id: str = Header(None, alias="x-device-id"),
+    admin_token: str = Header(None, alias="x-admin-token")
+) -> None:
+    if ADMIN_TOKEN is None or not admin_token or not hmac.compare_digest(admin_token, ADMIN_TOKEN):
+        raise HTTPException(
+            status_code=403,
+            detail={
+                "success": False,
+                "message": "Доступ запрещен" if ADMIN_TOKEN else "Администрирование отключено (ADMIN_TOKEN не задан)",
+                "deviceId": get_device_id(device_id)
+            }
+        )
+
+async def require_models(device_id: str = Header(None, alias="x-device-id")) -> None:
+    # До окончания прогрева эндпоинты моделей отвечают 503, балансировщик ждет /ready
+    if startup_state["status"] != "ready":
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "success": False,
+                "message": "Модели загружаются, повторите запрос позже",
+                "deviceId": get_device_id(device_id)
+            },
+            headers={"Retry-After": "1"}
+        )
+
+async def limit_device_rate(
+    http_request: Request,
+    device_id: str = Header(None, alias="x-device-id"),
+    admin_token: str = Header(None, alias="x-admin-token"),
+    forwarded_for: str = Header(None, alias="x-forwarded-for")
+) -> None:
+    # Клиент, повторяющий запросы в цикле, получает 429 до того, как запрос дойдет до моделей
+    if ADMIN_TOKEN is not None and admin_token and hmac.compare_digest(admin_token, ADMIN_TOKEN):
+        return
+    peer = http_request.client.host if http_request.client else None
+    key = device_id or f"ip:{client_address(peer, forwarded_for, RATE_LIMIT_TRUSTED_PROXIES)}"
+    wait = rate_limiter.acquire(key)
+    if wait > 0:
+        rate_limited.inc(route_label(http_request))
+        raise HTTPException(
+            status_code=429,
+            detail={
+                "success": False,
+                "message": "Слишком много запросов, повторите позже",
+                "deviceId": get_device_id(device_id)
+            },
+            headers={"Retry-After": str(max(math.ceil(wait), 1))}
+        )
+
+def cached_response(entry: CachedResponse, http_request: Request, device_id: Optional[str]) -> Response:
+    # Клиент с актуальной копией получает 304 без тела
+    headers = {
+        "ETag": entry.etag,
+        "Cache-Control": f"private, max-age={max(int(entry.expires_at - time.monotonic()), 0)}"
+    }
+    if_none_match = http_request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or entry.etag in [
+        tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+    ]):
+        response_cache.record_not_modified()
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(content={**entry.payload, "deviceId": get_device_id(device_id)}, headers=headers)
+
+def wants_ndjson(http_request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in http_request.headers.get("accept", "")
+
+def ndjson_response(chunks: AsyncIterator[List[dict]], device_id: Optional[str], error_message: str) -> StreamingResponse:
+    """
+    Потоковый ответ: строка JSON на результат, части отправляются по мере расчета.
+
+    Статус 200 уходит до расчета, поэтому ошибка посреди потока передается
+    последней строкой {"success": false, ...}, после нее поток закрывается.
+    """
+    async def body():
+        try:
+            async for rows in chunks:
+                yield b"".join(orjson.dumps(row, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n" for row in rows)
+        except Exception as e:
+            logger.error(f"Streaming response error: {str(e)}")
+            yield orjson.dumps({"success": False, "message": error_message, "deviceId": get_device_id(device_id)}) + b"\n"
+    return StreamingResponse(body(), media_type=NDJSON_MEDIA_TYPE)
+
+def route_label(request: Request) -> str:
+    # Шаблон маршрута, а не URL: число серий метрик не зависит от параметров запроса
+    route = request.scope.get("route")
+    if route is None:
+        for candidate in app.router.routes:
+            if candidate.matches(request.scope)[0] == Match.FULL:
+                route = candidate
+                break
+    return getattr(route, "path", "unmatched")
+
+# Middleware для логирования запросов и метрик
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    device_id = request.headers.get("x-device-id", "unknown")
-    start_time = datetime.utcnow()
+    timer = start_request_timer()
+    route = route_label(request)
+    sampled = LOG_SAMPLE_RATE >= 1.0 or random.random() < LOG_SAMPLE_RATE
     
-    logger.info(f"Request: {request.method} {request.url} - Device ID: {device_id}")
+    if sampled:
+        with timer.stage("logging"):
+            logger.info("Request: %s %s - Device ID: %s", request.method, request.url, request.headers.get("x-device-id", "unknown"))
     
-    response = await call_next(request)
+    http_requests_in_flight.inc(request.method, route)
+    slow = slow_requests.begin(request.method, route, request.url.path, request.headers.get("x-device-id", "unknown"), timer)
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        # Обработчик отметил этапы: остаток до ответа - сериализация модели ответа
+        if "validation" in timer.stages:
+            timer.mark("serialization")
+    finally:
+        http_requests_in_flight.dec(request.method, route)
+        process_time = timer.elapsed
+        http_request_duration.observe(process_time, request.method, route, str(status))
+        if slow_requests.finish(slow, status, process_time):
+            slow_requests_captured.inc(route)
     
-    process_time = (datetime.utcnow() - start_time).total_seconds()
-    logger.info(f"Response: {response.status_code} - Process Time: {process_time:.3f}s")
+    if sampled:
+        with timer.stage("logging"):
+            logger.info("Response: %s - Process Time: %.3fs", status, process_time)
+    for stage, seconds in timer.stages.items():
+        request_stage_duration.observe(seconds, route, stage)
     
     return response
 
 # Health check endpoint
 @app.get("/health", response_model=HealthResponse)
-def health(device_id: str = Header(None, alias="x-device-id")):
+async def health(device_id: str = Header(None, alias="x-device-id")):
     try:
         return HealthResponse(
             success=True,
@@ -123,9 +820,44 @@ def health(device_id: str = Header(None, alias="x-device-id")):
         logger.error(f"Health check error: {str(e)}")
         raise HTTPException(status_code=500, detail="Health check failed")
 
+# Readiness endpoint: модели загружены, сервис готов принимать трафик
+@app.get("/ready")
+async def readiness(device_id: str = Header(None, alias="x-device-id")):
+    ready = startup_state["status"] == "ready"
+    total = None
+    if startup_state["import_seconds"] is not None and startup_state["warmup_seconds"] is not None:
+        total = round(startup_state["import_seconds"] + startup_state["warmup_seconds"], 4)
+    return FastJSONResponse(
+        status_code=200 if ready else 503,
+        content={
+            "success": ready,
+            "service": "ai-service",
+            "deviceId": get_device_id(device_id),
+            "status": startup_state["status"],
+            "error": startup_state["error"],
+            "models": {
+                "version": model_version,
+                "recommendation_index": len(recommendation_index) if recommendation_index is not None else None,
+                "construction_norms": len(construction_estimator.project_type_names) if construction_estimator is not None else None,
+                "price_forecasts": len(forecast_model) if forecast_model is not None else None,
+                "copurchase_orders": copurchase_matrix.orders if copurchase_matrix is not None else None,
+                "market_analytics": market_analytics is not None,
+                "catalog_sequence": recommendation_index.sequence if recommendation_index is not None else None,
+                "inference_mode": INFERENCE_MODE
+            },
+            "startup": {
+                "import_seconds": startup_state["import_seconds"],
+                "warmup_seconds": startup_state["warmup_seconds"],
+                "total_seconds": total,
+                "budget_seconds": STARTUP_BUDGET_SECONDS,
+                "within_budget": total <= STARTUP_BUDGET_SECONDS if total is not None else None
+            }
+        }
+    )
+
 # Root endpoint
 @app.get("/")
-def root(device_id: str = Header(None, alias="x-device-id")):
+async def root(device_id: str = Header(None, alias="x-device-id")):
     try:
         return {
             "success": True,
@@ -134,10 +866,17 @@ def root(device_id: str = Header(None, alias="x-device-id")):
             "deviceId": get_device_id(device_id),
             "endpoints": {
                 "health": "/health",
+                "ready": "/ready",
                 "recommendations": "/recommendations",
+                "recommendations_batch": "/recommendations/batch",
+                "recommendations_complements": "/recommendations/complements",
+                "search": "/search",
                 "price_prediction": "/price-prediction",
+                "price_prediction_bulk": "/price-prediction/bulk",
                 "construction_estimate": "/construction-estimate",
-                "market_analysis": "/market-analysis"
+                "market_analysis": "/market-analysis",
+                "catalog_events": "/catalog/events",
+                "metrics": "/metrics"
             },
             "documentation": {
                 "swagger": "/docs",
@@ -149,41 +888,124 @@ def root(device_id: str = Header(None, alias="x-device-id")):
         raise HTTPException(status_code=500, detail="Service unavailable")
 
 # Product recommendations endpoint
-@app.post("/recommendations", response_model=ProductRecommendationResponse)
-def get_product_recommendations(
+@app.post("/recommendations", response_model=ProductRecommendationResponse, dependencies=[Depends(limit_device_rate), Depends(require_models)])
+async def get_product_recommendations(
     request: ProductRecommendationRequest,
+    http_request: Request,
     device_id: str = Header(None, alias="x-device-id")
 ):
+    # Время от входа в запрос до обработчика - разбор тела и валидация pydantic
+    timer = request_timer()
+    timer.mark("validation")
     try:
         logger.info(f"Product recommendations request - User: {request.user_id}, Device: {get_device_id(device_id)}")
+        timer.mark("logging")
         
-        # TODO: Implement AI recommendation logic
-        # TODO: Use machine learning models for personalized recommendations
+        # Рекомендации не зависят от user_id: повторы от разных пользователей и устройств
+        # ждут уже идущий расчет
+        async def score():
+            return (await score_recommendations(
+                [request.search_query], [request.category], [request.budget], [request.limit],
+                [request.location.as_tuple() if request.location else None]
+            ))[0]
+        recommendations = await inflight_requests.do(
+            response_cache.key("recommendations", request.model_dump(mode="json", exclude={"user_id"}), model_version),
+            score
+        )
+        timer.mark("scoring")
         
-        recommendations = [
-            {
-                "product_id": "rec-1",
-                "name": "Рекомендуемый товар 1",
-                "confidence": 0.85,
-                "reason": "Популярный выбор для вашей категории"
-            },
-            {
-                "product_id": "rec-2", 
-                "name": "Рекомендуемый товар 2",
-                "confidence": 0.78,
-                "reason": "Соответствует вашему бюджету"
+        if wants_ndjson(http_request):
+            # Длинный список товаров: строка на товар, сериализация частями
+            async def chunks():
+                for start in range(0, len(recommendations), STREAM_CHUNK_SIZE):
+                    yield recommendations[start:start + STREAM_CHUNK_SIZE]
+            return ndjson_response(chunks(), device_id, "Ошибка при получении рекомендаций")
+        
+        return FastJSONResponse({
+            "success": True,
+            "message": "Рекомендации товаров получены",
+            "deviceId": get_device_id(device_id),
+            "recommendations": recommendations,
+            "confidence": recommendations[0]["confidence"] if recommendations else 0.0
+        })
+    except Exception as e:
+        logger.error(f"Recommendations error: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "success": False,
+                "message": "Ошибка при получении рекомендаций",
+                "deviceId": get_device_id(device_id)
             }
-        ]
+        )
+
+# Batch product recommendations endpoint
+@app.post("/recommendations/batch", response_model=ProductRecommendationBatchResponse, dependencies=[Depends(limit_device_rate), Depends(require_models)])
+async def get_product_recommendations_batch(
+    request: ProductRecommendationBatchRequest,
+    http_request: Request,
+    device_id: str = Header(None, alias="x-device-id")
+):
+    timer = request_timer()
+    timer.mark("validation")
+    try:
+        logger.info(f"Batch recommendations request - Users: {len(request.requests)}, Device: {get_device_id(device_id)}")
+        timer.mark("logging")
         
-        return ProductRecommendationResponse(
-            success=True,
-            message="Рекомендации товаров получены",
-            deviceId=get_device_id(device_id),
-            recommendations=recommendations,
-            confidence=0.85
+        if wants_ndjson(http_request):
+            # Строка на пользователя; часть запросов скорится, пока предыдущая отправляется
+            async def chunks():
+                for start in range(0, len(request.requests), STREAM_CHUNK_SIZE):
+                    part = request.requests[start:start + STREAM_CHUNK_SIZE]
+                    batch = await score_recommendations(
+                        search_queries=[r.search_query for r in part],
+                        categories=[r.category for r in part],
+                        budgets=[r.budget for r in part],
+                        limits=[r.limit for r in part],
+                        locations=[r.location.as_tuple() if r.location else None for r in part]
+                    )
+                    yield [
+                        {
+                            "user_id": r.user_id,
+                            "recommendations": recommendations,
+                            "confidence": recommendations[0]["confidence"] if recommendations else 0.0
+                        }
+                        for r, recommendations in zip(part, batch)
+                    ]
+            return ndjson_response(chunks(), device_id, "Ошибка при получении рекомендаций")
+        
+        # Все запросы скорятся вместе одним умножением матрицы запросов на матрицу товаров
+        batch = await inflight_requests.do(
+            response_cache.key(
+                "recommendations/batch",
+                request.model_dump(mode="json", exclude={"requests": {"__all__": {"user_id"}}}),
+                model_version
+            ),
+            lambda: score_recommendations(
+                search_queries=[r.search_query for r in request.requests],
+                categories=[r.category for r in request.requests],
+                budgets=[r.budget for r in request.requests],
+                limits=[r.limit for r in request.requests],
+                locations=[r.location.as_tuple() if r.location else None for r in request.requests]
+            )
         )
+        timer.mark("scoring")
+        
+        return FastJSONResponse({
+            "success": True,
+            "message": "Рекомендации товаров получены",
+            "deviceId": get_device_id(device_id),
+            "results": [
+                {
+                    "user_id": r.user_id,
+                    "recommendations": recommendations,
+                    "confidence": recommendations[0]["confidence"] if recommendations else 0.0
+                }
+                for r, recommendations in zip(request.requests, batch)
+            ]
+        })
     except Exception as e:
-        logger.error(f"Recommendations error: {str(e)}")
+        logger.error(f"Batch recommendations error: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail={
@@ -193,26 +1015,184 @@ def get_product_recommendations(
             }
         )
 
+def product_items(positions, scores, reason: str) -> List[dict]:
+    # Позиции товаров индекса рекомендаций (матрица совместных покупок опубликована
+    # вместе с индексом, позиции совпадают)
+    index = recommendation_index
+    items = []
+    for i, score in zip(positions, scores):
+        cat = index.category[i]
+        items.append({
+            "product_id": index.product_ids[i],
+            "name": index.names[i],
+            "category": index.category_names[cat] if cat >= 0 else None,
+            "price": round(float(index.price[i]), 2),
+            "confidence": round(float(score), 4),
+            "reason": reason
+        })
+    return items
+
+def search_products(query: str, limit: int) -> List[dict]:
+    index = recommendation_index
+    positions, scores = index.search.search(query, limit)
+    items = product_items(positions, scores, "Соответствует вашему запросу")
+    for item, i in zip(items, positions):
+        item["in_stock"] = bool(index.in_stock[i])
+        if not item["in_stock"]:
+            item["price"] = None
+    return items
+
+# Product search endpoint (нечеткий поиск по каталогу)
+@app.get("/search", response_model=SearchResponse, dependencies=[Depends(limit_device_rate), Depends(require_models)])
+async def search_catalog(q: str, limit: int = 10, device_id: str = Header(None, alias="x-device-id")):
+    timer = request_timer()
+    timer.mark("validation")
+    try:
+        logger.info(f"Search request - Query length: {len(q)}, Device: {get_device_id(device_id)}")
+        timer.mark("logging")
+        
+        limit = max(min(limit, 100), 0)
+        products = await inflight_requests.do(
+            response_cache.key("search", {"q": q, "limit": limit}, model_version),
+            lambda: run_scoring(search_products, q, limit)
+        )
+        timer.mark("scoring")
+        
+        return FastJSONResponse({
+            "success": True,
+            "message": "Результаты поиска получены",
+            "deviceId": get_device_id(device_id),
+            "query": q,
+            "products": products
+        })
+    except Exception as e:
+        logger.error(f"Search error: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "success": False,
+                "message": "Ошибка при поиске товаров",
+                "deviceId": get_device_id(device_id)
+            }
+        )
+
+# Frequently bought together endpoint
+@app.post("/recommendations/complements", response_model=ComplementsResponse, dependencies=[Depends(limit_device_rate), Depends(require_models)])
+async def get_complements(
+    request: ComplementsRequest,
+    device_id: str = Header(None, alias="x-device-id")
+):
+    timer = request_timer()
+    timer.mark("validation")
+    try:
+        product_ids = list(dict.fromkeys(request.product_ids + [item.product_id for item in request.cart]))
+        if not product_ids:
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "success": False,
+                    "message": "Укажите product_ids или cart",
+                    "deviceId": get_device_id(device_id)
+                }
+            )
+        logger.info(f"Complements request - Products: {len(product_ids)}, Device: {get_device_id(device_id)}")
+        timer.mark("logging")
+        
+        # Соседи товаров предвычислены при обучении: поиск - срезы массивов,
+        # поэтому выполняется прямо в event loop, без пула скоринга
+        matrix = copurchase_matrix
+        if matrix is None:
+            return FastJSONResponse({
+                "success": True,
+                "message": "Нет данных о совместных покупках для активной версии моделей",
+                "deviceId": get_device_id(device_id),
+                "complements": [],
+                "unknown_product_ids": []
+            })
+        positions = [matrix.positions[pid] for pid in product_ids if pid in matrix.positions]
+        unknown = [pid for pid in product_ids if pid not in matrix.positions]
+        # Предлагаются только товары в наличии
+        indices, scores = matrix.complements(positions, max(request.limit, 0), recommendation_index.in_stock)
+        timer.mark("scoring")
+        
+        return FastJSONResponse({
+            "success": True,
+            "message": "Сопутствующие товары получены",
+            "deviceId": get_device_id(device_id),
+            "complements": product_items(indices, scores, "Часто покупают вместе"),
+            "unknown_product_ids": unknown
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Complements error: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "success": False,
+                "message": "Ошибка при подборе сопутствующих товаров",
+                "deviceId": get_device_id(device_id)
+            }
+        )
+
 # Price prediction endpoint
-@app.post("/price-prediction", response_model=PricePredictionResponse)
-def predict_price(
+@app.post("/price-prediction", response_model=PricePredictionResponse, dependencies=[Depends(limit_device_rate), Depends(require_models)])
+async def predict_price(
     request: PricePredictionRequest,
+    http_request: Request,
     device_id: str = Header(None, alias="x-device-id")
 ):
+    timer = request_timer()
+    timer.mark("validation")
     try:
         logger.info(f"Price prediction request - Product: {request.product_id}, Device: {get_device_id(device_id)}")
+        timer.mark("logging")
         
-        # TODO: Implement price prediction logic
-        # TODO: Use time series analysis and market data
+        # Без истории в запросе прогноз строится по обученным параметрам активной версии моделей
+        trained = forecast_model.get(request.product_id) if forecast_model is not None and not request.historical_prices else None
+        if not request.historical_prices and trained is None:
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "success": False,
+                    "message": "История цен не может быть пустой",
+                    "deviceId": get_device_id(device_id)
+                }
+            )
         
-        return PricePredictionResponse(
-            success=True,
-            message="Прогноз цены рассчитан",
-            deviceId=get_device_id(device_id),
-            predicted_price=1500.0,
-            confidence=0.78,
-            trend="stable"
-        )
+        cache_key = response_cache.key("price-prediction", request, model_version if trained is not None else None)
+        entry = response_cache.get(cache_key)
+        if entry is None:
+            from src.forecaster import market_adjustment
+            if trained is not None:
+                params = trained
+            else:
+                # Подбор - расчет NumPy: в пуле скоринга, как у пакетного прогноза
+                params, _ = await run_scoring(forecast_cache.get_or_fit, request.product_id, request.historical_prices)
+                if params.n == 0:
+                    # Все точки - пропуски (NaN): как пустая история
+                    raise HTTPException(
+                        status_code=400,
+                        detail={
+                            "success": False,
+                            "message": "История цен не может быть пустой",
+                            "deviceId": get_device_id(device_id)
+                        }
+                    )
+            predicted_price = params.predict() * market_adjustment(request.market_data)
+            
+            entry = response_cache.put(cache_key, {
+                "success": True,
+                "message": "Прогноз цены рассчитан",
+                "predicted_price": round(predicted_price, 2),
+                "confidence": params.confidence,
+                "trend": params.trend
+            })
+        timer.mark("scoring")
+        
+        return cached_response(entry, http_request, device_id)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Price prediction error: {str(e)}")
         raise HTTPException(
@@ -224,40 +1204,242 @@ def predict_price(
             }
         )
 
+async def bulk_forecasts(product_ids: List[str], values, mask, market_data: Optional[dict] = None) -> List[dict]:
+    from src.forecaster import market_adjustment
+    # Один векторизованный проход по матрице историй B x T
+    batch = await fit_forecasts(values, mask)
+    predicted = batch.predict() * market_adjustment(market_data)
+    # Словари в форме PriceForecast: внутренние данные не валидируются повторно.
+    # Строка без точек истории получает ошибку, как одиночный /price-prediction
+    return [
+        {"product_id": product_id, "predicted_price": round(price, 2), "confidence": confidence, "trend": trend}
+        if n > 0 else
+        {"product_id": product_id, "predicted_price": None, "confidence": None, "trend": None, "error": "История цен пуста"}
+        for product_id, price, confidence, trend, n in zip(
+            product_ids, predicted.tolist(), batch.confidence.tolist(), batch.trends().tolist(), batch.n.tolist()
+        )
+    ]
+
+def bulk_price_error(device_id: Optional[str], message: str) -> HTTPException:
+    return HTTPException(
+        status_code=400,
+        detail={
+            "success": False,
+            "message": message,
+            "deviceId": get_device_id(device_id)
+        }
+    )
+
+# Bulk price prediction endpoint
+@app.post("/price-prediction/bulk", response_model=BulkPricePredictionResponse, dependencies=[Depends(limit_device_rate), Depends(require_models)])
+async def predict_prices_bulk(
+    request: BulkPricePredictionRequest,
+    http_request: Request,
+    device_id: str = Header(None, alias="x-device-id")
+):
+    timer = request_timer()
+    timer.mark("validation")
+    try:
+        logger.info(f"Bulk price prediction request - Products: {len(request.product_ids)}, Device: {get_device_id(device_id)}")
+        timer.mark("logging")
+        
+        if len(request.product_ids) != len(request.historical_prices):
+            raise bulk_price_error(device_id, "Количество товаров и историй цен не совпадает")
+        
+        from src.forecaster import pad_histories
+        if wants_ndjson(http_request):
+            # Истории упаковываются и подбираются частями: матрица B x T не строится целиком
+            async def chunks():
+                for start in range(0, len(request.product_ids), STREAM_CHUNK_SIZE):
+                    end = start + STREAM_CHUNK_SIZE
+                    values, mask = await run_scoring(pad_histories, request.historical_prices[start:end])
+                    forecasts = await bulk_forecasts(request.product_ids[start:end], values, mask, request.market_data)
+                    yield forecasts
+            return ndjson_response(chunks(), device_id, "Ошибка при прогнозировании цен")
+        
+        values, mask = await run_scoring(pad_histories, request.historical_prices)
+        forecasts = await bulk_forecasts(request.product_ids, values, mask, request.market_data)
+        timer.mark("scoring")
+        
+        return FastJSONResponse({
+            "success": True,
+            "message": "Прогноз цен рассчитан",
+            "deviceId": get_device_id(device_id),
+            "forecasts": forecasts
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Bulk price prediction error: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "success": False,
+                "message": "Ошибка при прогнозировании цен",
+                "deviceId": get_device_id(device_id)
+            }
+        )
+
+# Bulk price prediction from uploaded NPZ/Parquet/Arrow file
+@app.post("/price-prediction/bulk/upload", response_model=BulkPricePredictionResponse, dependencies=[Depends(limit_device_rate), Depends(require_models)])
+async def predict_prices_bulk_upload(
+    http_request: Request,
+    file: UploadFile = File(...),
+    device_id: str = Header(None, alias="x-device-id")
+):
+    timer = request_timer()
+    timer.mark("validation")
+    try:
+        logger.info(f"Bulk price prediction upload - File: {file.filename}, Device: {get_device_id(device_id)}")
+        timer.mark("logging")
+        
+        from src.forecaster import load_histories_file
+        try:
+            product_ids, values, mask = await run_scoring(load_histories_file, await file.read(), file.filename or "")
+        except (ValueError, KeyError) as e:
+            raise bulk_price_error(device_id, f"Некорректный файл историй цен: {str(e)}")
+        if len(product_ids) != values.shape[0]:
+            raise bulk_price_error(device_id, "Количество товаров и историй цен не совпадает")
+        timer.mark("validation")
+        
+        if wants_ndjson(http_request):
+            async def chunks():
+                for start in range(0, len(product_ids), STREAM_CHUNK_SIZE):
+                    end = start + STREAM_CHUNK_SIZE
+                    forecasts = await bulk_forecasts(product_ids[start:end], values[start:end], mask[start:end])
+                    yield forecasts
+            return ndjson_response(chunks(), device_id, "Ошибка при прогнозировании цен")
+        
+        forecasts = await bulk_forecasts(product_ids, values, mask)
+        timer.mark("scoring")
+        
+        return FastJSONResponse({
+            "success": True,
+            "message": "Прогноз цен рассчитан",
+            "deviceId": get_device_id(device_id),
+            "forecasts": forecasts
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Bulk price prediction upload error: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "success": False,
+                "message": "Ошибка при прогнозировании цен",
+                "deviceId": get_device_id(device_id)
+            }
+        )
+
+# Price prediction cache statistics endpoint
+@app.get("/price-prediction/stats", dependencies=[Depends(require_models)])
+async def price_prediction_stats(device_id: str = Header(None, alias="x-device-id")):
+    return {
+        "success": True,
+        "deviceId": get_device_id(device_id),
+        "cache": forecast_cache.stats()
+    }
+
+# Response cache statistics endpoint
+@app.get("/cache/stats")
+async def response_cache_stats(device_id: str = Header(None, alias="x-device-id")):
+    return {
+        "success": True,
+        "deviceId": get_device_id(device_id),
+        "cache": response_cache.stats()
+    }
+
 # Construction estimate endpoint
-@app.post("/construction-estimate", response_model=ConstructionEstimateResponse)
-def get_construction_estimate(
+@app.post("/construction-estimate", response_model=ConstructionEstimateResponse, dependencies=[Depends(limit_device_rate), Depends(require_models)])
+async def get_construction_estimate(
     request: ConstructionEstimateRequest,
+    http_request: Request,
     device_id: str = Header(None, alias="x-device-id")
 ):
+    timer = request_timer()
+    timer.mark("validation")
     try:
         logger.info(f"Construction estimate request - Project: {request.project_type}, Device: {get_device_id(device_id)}")
+        timer.mark("logging")
         
-        # TODO: Implement construction estimation logic
-        # TODO: Use AI models trained on construction data
-        
-        return ConstructionEstimateResponse(
-            success=True,
-            message="Смета строительства рассчитана",
-            deviceId=get_device_id(device_id),
-            total_estimate=250000.0,
-            materials_breakdown=[
-                {
-                    "material": "Кирпич",
-                    "quantity": 5000,
-                    "unit": "шт",
-                    "cost": 150000.0
-                },
-                {
-                    "material": "Цемент",
-                    "quantity": 50,
-                    "unit": "мешков",
-                    "cost": 25000.0
+        # Смета зависит от запроса, версии норм и снимка цен материалов
+        cache_key = response_cache.key("construction-estimate", request, (model_version, construction_estimator.prices_version))
+        entry = response_cache.get(cache_key)
+        if entry is None:
+            from src.estimator import EstimateError
+            estimator, index = construction_estimator, recommendation_index
+            
+            async def compute() -> CachedResponse:
+                unit_prices = delivery_per_unit = None
+                if request.location is not None:
+                    # Цены материалов на ближайших к объекту складах с остатком и доставка
+                    unit_prices, delivery_per_unit = estimator.local_offers(
+                        index.geo, index.product_positions,
+                        request.location.latitude, request.location.longitude, DELIVERY_RATE_PER_TON_KM
+                    )
+                estimate = estimator.estimate(
+                    project_type=request.project_type,
+                    area=request.area,
+                    materials=request.materials,
+                    complexity=request.complexity,
+                    unit_prices=unit_prices,
+                    delivery_per_unit=delivery_per_unit
+                )
+                payload = {
+                    "success": True,
+                    "message": "Смета строительства рассчитана",
+                    "total_estimate": estimate.total_estimate,
+                    "materials_breakdown": estimate.materials_breakdown,
+                    "labor_estimate": estimate.labor_estimate,
+                    "timeline_days": estimate.timeline_days,
+                    "delivery_estimate": estimate.delivery_estimate
                 }
-            ],
-            labor_estimate=80000.0,
-            timeline_days=45
-        )
+                if request.simulation is not None:
+                    # Сценарии считаются в пуле скоринга, чтобы не занимать event loop
+                    bands = await run_scoring(
+                        estimator.simulate,
+                        project_type=request.project_type,
+                        area=request.area,
+                        materials=request.materials,
+                        complexity=request.complexity,
+                        draws=min(request.simulation.draws, ESTIMATE_SIMULATION_MAX_DRAWS),
+                        seed=request.simulation.seed,
+                        unit_prices=unit_prices,
+                        delivery_per_unit=delivery_per_unit,
+                        budget_seconds=ESTIMATE_SIMULATION_BUDGET_MS / 1000
+                    )
+                    payload["uncertainty"] = {
+                        "draws": bands.draws,
+                        "seed": request.simulation.seed,
+                        "truncated": bands.truncated,
+                        **{
+                            name: dict(zip(("p10", "p50", "p90"), getattr(bands, name)))
+                            for name in ("total_estimate", "materials_estimate", "labor_estimate", "timeline_days")
+                        }
+                    }
+                    if bands.truncated:
+                        # Неполный результат зависит от загрузки сервера: не закрепляем его в кэше
+                        return response_cache.entry(payload, ttl=0)
+                return response_cache.put(cache_key, payload)
+            
+            # Одинаковые сметы, пришедшие до записи в кэш (симуляция ждет пул скоринга), считаются один раз
+            try:
+                entry = await inflight_requests.do(cache_key, compute)
+            except EstimateError as e:
+                raise HTTPException(
+                    status_code=400,
+                    detail={
+                        "success": False,
+                        "message": str(e),
+                        "deviceId": get_device_id(device_id)
+                    }
+                )
+        timer.mark("scoring")
+        
+        return cached_response(entry, http_request, device_id)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Construction estimate error: {str(e)}")
         raise HTTPException(
@@ -270,49 +1452,256 @@ def get_construction_estimate(
         )
 
 # Market analysis endpoint
-@app.get("/market-analysis")
-def get_market_analysis(device_id: str = Header(None, alias="x-device-id")):
+@app.get("/market-analysis", dependencies=[Depends(limit_device_rate), Depends(require_models)])
+async def get_market_analysis(http_request: Request, device_id: str = Header(None, alias="x-device-id")):
+    timer = request_timer()
+    timer.mark("validation")
     try:
         logger.info(f"Market analysis request - Device: {get_device_id(device_id)}")
+        timer.mark("logging")
         
-        # TODO: Implement market analysis logic
-        # TODO: Analyze trends, demand patterns, and market dynamics
+        # Версия данных - число примененных событий: новые события сбрасывают кэш
+        cache_key = response_cache.key("market-analysis", version=market_analytics.events_applied)
+        entry = response_cache.get(cache_key)
+        if entry is None:
+            # Снимок поддерживается инкрементально, чтение не пересчитывает историю заказов
+            entry = response_cache.put(cache_key, {
+                "success": True,
+                "message": "Анализ рынка получен",
+                **market_analytics.snapshot()
+            }, ttl=MARKET_ANALYSIS_CACHE_TTL)
+        timer.mark("scoring")
+        
+        return cached_response(entry, http_request, device_id)
+    except Exception as e:
+        logger.error(f"Market analysis error: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "success": False,
+                "message": "Ошибка при анализе рынка",
+                "deviceId": get_device_id(device_id)
+            }
+        )
+
+# Market events ingestion endpoint
+@app.post("/market-analysis/events", dependencies=[Depends(require_admin), Depends(require_models)])
+async def ingest_market_events(
+    request: MarketEventsRequest,
+    device_id: str = Header(None, alias="x-device-id")
+):
+    timer = request_timer()
+    timer.mark("validation")
+    try:
+        applied = await run_scoring(market_analytics.apply_events, [event.model_dump() for event in request.events])
+        timer.mark("scoring")
+        logger.info(f"Market events ingested - Received: {len(request.events)}, Applied: {applied}, Device: {get_device_id(device_id)}")
+        timer.mark("logging")
         
         return {
             "success": True,
-            "message": "Анализ рынка получен",
+            "message": "События рынка применены",
             "deviceId": get_device_id(device_id),
-            "market_trends": {
-                "demand": "increasing",
-                "supply": "stable",
-                "price_trend": "moderate_increase"
-            },
-            "top_categories": ["Кирпич", "Цемент", "Доски"],
-            "seasonal_factors": ["Летний сезон строительства"],
-            "recommendations": [
-                "Увеличить закупки кирпича",
-                "Мониторить цены на цемент",
-                "Подготовиться к осеннему сезону"
-            ]
+            "received": len(request.events),
+            "applied": applied
         }
     except Exception as e:
-        logger.error(f"Market analysis error: {str(e)}")
+        logger.error(f"Market events error: {str(e)}")
         raise HTTPException(
             status_code=500,
             detail={
                 "success": False,
-                "message": "Ошибка при анализе рынка",
+                "message": "Ошибка при обработке событий рынка",
                 "deviceId": get_device_id(device_id)
             }
         )
 
+# Catalog events ingestion endpoint (вебхук catalog-service)
+@app.post("/catalog/events", dependencies=[Depends(require_admin), Depends(require_models)])
+async def ingest_catalog_events(
+    request: CatalogEventsRequest,
+    device_id: str = Header(None, alias="x-device-id")
+):
+    timer = request_timer()
+    timer.mark("validation")
+    try:
+        result = await sync_catalog([event.model_dump(exclude_none=True) for event in request.events])
+        timer.mark("scoring")
+        logger.info(f"Catalog events ingested - Received: {result['received']}, Applied: {result['applied']}, Sequence: {result['last_sequence']}, Device: {get_device_id(device_id)}")
+        timer.mark("logging")
+        
+        return {
+            "success": True,
+            "message": "События каталога применены",
+            "deviceId": get_device_id(device_id),
+            **result
+        }
+    except Exception as e:
+        logger.error(f"Catalog events error: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "success": False,
+                "message": "Ошибка при обработке событий каталога",
+                "deviceId": get_device_id(device_id)
+            }
+        )
+
+# Catalog sync status endpoint: с какого sequence источнику продолжать отправку
+@app.get("/catalog/events", dependencies=[Depends(require_admin), Depends(require_models)])
+async def catalog_sync_status(device_id: str = Header(None, alias="x-device-id")):
+    return {
+        "success": True,
+        "deviceId": get_device_id(device_id),
+        "last_sequence": catalog_events.last_sequence,
+        "index_sequence": recommendation_index.sequence,
+        "journal_events": catalog_events.events,
+        "journal_compactions": catalog_events.compactions,
+        "journal": CATALOG_EVENTS_LOG,
+        "inbox": CATALOG_EVENTS_INBOX,
+        "pending": {
+            "search": recommendation_index.search.pending,
+            "offers": recommendation_index.geo.pending
+        }
+    }
+
+# Model registry endpoints
+@app.get("/admin/models", dependencies=[Depends(require_admin)])
+async def list_models(device_id: str = Header(None, alias="x-device-id")):
+    versions = []
+    current = None
+    if MODEL_REGISTRY_DIR:
+        from src.model_registry import ModelRegistry
+        registry = ModelRegistry(MODEL_REGISTRY_DIR)
+        versions = registry.versions()
+        current = registry.current_version()
+    return {
+        "success": True,
+        "deviceId": get_device_id(device_id),
+        "active": model_version,
+        "current": current,
+        "versions": versions,
+        "registry": MODEL_REGISTRY_DIR
+    }
+
+@app.post("/admin/models/reload", dependencies=[Depends(require_admin), Depends(require_models)])
+async def reload_model_version(
+    request: Optional[ModelReloadRequest] = None,
+    device_id: str = Header(None, alias="x-device-id")
+):
+    from src.model_registry import RegistryError
+    try:
+        version = await reload_models(request.version if request else None)
+        return {
+            "success": True,
+            "message": "Версия моделей загружена",
+            "deviceId": get_device_id(device_id),
+            "version": version
+        }
+    except RegistryError as e:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "success": False,
+                "message": str(e),
+                "deviceId": get_device_id(device_id)
+            }
+        )
+    except Exception as e:
+        logger.error(f"Model reload error: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail={
+                "success": False,
+                "message": "Ошибка при загрузке версии моделей",
+                "deviceId": get_device_id(device_id)
+            }
+        )
+
+# Profiler endpoints (admin): сэмплирующий профилировщик и профили медленных запросов
+@app.post("/admin/profiler", dependencies=[Depends(require_admin)])
+async def start_profiler(
+    request: Optional[ProfilerRequest] = None,
+    device_id: str = Header(None, alias="x-device-id")
+):
+    request = request or ProfilerRequest()
+    if not profiler.start(min(request.seconds, PROFILER_MAX_SECONDS), request.interval_ms / 1000):
+        raise HTTPException(
+            status_code=409,
+            detail={
+                "success": False,
+                "message": "Профилирование уже запущено",
+                "deviceId": get_device_id(device_id)
+            }
+        )
+    logger.info(f"Sampling profiler started for {profiler.seconds}s - Device: {get_device_id(device_id)}")
+    return {
+        "success": True,
+        "message": "Профилирование запущено",
+        "deviceId": get_device_id(device_id),
+        "profiler": profiler.status()
+    }
+
+@app.get("/admin/profiler", dependencies=[Depends(require_admin)])
+async def profiler_status(device_id: str = Header(None, alias="x-device-id")):
+    return {
+        "success": True,
+        "deviceId": get_device_id(device_id),
+        "profiler": profiler.status()
+    }
+
+@app.get("/admin/profiler/flamegraph", dependencies=[Depends(require_admin)])
+async def profiler_flamegraph(device_id: str = Header(None, alias="x-device-id")):
+    # Во время сессии отдаются стеки, снятые к этому моменту
+    if profiler.samples == 0:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "success": False,
+                "message": "Нет данных профилирования, запустите POST /admin/profiler",
+                "deviceId": get_device_id(device_id)
+            }
+        )
+    filename = f"ai-service-{profiler.started_at.replace(':', '').replace('-', '')}.folded"
+    return PlainTextResponse(
+        profiler.folded(),
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.get("/admin/slow-requests", dependencies=[Depends(require_admin)])
+async def list_slow_requests(
+    limit: int = 20,
+    route: Optional[str] = None,
+    device_id: str = Header(None, alias="x-device-id")
+):
+    return {
+        "success": True,
+        "deviceId": get_device_id(device_id),
+        "slow_requests": slow_requests.stats(),
+        "requests": slow_requests.recent(limit, route)
+    }
+
+# Metrics endpoint (Prometheus text format)
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Обработчики ловят исключения и отвечают HTTPException 500: исходное
+# исключение остается в __context__, по нему и считается ai_http_exceptions_total
+@app.exception_handler(StarletteHTTPException)
+async def counting_http_exception_handler(request: Request, exc: StarletteHTTPException):
+    if exc.status_code >= 500 and exc.__context__ is not None:
+        http_exceptions.inc(route_label(request), type(exc.__context__).__name__)
+    return await http_exception_handler(request, exc)
+
 # Global exception handler
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     device_id = request.headers.get("x-device-id", "unknown")
+    http_exceptions.inc(route_label(request), type(exc).__name__)
     logger.error(f"Global exception: {str(exc)} - Device: {device_id}")
     
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=500,
         content={
             "success": False,
@@ -323,21 +1712,7 @@ async def global_exception_handler(request: Request, exc: Exception):
     )
 
 if __name__ == "__main__":
-    import uvicorn
-    
-    logger.info("🚀 AI Service запущен")
-    logger.info("📱 Device ID tracking: включен")
-    logger.info("🤖 Рекомендации: /recommendations")
-    logger.info("💰 Прогноз цен: /price-prediction")
-    logger.info("🏗️ Смета строительства: /construction-estimate")
-    logger.info("📊 Анализ рынка: /market-analysis")
-    logger.info("📚 Документация: /docs")
-    
-    uvicorn.run(
-        app, 
-        host="0.0.0.0", 
-        port=3005,
-        log_level="info"
-    )
-
-
+    # Точка входа - python -m src (src/__main__.py): при запуске как src.main
+    # процессы пула (spawn) заново импортируют этот модуль целиком
+    from src.__main__ import main
+    main()
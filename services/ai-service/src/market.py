@@ -0,0 +1,318 @@
+"""
+Инкрементальная аналитика рынка.
+
+Спрос и цены по категориям поддерживаются экспоненциально затухающими
+счетчиками с короткой и длинной постоянной времени и скользящим окном
+почасовых корзин заказов, предложение - текущим остатком и его недельным
+экспоненциальным средним. Все агрегаты обновляются по мере поступления
+событий заказов и каталога. Ответ эндпоинта собирается в снимок при
+обновлении и отдается из памяти без пересчета истории.
+"""
+
+import math
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+# Постоянные времени затухания, секунды
+SHORT_TAU = 24 * 3600.0
+LONG_TAU = 7 * 24 * 3600.0
+
+# Скользящее окно заказов: 24 почасовые корзины
+WINDOW_BUCKETS = 24
+BUCKET_SECONDS = 3600
+
+# Снимок пересобирается при чтении не чаще этого интервала, если событий не было
+SNAPSHOT_REFRESH_SECONDS = 60.0
+
+TOP_CATEGORIES = 3
+
+# Сезонные факторы по месяцам
+SEASONAL_FACTORS = {
+    1: "Зимний период: сниженный спрос",
+    2: "Зимний период: сниженный спрос",
+    3: "Подготовка к строительному сезону",
+    4: "Начало строительного сезона",
+    5: "Летний сезон строительства",
+    6: "Летний сезон строительства",
+    7: "Летний сезон строительства",
+    8: "Летний сезон строительства",
+    9: "Завершение строительного сезона",
+    10: "Осенний сезон: внутренняя отделка",
+    11: "Осенний сезон: внутренняя отделка",
+    12: "Зимний период: сниженный спрос",
+}
+
+
+class DecayedCounter:
+    """Сумма с экспоненциальным затуханием по времени"""
+
+    __slots__ = ("tau", "value", "updated")
+
+    def __init__(self, tau: float):
+        self.tau = tau
+        self.value = 0.0
+        self.updated: Optional[float] = None
+
+    def at(self, ts: float) -> float:
+        if self.updated is None:
+            return 0.0
+        return self.value * math.exp(-max(ts - self.updated, 0.0) / self.tau)
+
+    def add(self, amount: float, ts: float) -> None:
+        if self.updated is not None and ts < self.updated:
+            # Запоздавшее событие (дозагрузка, перестановка): к моменту updated
+            # его вклад уже затух, как если бы оно пришло вовремя
+            self.value += amount * math.exp(-(self.updated - ts) / self.tau)
+            return
+        self.value = self.at(ts) + amount
+        self.updated = ts
+
+    def rate(self, ts: float) -> float:
+        """Интенсивность в единицах за секунду"""
+        return self.at(ts) / self.tau
+
+
+class DecayedAverage:
+    """Экспоненциальное среднее кусочно-постоянного уровня с шагом по времени"""
+
+    __slots__ = ("tau", "level", "ema", "updated")
+
+    def __init__(self, tau: float):
+        self.tau = tau
+        self.level = 0.0
+        self.ema: Optional[float] = None
+        self.updated: Optional[float] = None
+
+    def at(self, ts: float) -> float:
+        # Между обновлениями уровень постоянен, среднее подтягивается к нему
+        if self.ema is None:
+            return self.level
+        return self.level + (self.ema - self.level) * math.exp(-max(ts - self.updated, 0.0) / self.tau)
+
+    def update(self, level: float, ts: float) -> None:
+        if self.updated is not None and ts < self.updated:
+            # Запоздавший снимок не подменяет более новый уровень: среднее
+            # получает его вклад за [ts, updated], как если бы он пришел вовремя
+            self.ema += (level - self.ema) * (1.0 - math.exp(-(self.updated - ts) / self.tau))
+            return
+        self.ema = self.at(ts) if self.ema is not None else level
+        self.level = level
+        self.updated = ts
+
+
+class CategoryStats:
+    """Агрегаты одной категории"""
+
+    __slots__ = (
+        "demand_short", "demand_long", "revenue_short", "revenue_long",
+        "supply", "buckets", "bucket_start",
+    )
+
+    def __init__(self):
+        self.demand_short = DecayedCounter(SHORT_TAU)
+        self.demand_long = DecayedCounter(LONG_TAU)
+        self.revenue_short = DecayedCounter(SHORT_TAU)
+        self.revenue_long = DecayedCounter(LONG_TAU)
+        self.supply = DecayedAverage(LONG_TAU)
+        self.buckets = [0.0] * WINDOW_BUCKETS
+        self.bucket_start = 0
+
+    def add_order(self, quantity: float, unit_price: Optional[float], ts: float) -> None:
+        self.demand_short.add(quantity, ts)
+        self.demand_long.add(quantity, ts)
+        if unit_price is not None:
+            self.revenue_short.add(quantity * unit_price, ts)
+            self.revenue_long.add(quantity * unit_price, ts)
+        bucket = int(ts // BUCKET_SECONDS)
+        self._advance(bucket)
+        if bucket > self.bucket_start - WINDOW_BUCKETS:
+            self.buckets[bucket % WINDOW_BUCKETS] += quantity
+
+    def set_supply(self, supply: float, ts: float) -> None:
+        self.supply.update(supply, ts)
+
+    def _advance(self, bucket: int) -> None:
+        # Обнуляем корзины, вышедшие из окна; не больше WINDOW_BUCKETS шагов
+        if bucket <= self.bucket_start:
+            return
+        for b in range(max(self.bucket_start + 1, bucket - WINDOW_BUCKETS + 1), bucket + 1):
+            self.buckets[b % WINDOW_BUCKETS] = 0.0
+        self.bucket_start = bucket
+
+    def window_total(self, ts: float) -> float:
+        self._advance(int(ts // BUCKET_SECONDS))
+        return sum(self.buckets)
+
+
+def _ratio_trend(short: float, long: float, labels=("increasing", "stable", "decreasing"), band: float = 0.1) -> str:
+    if long <= 0:
+        return labels[0] if short > 0 else labels[1]
+    ratio = short / long
+    if ratio > 1.0 + band:
+        return labels[0]
+    if ratio < 1.0 - band:
+        return labels[2]
+    return labels[1]
+
+
+def _price_trend(short: float, long: float) -> str:
+    if long <= 0 or short <= 0:
+        return "stable"
+    change = short / long - 1.0
+    if change > 0.05:
+        return "increase"
+    if change > 0.01:
+        return "moderate_increase"
+    if change < -0.05:
+        return "decrease"
+    if change < -0.01:
+        return "moderate_decrease"
+    return "stable"
+
+
+class MarketAnalytics:
+    """Инкрементальные агрегаты рынка со снимком для чтения за O(1)"""
+
+    def __init__(self, product_categories: Optional[Dict[str, str]] = None):
+        self.product_categories: Dict[str, str] = dict(product_categories or {})
+        self._categories: Dict[str, CategoryStats] = {}
+        self._product_supply: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.events_applied = 0
+        self._snapshot: Optional[dict] = None
+        self._snapshot_at = 0.0
+
+    @classmethod
+    def from_catalog(cls, catalog: dict, ts: Optional[float] = None) -> "MarketAnalytics":
+        """Начальное состояние: категории товаров и текущие остатки из снимка каталога"""
+        names = {c["id"]: c["name"] for c in catalog.get("categories", [])}
+        product_categories = {
+            p["id"]: names[p["categoryId"]] for p in catalog.get("products", []) if p.get("categoryId") in names
+        }
+        analytics = cls(product_categories)
+        analytics.apply_events(
+            (
+                {
+                    "type": "stock",
+                    "product_id": p["id"],
+                    "available": sum(w.get("available", 0) for w in p.get("warehouses", [])),
+                    "timestamp": ts,
+                }
+                for p in catalog.get("products", [])
+            ),
+        )
+        # Начальные остатки - это базовый уровень, а не рост предложения
+        for stats in analytics._categories.values():
+            stats.supply.ema = stats.supply.level
+        analytics._snapshot = None
+        return analytics
+
+    def _stats(self, category: str) -> CategoryStats:
+        stats = self._categories.get(category)
+        if stats is None:
+            stats = self._categories[category] = CategoryStats()
+        return stats
+
+    def apply_events(self, events: Iterable[dict]) -> int:
+        """Применяет события заказов и каталога, стоимость O(число событий)"""
+        applied = 0
+        now = time.time()
+        with self._lock:
+            for event in events:
+                ts = event.get("timestamp") or now
+                product_id = event["product_id"]
+                category = event.get("category") or self.product_categories.get(product_id)
+                if category is None:
+                    continue
+                self.product_categories.setdefault(product_id, category)
+                stats = self._stats(category)
+
+                if event["type"] == "order":
+                    stats.add_order(float(event.get("quantity") or 0.0), event.get("unit_price"), ts)
+                elif event["type"] == "stock" and event.get("available") is not None:
+                    available = float(event["available"])
+                    previous = self._product_supply.get(product_id, 0.0)
+                    self._product_supply[product_id] = available
+                    stats.set_supply(stats.supply.level + available - previous, ts)
+                else:
+                    continue
+                applied += 1
+            self.events_applied += applied
+            if applied:
+                self._snapshot = self._build_snapshot(now)
+                self._snapshot_at = now
+        return applied
+
+    def snapshot(self) -> dict:
+        """Текущий снимок аналитики; пересобирается только по событиям или раз в интервал"""
+        now = time.time()
+        snapshot = self._snapshot
+        if snapshot is None or now - self._snapshot_at > SNAPSHOT_REFRESH_SECONDS:
+            with self._lock:
+                self._snapshot = snapshot = self._build_snapshot(now)
+                self._snapshot_at = now
+        return snapshot
+
+    def _build_snapshot(self, now: float) -> dict:
+        # Стоимость O(число категорий), история заказов не пересматривается
+        demand_short = demand_long = 0.0
+        supply_level = supply_baseline = 0.0
+        price_change = price_weight = 0.0
+        categories = []
+        for name, stats in self._categories.items():
+            d_short = stats.demand_short.rate(now)
+            d_long = stats.demand_long.rate(now)
+            demand_short += d_short
+            demand_long += d_long
+            supply_level += stats.supply.level
+            supply_baseline += stats.supply.at(now)
+            price_short = _safe_div(stats.revenue_short.at(now), stats.demand_short.at(now))
+            price_long = _safe_div(stats.revenue_long.at(now), stats.demand_long.at(now))
+            # Общий ценовой тренд: изменения средних цен категорий, взвешенные текущим спросом
+            if price_short > 0 and price_long > 0:
+                price_change += d_short * (price_short / price_long - 1.0)
+                price_weight += d_short
+            categories.append({
+                "category": name,
+                "demand_trend": _ratio_trend(d_short, d_long),
+                "supply_trend": _ratio_trend(stats.supply.level, stats.supply.at(now), band=0.05),
+                "price_trend": _price_trend(price_short, price_long),
+                "orders_24h": stats.window_total(now),
+                "supply": stats.supply.level,
+                "_demand": d_short,
+            })
+        categories.sort(key=lambda c: c["_demand"], reverse=True)
+        top = [c for c in categories if c["_demand"] > 0][:TOP_CATEGORIES]
+        for c in categories:
+            del c["_demand"]
+
+        market_trends = {
+            "demand": _ratio_trend(demand_short, demand_long),
+            "supply": _ratio_trend(supply_level, supply_baseline, band=0.05),
+            "price_trend": _price_trend(1.0 + _safe_div(price_change, price_weight), 1.0),
+        }
+
+        recommendations: List[str] = []
+        for c in top:
+            if c["demand_trend"] == "increasing":
+                recommendations.append(f"Увеличить закупки: {c['category']}")
+            if c["price_trend"] in ("increase", "moderate_increase"):
+                recommendations.append(f"Мониторить цены: {c['category']}")
+        if not recommendations:
+            recommendations.append("Спрос стабилен, поддерживать текущие объемы закупок")
+
+        return {
+            "market_trends": market_trends,
+            "top_categories": [c["category"] for c in top],
+            "categories": categories,
+            "seasonal_factors": [SEASONAL_FACTORS[datetime.utcfromtimestamp(now).month]],
+            "recommendations": recommendations,
+            "events_applied": self.events_applied,
+            "updated_at": datetime.utcfromtimestamp(now).isoformat() + "Z",
+        }
+
+
+def _safe_div(a: float, b: float) -> float:
+    return a / b if b > 0 else 0.0
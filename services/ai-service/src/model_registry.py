@@ -0,0 +1,282 @@
+"""
+Реестр версий моделей на диске.
+
+    MODEL_REGISTRY_DIR/
+        CURRENT                  - имя активной версии (заменяется атомарно)
+        versions/<version>/
+            manifest.json        - версия, время создания, источники, файлы и размеры
+            recommender/         - массивы индекса рекомендаций и поискового индекса (.npy), метаданные
+            forecaster/          - обученные параметры прогноза цен по товарам (.npy)
+            copurchase/          - матрица совместных покупок (CSR, .npy), см. src.training
+            estimator/           - нормы расхода и снимок цен материалов (JSON)
+
+Версия пишется во временный каталог и переименовывается целиком, поэтому
+читатель никогда не видит недописанную версию. Массивы загружаются через mmap
+без копирования: страницы берутся из page cache и делятся между процессами.
+
+Использование (из каталога services/ai-service):
+    python -m src.model_registry publish --registry models --catalog data/catalog.json \\
+        --norms data/estimator_norms.json --histories prices.parquet
+    python -m src.model_registry list --registry models
+    python -m src.model_registry activate --registry models 20261018T120000Z-1a2b3c
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from src.copurchase import CoPurchaseMatrix
+from src.estimator import ConstructionEstimator, catalog_prices, load_norms
+from src.forecaster import ForecastModel, load_histories_file
+from src.recommender import RecommendationIndex, load_catalog
+
+# 2: поисковый индекс по триграммам (src.search) вместо словного TF-IDF
+# 3: индекс складов и предложений (src.geo) в recommender/
+# 4: остатки всех предложений складов, признаки товаров и sequence событий каталога
+MANIFEST_FORMAT = 4
+
+
+class RegistryError(ValueError):
+    """Версия не найдена или ее артефакты повреждены"""
+
+
+@dataclass(frozen=True)
+class ModelBundle:
+    """Согласованный набор моделей одной версии, подменяется в сервисе целиком"""
+    version: str
+    index: RecommendationIndex
+    estimator: ConstructionEstimator
+    forecasts: Optional[ForecastModel]
+    # Каталог массивов индекса на диске: процессы пула отображают его напрямую
+    index_dir: Optional[str] = None
+    copurchase: Optional[CoPurchaseMatrix] = None
+
+
+def new_version() -> str:
+    return f"{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}-{uuid.uuid4().hex[:6]}"
+
+
+def bundle_from_catalog(catalog: dict, norms: dict, forecasts: Optional[ForecastModel] = None) -> ModelBundle:
+    """Модели, построенные в памяти по снимку каталога (без реестра)"""
+    return ModelBundle(
+        version=f"catalog-{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}",
+        index=RecommendationIndex(catalog),
+        estimator=ConstructionEstimator(norms, catalog_prices(catalog)),
+        forecasts=forecasts,
+    )
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_json(path: str, data) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+class ModelRegistry:
+    """Каталог версионированных артефактов моделей"""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.versions_dir = os.path.join(root, "versions")
+
+    def version_dir(self, version: str) -> str:
+        return os.path.join(self.versions_dir, version)
+
+    def versions(self) -> List[str]:
+        if not os.path.isdir(self.versions_dir):
+            return []
+        return sorted(
+            v for v in os.listdir(self.versions_dir)
+            if not v.startswith(".") and os.path.isfile(os.path.join(self.versions_dir, v, "manifest.json"))
+        )
+
+    def current_version(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.root, "CURRENT"), "r", encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def manifest(self, version: Optional[str]) -> dict:
+        if not version:
+            raise RegistryError(f"No active model version in {self.root}")
+        path = os.path.join(self.version_dir(version), "manifest.json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise RegistryError(f"Model version not found: {version}")
+
+    def publish(
+        self,
+        index: RecommendationIndex,
+        norms: dict,
+        prices: Dict[str, float],
+        forecasts: Optional[ForecastModel] = None,
+        source: Optional[dict] = None,
+        activate: bool = True,
+        copurchase: Optional[CoPurchaseMatrix] = None,
+    ) -> str:
+        """Записывает новую версию и (по умолчанию) делает ее активной"""
+        if copurchase is not None and copurchase.product_ids != index.product_ids:
+            # Сервис обращается к товарам соседей по позициям индекса рекомендаций
+            raise RegistryError("Co-purchase matrix and recommendation index cover different products")
+        version = new_version()
+        os.makedirs(self.versions_dir, exist_ok=True)
+        tmp_dir = os.path.join(self.versions_dir, f".tmp-{version}")
+        try:
+            index.save(os.path.join(tmp_dir, "recommender"))
+            if forecasts is not None:
+                forecasts.save(os.path.join(tmp_dir, "forecaster"))
+            if copurchase is not None:
+                copurchase.save(os.path.join(tmp_dir, "copurchase"))
+            os.makedirs(os.path.join(tmp_dir, "estimator"))
+            _write_json(os.path.join(tmp_dir, "estimator", "norms.json"), norms)
+            _write_json(os.path.join(tmp_dir, "estimator", "prices.json"), prices)
+
+            files = {}
+            for base, _, names in os.walk(tmp_dir):
+                for name in names:
+                    path = os.path.join(base, name)
+                    rel = os.path.relpath(path, tmp_dir)
+                    files[rel] = {"size": os.path.getsize(path), "sha256": _sha256(path)}
+            _write_json(os.path.join(tmp_dir, "manifest.json"), {
+                "format": MANIFEST_FORMAT,
+                "version": version,
+                "created_at": datetime.utcnow().isoformat() + "Z",
+                "source": source or {},
+                "artifacts": {
+                    "recommender": {"products": len(index)},
+                    "forecaster": {"products": len(forecasts)} if forecasts is not None else None,
+                    "estimator": {"project_types": len(norms.get("project_types", []))},
+                    "copurchase": {
+                        "products": len(copurchase), "orders": copurchase.orders,
+                        "pairs": int(copurchase.counts.nnz), "top_k": copurchase.top_k,
+                    } if copurchase is not None else None,
+                },
+                "files": files,
+            })
+            os.rename(tmp_dir, self.version_dir(version))
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        if activate:
+            self.activate(version)
+        return version
+
+    def activate(self, version: str) -> None:
+        """Переключает CURRENT на версию (запись во временный файл и os.replace)"""
+        self.manifest(version)
+        tmp_path = os.path.join(self.root, f".CURRENT.{uuid.uuid4().hex}")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(version + "\n")
+        os.replace(tmp_path, os.path.join(self.root, "CURRENT"))
+
+    def verify(self, version: str, checksums: bool = False) -> None:
+        """Проверяет наличие и размеры файлов версии (и sha256 при checksums=True)"""
+        manifest = self.manifest(version)
+        directory = self.version_dir(version)
+        for rel, info in manifest["files"].items():
+            path = os.path.join(directory, rel)
+            if not os.path.isfile(path) or os.path.getsize(path) != info["size"]:
+                raise RegistryError(f"Model artifact is missing or truncated: {version}/{rel}")
+            if checksums and _sha256(path) != info["sha256"]:
+                raise RegistryError(f"Model artifact checksum mismatch: {version}/{rel}")
+
+    def load(self, version: Optional[str] = None, mmap_mode: Optional[str] = "r") -> ModelBundle:
+        """Загружает версию (по умолчанию активную); массивы отображаются в память"""
+        version = version or self.current_version()
+        if version is None:
+            raise RegistryError(f"No active model version in {self.root}")
+        if self.manifest(version).get("format") != MANIFEST_FORMAT:
+            raise RegistryError(f"Model version {version} has an outdated format, publish it again")
+        self.verify(version)
+        directory = self.version_dir(version)
+        estimator_dir = os.path.join(directory, "estimator")
+        with open(os.path.join(estimator_dir, "prices.json"), "r", encoding="utf-8") as f:
+            prices = json.load(f)
+        forecaster_dir = os.path.join(directory, "forecaster")
+        copurchase_dir = os.path.join(directory, "copurchase")
+        return ModelBundle(
+            version=version,
+            index=RecommendationIndex.load(os.path.join(directory, "recommender"), mmap_mode=mmap_mode),
+            estimator=ConstructionEstimator(load_norms(os.path.join(estimator_dir, "norms.json")), prices),
+            forecasts=ForecastModel.load(forecaster_dir, mmap_mode=mmap_mode) if os.path.isdir(forecaster_dir) else None,
+            index_dir=os.path.join(directory, "recommender"),
+            copurchase=CoPurchaseMatrix.load(copurchase_dir, mmap_mode=mmap_mode) if os.path.isdir(copurchase_dir) else None,
+        )
+
+    def prune(self, keep: int) -> List[str]:
+        """Удаляет старые версии, кроме keep последних и активной"""
+        current = self.current_version()
+        versions = self.versions()
+        removed = [v for v in versions[:max(len(versions) - keep, 0)] if v != current]
+        for version in removed:
+            shutil.rmtree(self.version_dir(version), ignore_errors=True)
+        return removed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="AI Service model registry")
+    parser.add_argument("--registry", default=os.getenv("MODEL_REGISTRY_DIR", "models"))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    publish = commands.add_parser("publish", help="build models from a catalog snapshot and publish a version")
+    publish.add_argument("--catalog", required=True)
+    publish.add_argument("--norms", required=True)
+    publish.add_argument("--histories", help="price histories (.npz/.parquet/.arrow) for the forecaster")
+    publish.add_argument("--no-activate", action="store_true")
+    publish.add_argument("--keep", type=int, default=0, help="prune to this many versions (0 = keep all)")
+
+    commands.add_parser("list", help="list versions")
+    activate = commands.add_parser("activate", help="make a version current")
+    activate.add_argument("version")
+    verify = commands.add_parser("verify", help="check artifact sizes and checksums")
+    verify.add_argument("version", nargs="?")
+    args = parser.parse_args(argv)
+
+    registry = ModelRegistry(args.registry)
+    if args.command == "publish":
+        catalog = load_catalog(args.catalog)
+        forecasts = None
+        if args.histories:
+            with open(args.histories, "rb") as f:
+                product_ids, values, mask = load_histories_file(f.read(), args.histories)
+            forecasts = ForecastModel.from_histories(product_ids, values, mask)
+        version = registry.publish(
+            RecommendationIndex(catalog),
+            load_norms(args.norms),
+            catalog_prices(catalog),
+            forecasts=forecasts,
+            source={"catalog": args.catalog, "norms": args.norms, "histories": args.histories},
+            activate=not args.no_activate,
+        )
+        print(version)
+        if args.keep:
+            registry.prune(args.keep)
+    elif args.command == "list":
+        current = registry.current_version()
+        for version in registry.versions():
+            print(f"{'*' if version == current else ' '} {version}")
+    elif args.command == "activate":
+        registry.activate(args.version)
+    elif args.command == "verify":
+        registry.verify(args.version or registry.current_version(), checksums=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
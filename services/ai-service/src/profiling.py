@@ -0,0 +1,259 @@
+"""
+Профилирование работающего сервиса без внешних зависимостей.
+
+SamplingProfiler по запросу администратора на заданное время снимает стеки
+всех потоков процесса (sys._current_frames) с заданным интервалом и копит их
+в формате folded stacks ("поток;функция;функция число"), который принимают
+flamegraph.pl, inferno и speedscope.
+
+SlowRequestRecorder сохраняет профиль запросов дольше порога: время этапов
+RequestTimer и сводку стеков. Пока запрос в работе дольше порога, фоновый
+поток снимает стеки занятых потоков (цикл событий, пул скоринга) и относит
+их ко всем таким запросам. Профили хранятся в кольцевом буфере последних
+запросов. Процессы пула инференса (INFERENCE_MODE=process) не профилируются.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from types import CodeType
+from typing import TYPE_CHECKING, Dict, List, Optional, Set
+
+if TYPE_CHECKING:
+    from src.metrics import RequestTimer
+
+# Вершина стека потока, который ждет работу: в профилях медленных запросов такие стеки не нужны
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+# Ограничения числа различных стеков: за сессию профилировщика и на один запрос
+MAX_PROFILE_STACKS = 20000
+MAX_REQUEST_STACKS = 200
+# Стеков в профиле медленного запроса
+TOP_REQUEST_STACKS = 20
+
+_labels: Dict[CodeType, str] = {}
+
+
+def _label(code: CodeType) -> str:
+    label = _labels.get(code)
+    if label is None:
+        directory, filename = os.path.split(code.co_filename)
+        name = getattr(code, "co_qualname", code.co_name)
+        label = f"{name} ({os.path.basename(directory)}/{filename}:{code.co_firstlineno})"
+        _labels[code] = label
+    return label
+
+
+def sample_stacks(exclude: Set[int], include_idle: bool = True) -> List[str]:
+    """Текущие стеки потоков процесса в формате folded (от потока к вершине стека)"""
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stacks = []
+    for ident, frame in sys._current_frames().items():
+        if ident in exclude:
+            continue
+        code = frame.f_code
+        if not include_idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+            continue
+        labels = []
+        while frame is not None:
+            labels.append(_label(frame.f_code))
+            frame = frame.f_back
+        labels.append(names.get(ident, f"thread-{ident}"))
+        stacks.append(";".join(reversed(labels)))
+    return stacks
+
+
+class SamplingProfiler:
+    """Сэмплирующий профилировщик потоков процесса на ограниченное время"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.dropped = 0
+        self.started_at: Optional[str] = None
+        self.seconds = 0.0
+        self.interval = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float, interval: float) -> bool:
+        """Запускает сессию; False - предыдущая сессия еще идет"""
+        with self._lock:
+            if self.running:
+                return False
+            self.stacks = Counter()
+            self.samples = 0
+            self.dropped = 0
+            self.started_at = datetime.utcnow().isoformat() + "Z"
+            self.seconds = seconds
+            self.interval = interval
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        deadline = time.monotonic() + self.seconds
+        exclude = {threading.get_ident()}
+        while time.monotonic() < deadline:
+            stacks = sample_stacks(exclude)
+            with self._lock:
+                for stack in stacks:
+                    if stack in self.stacks or len(self.stacks) < MAX_PROFILE_STACKS:
+                        self.stacks[stack] += 1
+                    else:
+                        self.dropped += 1
+                self.samples += 1
+            if self._stop.wait(self.interval):
+                break
+
+    def folded(self) -> str:
+        """Снятые стеки в формате folded, самые частые первыми"""
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "running": self.running,
+                "started_at": self.started_at,
+                "seconds": self.seconds,
+                "interval_ms": round(self.interval * 1000, 3),
+                "samples": self.samples,
+                "stacks": len(self.stacks),
+                "dropped": self.dropped
+            }
+
+
+class _InFlight:
+    __slots__ = ("method", "route", "path", "device_id", "timer", "stacks", "samples")
+
+    def __init__(self, method: str, route: str, path: str, device_id: str, timer: "RequestTimer"):
+        self.method = method
+        self.route = route
+        self.path = path
+        self.device_id = device_id
+        self.timer = timer
+        self.stacks: Counter = Counter()
+        self.samples = 0
+
+
+class SlowRequestRecorder:
+    """Профили запросов дольше порога в кольцевом буфере"""
+
+    def __init__(self, threshold: float, capacity: int = 100, interval: float = 0.01):
+        self.threshold = threshold
+        self.interval = interval
+        self.records: deque = deque(maxlen=capacity)
+        self.captured = 0
+        self._inflight: Dict[int, _InFlight] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def start(self) -> None:
+        if not self.enabled or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="slow-request-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def begin(self, method: str, route: str, path: str, device_id: str, timer: "RequestTimer") -> Optional[_InFlight]:
+        if not self.enabled:
+            return None
+        request = _InFlight(method, route, path, device_id, timer)
+        with self._lock:
+            self._inflight[id(request)] = request
+        return request
+
+    def finish(self, request: Optional[_InFlight], status: int, duration: float) -> bool:
+        """Снимает запрос с учета; True - запрос дольше порога и его профиль сохранен"""
+        if request is None:
+            return False
+        with self._lock:
+            self._inflight.pop(id(request), None)
+        if duration < self.threshold:
+            return False
+        record = {
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "method": request.method,
+            "route": request.route,
+            "path": request.path,
+            "status": status,
+            "device_id": request.device_id,
+            "duration_ms": round(duration * 1000, 2),
+            "stages_ms": {stage: round(seconds * 1000, 2) for stage, seconds in request.timer.stages.items()},
+            "samples": request.samples,
+            "stacks": [
+                {"stack": stack, "count": count}
+                for stack, count in request.stacks.most_common(TOP_REQUEST_STACKS)
+            ]
+        }
+        with self._lock:
+            self.records.append(record)
+            self.captured += 1
+        return True
+
+    def _run(self) -> None:
+        # Стеки снимаются только пока есть запросы дольше порога, остальное время поток спит
+        exclude = {threading.get_ident()}
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            with self._lock:
+                slow = [r for r in self._inflight.values() if now - r.timer.start >= self.threshold]
+            if not slow:
+                continue
+            stacks = sample_stacks(exclude, include_idle=False)
+            with self._lock:
+                for request in slow:
+                    request.samples += 1
+                    for stack in stacks:
+                        if stack in request.stacks or len(request.stacks) < MAX_REQUEST_STACKS:
+                            request.stacks[stack] += 1
+
+    def recent(self, limit: int = 20, route: Optional[str] = None) -> List[dict]:
+        """Последние профили, новые первыми; route - шаблон маршрута"""
+        with self._lock:
+            records = list(self.records)
+        records.reverse()
+        if route is not None:
+            records = [r for r in records if r["route"] == route]
+        return records[:max(limit, 0)]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "threshold_ms": round(self.threshold * 1000, 3),
+                "capacity": self.records.maxlen,
+                "stored": len(self.records),
+                "captured": self.captured,
+                "in_flight": len(self._inflight)
+            }
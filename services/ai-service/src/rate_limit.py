@@ -0,0 +1,160 @@
+"""
+Защита эндпоинтов моделей от клиентов, повторяющих запросы в цикле.
+
+TokenBucketLimiter - token bucket на устройство (x-device-id): в среднем
+rate запросов в секунду, всплеск до burst. Корзина, простоявшая burst / rate
+секунд, снова полная и ничем не отличается от новой, поэтому такие корзины
+удаляются; число корзин дополнительно ограничено max_keys с вытеснением по LRU.
+
+Запросы без x-device-id считаются по адресу клиента. За обратным прокси
+(nginx) адрес соединения - адрес прокси, поэтому client_address берет адрес
+из X-Forwarded-For, но только если соединение пришло от доверенного прокси:
+иначе клиент мог бы подставить любой адрес и получать новую корзину.
+
+SingleFlight - одинаковые запросы, пришедшие пока первый еще считается, ждут
+его результат вместо повторного расчета.
+"""
+
+import asyncio
+import functools
+import ipaddress
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, TypeVar, Union
+
+T = TypeVar("T")
+IPNetwork = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+def parse_networks(spec: str) -> List[IPNetwork]:
+    """Сети из строки через запятую: адреса и CIDR ("127.0.0.1, 10.0.0.0/8")"""
+    return [ipaddress.ip_network(part.strip(), strict=False) for part in spec.split(",") if part.strip()]
+
+
+def _trusted(address: str, trusted: Sequence[IPNetwork]) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted)
+
+
+def client_address(peer: Optional[str], forwarded_for: Optional[str], trusted: Sequence[IPNetwork]) -> str:
+    """
+    Адрес клиента для ограничения частоты.
+
+    X-Forwarded-For учитывается, только если соединение пришло от доверенного
+    прокси; цепочка читается справа, первый недоверенный адрес - клиент
+    (левее него значения задает сам клиент и им верить нельзя).
+    """
+    address = peer or "unknown"
+    if not forwarded_for or not _trusted(address, trusted):
+        return address
+    for hop in reversed([hop.strip() for hop in forwarded_for.split(",") if hop.strip()]):
+        address = hop
+        if not _trusted(hop, trusted):
+            break
+    return address
+
+
+class TokenBucketLimiter:
+    """Token bucket по ключу клиента с ограниченной памятью"""
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 100000):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_keys = max_keys
+        # Порядок - по времени последнего запроса, в начале самые давние корзины
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def acquire(self, key: str, now: Optional[float] = None) -> float:
+        """Списывает токен; 0 - запрос разрешен, иначе секунды до появления токена"""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            if bucket is None:
+                tokens = float(self.burst)
+            else:
+                tokens = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+            if tokens >= 1.0:
+                tokens -= 1.0
+                wait = 0.0
+                self.allowed += 1
+            else:
+                wait = (1.0 - tokens) / self.rate
+                self.rejected += 1
+            self._buckets[key] = [tokens, now]
+            self._evict(now)
+            return wait
+
+    def _evict(self, now: float) -> None:
+        # Полные корзины удаляются без потери состояния, сверх лимита - самые давние
+        idle = self.burst / self.rate
+        while self._buckets:
+            updated = next(iter(self._buckets.values()))[1]
+            if now - updated < idle and len(self._buckets) <= self.max_keys:
+                break
+            self._buckets.popitem(last=False)
+            if now - updated < idle:
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "rate": self.rate,
+                "burst": self.burst,
+                "buckets": len(self._buckets),
+                "max_buckets": self.max_keys,
+                "allowed": self.allowed,
+                "rejected": self.rejected,
+                "evictions": self.evictions
+            }
+
+
+class SingleFlight:
+    """Объединение одинаковых запросов в работе (в пределах event loop)"""
+
+    def __init__(self):
+        self._calls: Dict[str, "asyncio.Future"] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        Результат func() для ключа key; пока расчет идет, повторы ждут его же.
+
+        Расчет выполняется отдельной задачей: отключение клиента, запустившего
+        его, не отменяет ответ остальным. Ошибку расчета получают все ожидающие.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(functools.partial(self._forget, key))
+            self.calls += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: "asyncio.Future") -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Ошибку забирает хотя бы один ожидающий; если все отменены - гасим предупреждение
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._calls), "calls": self.calls, "shared": self.shared}
+
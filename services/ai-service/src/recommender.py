@@ -0,0 +1,423 @@
+"""
+Векторизованный движок рекомендаций товаров.
+
+Каталог (Product, Category, ProductAttribute, WarehouseProduct из catalog-service)
+один раз при старте превращается в поисковый индекс по триграммам (src.search),
+пространственный индекс складов (src.geo) и массивы NumPy (цена, остаток,
+категория). Запрос скорится одной матричной операцией по всем товарам, фильтры
+по категории, бюджету и наличию применяются масками, top-k выбирается
+частичной сортировкой. С местоположением покупателя цена товара берется на
+ближайшем складе с остатком и учитывает доставку.
+
+События каталога (src.catalog_sync) меняют товары, цены и остатки на месте:
+затрагиваются только элементы измененных товаров, массивы, отображенные из
+файлов, при первом изменении копируются в память процесса.
+"""
+
+import json
+import os
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.geo import DEFAULT_RATE_PER_TON_KM, OfferChange, WarehouseIndex, delivery_cost
+from src.search import MIN_SCORE, SearchIndex
+
+# Веса априорной части скора (без поискового запроса)
+FEATURED_WEIGHT = 0.1
+STOCK_WEIGHT = 0.05
+
+# Штраф за долю доставки в цене с доставкой (при известном местоположении)
+DELIVERY_WEIGHT = 0.3
+
+# Размер блока запросов при пакетном скоринге, ограничивает память B x N
+SCORE_BLOCK = 256
+
+# Массивы индекса, сохраняемые в .npy для отображения в память (mmap)
+ARRAY_FIELDS = ("category", "price", "stock", "prior", "in_stock", "featured", "active")
+
+
+class DeliveryQuote(NamedTuple):
+    """Цены товаров для одной точки доставки (массивы по всем товарам)"""
+    warehouse: np.ndarray  # позиция ближайшего склада с остатком, -1 - нет среди ближайших
+    distance: np.ndarray   # км по прямой
+    price: np.ndarray      # цена на этом складе (без склада - минимальная по каталогу)
+    cost: np.ndarray       # доставка единицы товара
+    landed: np.ndarray     # цена с доставкой
+
+
+class CatalogUpdate(NamedTuple):
+    """Итог применения пачки событий каталога"""
+    applied: int
+    skipped: int            # товар или склад не из индекса, предложение без цены
+    products: List[str]     # товары с изменившимися ценами или остатками
+
+
+def _writable(owner, name: str) -> np.ndarray:
+    """
+    Массив для изменения на месте: отображенный из файла копируется один раз.
+
+    Копируются только векторы длины N (категория, цены, остатки, вес - около
+    26 байт на товар на процесс), матрицы поиска и предложений остаются
+    отображенными, а изменения копятся в их дельта-сегментах. Копии живут до
+    следующей публикации хранилища (см. needs_compaction).
+    """
+    array = getattr(owner, name)
+    if not array.flags.writeable:
+        array = np.array(array)
+        setattr(owner, name, array)
+    return array
+
+
+def load_catalog(path: str) -> dict:
+    """Загружает снимок каталога (JSON в формате моделей catalog-service)"""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class RecommendationIndex:
+    """Предвычисленный индекс товаров для рекомендаций"""
+
+    def __init__(self, catalog: dict):
+        categories = catalog.get("categories", [])
+        products = [p for p in catalog.get("products", []) if p.get("isActive", True)]
+
+        self.category_ids: List[str] = [c["id"] for c in categories]
+        self.category_names: List[str] = [c["name"] for c in categories]
+        category_pos = {cid: i for i, cid in enumerate(self.category_ids)}
+        self._category_lookup = {name.lower(): i for i, name in enumerate(self.category_names)}
+
+        # Потомки категорий: фильтр по родителю включает все дочерние категории
+        parents = [category_pos.get(c.get("parentId")) for c in categories]
+        self._category_members: List[np.ndarray] = []
+        for i in range(len(categories)):
+            members = [j for j in range(len(categories)) if self._is_descendant(j, i, parents)]
+            self._category_members.append(np.array(members, dtype=np.int32))
+
+        self._category_masks: Dict[int, np.ndarray] = {}
+
+        n = len(products)
+        self.product_ids: List[str] = [p["id"] for p in products]
+        self.names: List[str] = [p["name"] for p in products]
+        self.category: np.ndarray = np.array(
+            [category_pos.get(p.get("categoryId"), -1) for p in products], dtype=np.int32
+        )
+        self.price = np.full(n, np.inf, dtype=np.float32)
+        self.stock = np.zeros(n, dtype=np.float32)
+        self.featured = np.zeros(n, dtype=np.float32)
+        self.active = np.ones(n, dtype=bool)
+        # Последнее событие каталога, учтенное в индексе (снимок может его указывать)
+        self.sequence = int(catalog.get("sequence") or 0)
+
+        for i, p in enumerate(products):
+            self.featured[i] = 1.0 if p.get("isFeatured") else 0.0
+            available = [w for w in p.get("warehouses", []) if w.get("available", 0) > 0]
+            if available:
+                self.price[i] = min(float(w["unitPrice"]) for w in available)
+                self.stock[i] = sum(w["available"] for w in available)
+
+        self.product_positions: Dict[str, int] = {pid: i for i, pid in enumerate(self.product_ids)}
+
+        # Нечеткий поиск по названию, бренду, модели, категории и атрибутам
+        self.search = SearchIndex.build([self._product_text(p, categories, category_pos) for p in products])
+        # Склады с координатами и предложения товаров по складам
+        self.geo = WarehouseIndex(catalog.get("warehouses", []), products)
+
+        # Масштаб остатка фиксируется при сборке: события не пересчитывают весь каталог
+        log_stock = np.log1p(self.stock)
+        self.stock_scale = float(log_stock.max()) if n and log_stock.max() > 0 else 1.0
+        self.prior = (FEATURED_WEIGHT * self.featured + STOCK_WEIGHT * log_stock / self.stock_scale).astype(np.float32)
+        self.in_stock = self.stock > 0
+
+    @staticmethod
+    def _is_descendant(node: int, ancestor: int, parents: List[Optional[int]]) -> bool:
+        seen = set()
+        while node is not None and node not in seen:
+            if node == ancestor:
+                return True
+            seen.add(node)
+            node = parents[node]
+        return False
+
+    @staticmethod
+    def _product_text(product: dict, categories: List[dict], category_pos: Dict[str, int]) -> str:
+        parts = [product.get("name"), product.get("brand"), product.get("model")]
+        pos = category_pos.get(product.get("categoryId"))
+        if pos is not None:
+            parts.append(categories[pos]["name"])
+        for attr in product.get("attributes", []):
+            parts.append(attr.get("value"))
+        return " ".join(part for part in parts if part)
+
+    def apply_events(self, events: Sequence[dict]) -> CatalogUpdate:
+        """
+        Применяет события каталога с sequence новее уже учтенного, по порядку.
+
+        product - полная запись товара (название, категория, атрибуты, активность),
+        price и stock - цена и остаток товара на складе (WarehouseProduct).
+        Стоимость - O(измененных товаров и их предложений). Товаров, которых
+        нет в индексе, события не добавляют: новые позиции появляются при
+        пересборке версии моделей.
+        """
+        categories = [{"id": cid, "name": name} for cid, name in zip(self.category_ids, self.category_names)]
+        category_pos = {cid: i for i, cid in enumerate(self.category_ids)}
+        texts: Dict[int, str] = {}
+        offer_changes: List[OfferChange] = []
+        changed = set()
+        applied = skipped = 0
+        for event in events:
+            if event["sequence"] <= self.sequence:
+                continue
+            self.sequence = event["sequence"]
+            product = event.get("product") or {}
+            i = self.product_positions.get(event.get("product_id") or product.get("id"))
+            if i is None:
+                skipped += 1
+                continue
+            if event["type"] == "product":
+                cat = category_pos.get(product.get("categoryId"), -1)
+                if cat != self.category[i]:
+                    _writable(self, "category")[i] = cat
+                    # Снимок словаря: потоки скоринга добавляют маски в _category_mask
+                    for member, mask in list(self._category_masks.items()):
+                        mask[i] = cat in self._category_members[member]
+                self.names[i] = product.get("name") or self.names[i]
+                _writable(self, "featured")[i] = 1.0 if product.get("isFeatured") else 0.0
+                _writable(self, "active")[i] = product.get("isActive", True)
+                if product.get("weight") is not None:
+                    _writable(self.geo, "weight")[i] = float(product["weight"])
+                # Неактивный товар пропадает из поиска вместе с текстом
+                texts[i] = self._product_text(product, categories, category_pos) if self.active[i] else ""
+                changed.add(i)
+            else:
+                w = self.geo.warehouse_positions.get(event.get("warehouse_id"))
+                if w is None:
+                    skipped += 1
+                    continue
+                offer_changes.append(OfferChange(i, w, event.get("unit_price"), event.get("available")))
+            applied += 1
+
+        offers_changed, offers_skipped = self.geo.update_offers(offer_changes)
+        changed.update(offers_changed)
+        if texts:
+            self.search.update(list(texts), list(texts.values()))
+        price, stock = _writable(self, "price"), _writable(self, "stock")
+        prior, in_stock = _writable(self, "prior"), _writable(self, "in_stock")
+        for i in changed:
+            _, prices, available = self.geo.product_row(i)
+            stocked = available > 0
+            price[i] = prices[stocked].min() if stocked.any() else np.inf
+            stock[i] = available[stocked].sum()
+            prior[i] = FEATURED_WEIGHT * self.featured[i] + STOCK_WEIGHT * min(1.0, np.log1p(stock[i]) / self.stock_scale)
+            in_stock[i] = self.active[i] and stock[i] > 0
+        return CatalogUpdate(
+            applied - offers_skipped, skipped + offers_skipped, [self.product_ids[i] for i in sorted(offers_changed)]
+        )
+
+    def needs_compaction(self) -> bool:
+        """Дельта-сегменты поиска или предложений выросли до порога слияния"""
+        return self.search.needs_compaction() or self.geo.needs_compaction()
+
+    def compact(self) -> None:
+        """
+        Сливает дельта-сегменты поиска и предложений с основными матрицами.
+
+        Индексы, отображенные из хранилища (load с mmap_mode), сами не сливаются
+        (auto_compact=False): слияние скопировало бы общие матрицы в память
+        каждого процесса. Его делает владелец хранилища - сливает свою копию и
+        публикует новое хранилище (src.main.compact_index).
+        """
+        self.search.compact()
+        self.geo.compact()
+
+    def save(self, directory: str) -> None:
+        """Сохраняет индекс: массивы в .npy (пригодны для mmap), метаданные в JSON"""
+        os.makedirs(directory, exist_ok=True)
+        for name in ARRAY_FIELDS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        self.search.save(directory)
+        self.geo.save(directory)
+        meta = {
+            "product_ids": self.product_ids,
+            "names": self.names,
+            "category_ids": self.category_ids,
+            "category_names": self.category_names,
+            "category_members": [m.tolist() for m in self._category_members],
+            "stock_scale": self.stock_scale,
+            "sequence": self.sequence,
+        }
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory: str, mmap_mode: Optional[str] = "r") -> "RecommendationIndex":
+        """
+        Загружает индекс, сохраненный save().
+
+        При mmap_mode="r" массивы отображаются в память без копирования, поэтому
+        несколько процессов, загрузивших один каталог, делят одну копию страниц.
+        """
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls.__new__(cls)
+        for name in ARRAY_FIELDS:
+            setattr(index, name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode))
+        index.search = SearchIndex.load(directory, mmap_mode=mmap_mode)
+        index.geo = WarehouseIndex.load(directory, mmap_mode=mmap_mode)
+        index.product_ids = meta["product_ids"]
+        index.product_positions = {pid: i for i, pid in enumerate(index.product_ids)}
+        index.names = meta["names"]
+        index.category_ids = meta["category_ids"]
+        index.category_names = meta["category_names"]
+        index._category_lookup = {name.lower(): i for i, name in enumerate(index.category_names)}
+        index._category_members = [np.array(m, dtype=np.int32) for m in meta["category_members"]]
+        index._category_masks = {}
+        index.stock_scale = meta["stock_scale"]
+        index.sequence = meta["sequence"]
+        return index
+
+    def _category_mask(self, cat_pos: int) -> np.ndarray:
+        mask = self._category_masks.get(cat_pos)
+        if mask is None:
+            mask = np.isin(self.category, self._category_members[cat_pos])
+            self._category_masks[cat_pos] = mask
+        return mask
+
+    def __len__(self) -> int:
+        return len(self.product_ids)
+
+    def _encode(self, search_queries: Sequence[Optional[str]], categories: Sequence[Optional[str]]):
+        """Строит разреженную матрицу запросов B x V и маски категорий"""
+        texts: List[Optional[str]] = []
+        category_filter: List[Optional[np.ndarray]] = []
+        for text, category in zip(search_queries, categories):
+            cat_pos = self._category_lookup.get(category.lower()) if category else None
+            if category and cat_pos is None:
+                # Неизвестная категория работает как часть поискового запроса
+                text = f"{text or ''} {category}"
+            texts.append(text)
+            category_filter.append(self._category_mask(cat_pos) if cat_pos is not None else None)
+        return self.search.encode(texts), category_filter
+
+    def delivery_quote(
+        self, latitude: float, longitude: float, rate_per_ton_km: float = DEFAULT_RATE_PER_TON_KM
+    ) -> DeliveryQuote:
+        """Цены с доставкой до точки по ближайшим складам (KD-дерево, без перебора всех складов)"""
+        warehouse, distance, price = self.geo.nearest_stock(latitude, longitude)
+        # Товар не найден на ближайших складах: минимальная цена каталога и нижняя оценка расстояния
+        price = np.where(warehouse >= 0, price, self.price)
+        cost = delivery_cost(self.geo.weight, distance, rate_per_ton_km).astype(np.float32)
+        return DeliveryQuote(warehouse, distance, price, cost, price + cost)
+
+    def recommend_batch(
+        self,
+        search_queries: Sequence[Optional[str]],
+        categories: Sequence[Optional[str]],
+        budgets: Sequence[Optional[float]],
+        limits: Sequence[int],
+        locations: Optional[Sequence[Optional[Tuple[float, float]]]] = None,
+        delivery_rate: float = DEFAULT_RATE_PER_TON_KM,
+    ) -> List[List[dict]]:
+        """
+        Скорит пачку запросов матричным умножением Q x X^T и возвращает top-k для каждого.
+
+        locations - (широта, долгота) покупателя для запроса или None: бюджет
+        сравнивается с ценой с доставкой, а доля доставки снижает скор.
+        """
+        results: List[List[dict]] = []
+        if not len(self):
+            return [[] for _ in search_queries]
+        if locations is None:
+            locations = [None] * len(search_queries)
+        for start in range(0, len(search_queries), SCORE_BLOCK):
+            end = start + SCORE_BLOCK
+            queries, category_filter = self._encode(search_queries[start:end], categories[start:end])
+            block_budgets = np.array(
+                [np.inf if b is None else b for b in budgets[start:end]], dtype=np.float32
+            )
+
+            text_scores = self.search.scores(queries)
+            scores = text_scores + self.prior
+            valid = self.in_stock & (self.price[None, :] <= block_budgets[:, None])
+            quotes: List[Optional[DeliveryQuote]] = []
+            for row, location in enumerate(locations[start:end]):
+                quote = self.delivery_quote(location[0], location[1], delivery_rate) if location is not None else None
+                if quote is not None:
+                    valid[row] = self.in_stock & (quote.landed <= block_budgets[row])
+                    # Тяжелые дешевые товары с дальних складов опускаются ниже
+                    scores[row] -= DELIVERY_WEIGHT * quote.cost / np.maximum(quote.landed, 1e-6)
+                quotes.append(quote)
+            for row, mask in enumerate(category_filter):
+                if mask is not None:
+                    valid[row] &= mask
+            # С поисковым запросом кандидатами считаются только товары с текстовым совпадением
+            # (случайные общие триграммы ниже порога MIN_SCORE не считаются совпадением)
+            has_query = np.diff(queries.indptr) > 0
+            text_scores[text_scores < MIN_SCORE] = 0.0
+            valid &= ~has_query[:, None] | (text_scores > 0)
+            scores = np.where(valid, scores, -np.inf)
+
+            block_limits = np.clip(np.asarray(limits[start:end], dtype=np.int64), 0, len(self))
+            k = int(block_limits.max()) if block_limits.size else 0
+            if k == 0:
+                results.extend([] for _ in range(scores.shape[0]))
+                continue
+            # Порог k-го по величине скора для всех строк одной частичной сортировкой
+            kth = -np.partition(-scores, k - 1, axis=1)[:, k - 1]
+            for row in range(scores.shape[0]):
+                results.append(self._top_k(
+                    scores[row],
+                    text_scores[row],
+                    kth[row],
+                    int(block_limits[row]),
+                    has_query=bool(has_query[row]),
+                    budget=block_budgets[row],
+                    quote=quotes[row],
+                ))
+        return results
+
+    def _top_k(
+        self,
+        scores: np.ndarray,
+        text_scores: np.ndarray,
+        kth: float,
+        k: int,
+        has_query: bool,
+        budget: float,
+        quote: Optional[DeliveryQuote] = None,
+    ) -> List[dict]:
+        candidates = np.flatnonzero(scores >= kth)
+        candidates = candidates[np.isfinite(scores[candidates])]
+        # Детерминированный порядок: по убыванию скора, при равенстве по позиции в каталоге,
+        # поэтому результат не зависит от размера пачки
+        top = candidates[np.lexsort((candidates, -scores[candidates]))][:k]
+
+        items = []
+        for i in top:
+            confidence = float(min(1.0, max(0.0, scores[i])))
+            if has_query and text_scores[i] > 0:
+                reason = "Соответствует вашему запросу"
+            elif np.isfinite(budget):
+                reason = "Соответствует вашему бюджету"
+            else:
+                reason = "Популярный выбор для вашей категории"
+            cat = self.category[i]
+            item = {
+                "product_id": self.product_ids[i],
+                "name": self.names[i],
+                "category": self.category_names[cat] if cat >= 0 else None,
+                "price": round(float(self.price[i]), 2),
+                "confidence": round(confidence, 4),
+                "reason": reason,
+            }
+            if quote is not None:
+                warehouse = quote.warehouse[i]
+                item.update({
+                    "price": round(float(quote.price[i]), 2),
+                    "warehouse_id": self.geo.warehouse_ids[warehouse] if warehouse >= 0 else None,
+                    "distance_km": round(float(quote.distance[i]), 1),
+                    "delivery_cost": round(float(quote.cost[i]), 2),
+                    "total_price": round(float(quote.landed[i]), 2),
+                })
+            items.append(item)
+        return items
@@ -0,0 +1,124 @@
+"""
+Кэш ответов идемпотентных эндпоинтов.
+
+Ключ - канонический хеш модели запроса (JSON с сортировкой ключей) вместе с
+именем эндпоинта и версией данных, от которых зависит ответ. Записи живут
+TTL секунд и вытесняются по LRU при превышении числа записей или объема.
+Кэшируется ответ без deviceId, поэтому одна запись обслуживает все устройства;
+ETag считается по содержимому и позволяет отвечать клиентам 304.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from pydantic import BaseModel
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def canonical_json(value: Any) -> bytes:
+    if isinstance(value, BaseModel):
+        value = value.model_dump(mode="json")
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    payload: dict
+    etag: str
+    size: int
+    expires_at: float
+
+
+class ResponseCache:
+    """TTL + LRU кэш ответов с учетом занимаемой памяти"""
+
+    def __init__(self, maxsize: int = 10000, max_bytes: int = 64 * 1024 * 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._items: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.not_modified = 0
+
+    def key(self, endpoint: str, request: Any = None, version: Any = None) -> str:
+        """Ключ кэша: эндпоинт, версия данных и канонический хеш запроса"""
+        body = canonical_json(request) if request is not None else b""
+        return f"{endpoint}:{version}:{_digest(body)}"
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and entry.expires_at <= now:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def entry(self, payload: dict, ttl: Optional[float] = None) -> CachedResponse:
+        """Запись с ETag для ответа, без сохранения в кэше"""
+        body = canonical_json(payload)
+        return CachedResponse(
+            payload=payload,
+            etag=f'"{_digest(body)}"',
+            size=len(body),
+            expires_at=time.monotonic() + (self.ttl if ttl is None else ttl),
+        )
+
+    def put(self, key: str, payload: dict, ttl: Optional[float] = None) -> CachedResponse:
+        entry = self.entry(payload, ttl)
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+            self._items[key] = entry
+            self.bytes += entry.size
+            while self._items and (len(self._items) > self.maxsize or self.bytes > self.max_bytes):
+                self._remove(next(iter(self._items)))
+                self.evictions += 1
+        return entry
+
+    def _remove(self, key: str) -> None:
+        self.bytes -= self._items.pop(key).size
+
+    def record_not_modified(self) -> None:
+        with self._lock:
+            self.not_modified += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "maxsize": self.maxsize,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "not_modified": self.not_modified,
+            }
@@ -0,0 +1,289 @@
+"""
+Нечеткий полнотекстовый поиск по товарам на русском языке.
+
+Текст нормализуется (регистр, ё -> е), слова приводятся к основе легким
+стеммером (отсечение окончаний), и каждое слово дает термы: основу целиком и
+символьные триграммы основы с границами слова. Опечатки и словоформы
+("кирпичь", "цемента м500") совпадают с товаром по большей части триграмм.
+
+Индекс - разреженная TF-IDF матрица товаров по термам (строки нормированы
+по L2) и ее транспонированная копия, то есть инвертированный индекс: запрос
+скорится умножением разреженного вектора запроса, затрагивая только списки
+товаров своих термов.
+
+Изменения каталога применяются инкрементально: измененные строки попадают в
+небольшой дельта-сегмент, а строки основной матрицы помечаются устаревшими.
+Когда дельта вырастает, сегменты сливаются без повторного разбора текстов.
+"""
+
+import functools
+import json
+import os
+import re
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+_WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+_CYRILLIC_RE = re.compile(r"^[а-я]+$")
+
+# Окончания существительных и прилагательных, от длинных к коротким
+_ENDINGS = tuple(sorted({
+    "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ией",
+    "ая", "яя", "ое", "ее", "ой", "ей", "ий", "ый", "ую", "юю", "ие", "ые",
+    "ов", "ев", "ам", "ям", "ах", "ях", "ом", "ем", "ию", "ия", "ии",
+    "а", "я", "ы", "и", "у", "ю", "е", "о", "ь",
+}, key=len, reverse=True))
+
+# Минимальная длина основы после отсечения окончания
+MIN_STEM = 3
+NGRAM = 3
+
+# Минимальная косинусная близость товара к запросу
+MIN_SCORE = 0.1
+
+# Дельта-сегмент сливается с основной матрицей, когда в нем больше строк
+COMPACT_MIN_ROWS = 1000
+COMPACT_FRACTION = 0.05
+
+SEARCH_FILES = ("features", "features_t")
+
+
+def normalize(text: Optional[str]) -> List[str]:
+    """Слова строки в нижнем регистре, ё заменяется на е"""
+    if not text:
+        return []
+    return _WORD_RE.findall(text.lower().replace("ё", "е"))
+
+
+def stem(word: str) -> str:
+    """Основа русского слова: отсечение окончания и мягкого знака"""
+    if not _CYRILLIC_RE.match(word) or len(word) <= MIN_STEM:
+        return word
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            word = word[:-len(ending)]
+            break
+    if word.endswith("ь") and len(word) > MIN_STEM:
+        word = word[:-1]
+    return word
+
+
+@functools.lru_cache(maxsize=100_000)
+def _word_terms(word: str) -> Tuple[str, ...]:
+    # Слова каталога сильно повторяются, разбор слова кэшируется
+    base = stem(word)
+    padded = f" {base} "
+    return ("w:" + base,) + tuple(padded[i:i + NGRAM] for i in range(len(padded) - NGRAM + 1))
+
+
+def analyze(text: Optional[str]) -> List[str]:
+    """Термы текста: основы слов ("w:") и символьные триграммы основ"""
+    terms = set()
+    for word in normalize(text):
+        terms.update(_word_terms(word))
+    return sorted(terms)
+
+
+def _columns(matrix: sparse.csr_matrix, width: int) -> sparse.csr_matrix:
+    """Матрица запросов шириной width: словарь мог вырасти до или после построения сегмента"""
+    if matrix.shape[1] == width:
+        return matrix
+    if matrix.shape[1] > width:
+        return matrix[:, :width]
+    padded = matrix.copy()
+    padded.resize((matrix.shape[0], width))
+    return padded
+
+
+class _Delta(NamedTuple):
+    """Состояние дельта-сегмента, подменяется одним присваиванием"""
+    positions: np.ndarray    # строки основной матрицы, замененные строками дельты
+    rows_t: sparse.csr_matrix  # V_d x D, транспонированные строки дельты
+    stale: np.ndarray        # маска замененных строк основной матрицы
+
+
+class SearchIndex:
+    """Инвертированный TF-IDF индекс по триграммам и основам слов"""
+
+    def __init__(self, features: sparse.csr_matrix, idf: np.ndarray, vocabulary: Dict[str, int]):
+        self.features = features
+        # Транспонированная копия V x N: Q @ X^T без конвертации формата на каждом запросе
+        self.features_t = features.T.tocsr()
+        self.idf = idf
+        self.vocabulary = vocabulary
+        self._delta = self._empty_delta()
+        self.auto_compact = True
+
+    @classmethod
+    def build(cls, texts: Sequence[str]) -> "SearchIndex":
+        vocabulary: Dict[str, int] = {}
+        rows: List[int] = []
+        cols: List[int] = []
+        for i, text in enumerate(texts):
+            for term in analyze(text):
+                rows.append(i)
+                cols.append(vocabulary.setdefault(term, len(vocabulary)))
+        n = len(texts)
+        df = np.bincount(cols, minlength=len(vocabulary)).astype(np.float32)
+        idf = (np.log((1.0 + n) / (1.0 + df)) + 1.0).astype(np.float32)
+        counts = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(n, len(vocabulary)), dtype=np.float32
+        )
+        return cls(cls._weigh(counts, idf), idf, vocabulary)
+
+    @staticmethod
+    def _weigh(counts: sparse.csr_matrix, idf: np.ndarray) -> sparse.csr_matrix:
+        """TF-IDF с нормировкой строк по L2"""
+        weighted = counts @ sparse.diags(idf[:counts.shape[1]])
+        norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        return sparse.csr_matrix(sparse.diags(1.0 / norms) @ weighted, dtype=np.float32)
+
+    def _empty_delta(self) -> _Delta:
+        return _Delta(
+            positions=np.empty(0, dtype=np.int64),
+            rows_t=sparse.csr_matrix((0, 0), dtype=np.float32),
+            stale=np.zeros(self.features.shape[0], dtype=bool),
+        )
+
+    def __len__(self) -> int:
+        return self.features.shape[0]
+
+    @property
+    def pending(self) -> int:
+        """Строк в дельта-сегменте"""
+        return len(self._delta.positions)
+
+    def needs_compaction(self) -> bool:
+        return self.pending > max(COMPACT_MIN_ROWS, COMPACT_FRACTION * len(self))
+
+    def _term_matrix(self, texts: Sequence[Optional[str]], grow: bool) -> sparse.csr_matrix:
+        """Бинарная матрица термов B x V; при grow=True новые термы добавляются в словарь"""
+        vocabulary = dict(self.vocabulary) if grow else self.vocabulary
+        rows: List[int] = []
+        cols: List[int] = []
+        for i, text in enumerate(texts):
+            for term in analyze(text):
+                col = vocabulary.get(term)
+                if col is None and grow:
+                    col = vocabulary[term] = len(vocabulary)
+                if col is not None:
+                    rows.append(i)
+                    cols.append(col)
+        if grow and len(vocabulary) > len(self.vocabulary):
+            # Новые термы считаются редкими (df = 1). idf подменяется раньше словаря,
+            # поэтому читатель не получит номер терма без веса
+            rare = np.log((1.0 + len(self)) / 2.0) + 1.0
+            self.idf = np.concatenate([
+                self.idf, np.full(len(vocabulary) - len(self.idf), rare, dtype=np.float32)
+            ])
+            self.vocabulary = vocabulary
+        return sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(len(texts), len(vocabulary)),
+            dtype=np.float32
+        )
+
+    def encode(self, queries: Sequence[Optional[str]]) -> sparse.csr_matrix:
+        """Нормированная матрица запросов B x V; термы вне словаря не влияют на скор"""
+        return self._weigh(self._term_matrix(queries, grow=False), self.idf)
+
+    def scores(self, queries: sparse.csr_matrix) -> np.ndarray:
+        """Косинусная близость запросов ко всем товарам, плотная матрица B x N"""
+        delta = self._delta
+        result = (_columns(queries, self.features_t.shape[0]) @ self.features_t).toarray()
+        if len(delta.positions):
+            result[:, delta.stale] = 0.0
+            result[:, delta.positions] = (_columns(queries, delta.rows_t.shape[0]) @ delta.rows_t).toarray()
+        return result
+
+    def search(self, query: str, limit: int = 10, min_score: float = MIN_SCORE) -> Tuple[np.ndarray, np.ndarray]:
+        """Позиции и скоры лучших товаров для одного запроса (без плотного вектора по каталогу)"""
+        encoded = self.encode([query])
+        if not encoded.nnz:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        delta = self._delta
+        base = (_columns(encoded, self.features_t.shape[0]) @ self.features_t).tocoo()
+        positions, scores = base.col.astype(np.int64), base.data
+        if len(delta.positions):
+            keep = ~delta.stale[positions]
+            updated = (_columns(encoded, delta.rows_t.shape[0]) @ delta.rows_t).tocoo()
+            positions = np.concatenate([positions[keep], delta.positions[updated.col]])
+            scores = np.concatenate([scores[keep], updated.data])
+        keep = scores >= min_score
+        positions, scores = positions[keep], scores[keep]
+        top = np.lexsort((positions, -scores))[:limit]
+        return positions[top], scores[top].astype(np.float32)
+
+    def update(self, positions: Sequence[int], texts: Sequence[Optional[str]]) -> None:
+        """Заменяет тексты товаров на позициях positions (инкрементально, через дельта-сегмент)"""
+        positions = np.asarray(positions, dtype=np.int64)
+        if not len(positions):
+            return
+        rows = self._weigh(self._term_matrix(texts, grow=True), self.idf)
+        delta = self._delta
+        # Повторное обновление товара заменяет его прежнюю строку в дельте
+        keep = ~np.isin(delta.positions, positions)
+        if delta.rows_t.shape[1]:
+            old_rows = delta.rows_t.T.tocsr()[np.flatnonzero(keep)]
+            old_rows.resize((old_rows.shape[0], rows.shape[1]))
+            rows = sparse.vstack([old_rows, rows], format="csr")
+            positions = np.concatenate([delta.positions[keep], positions])
+        stale = delta.stale.copy()
+        stale[positions] = True
+        self._delta = _Delta(positions=positions, rows_t=rows.T.tocsr(), stale=stale)
+        if self.auto_compact and self.needs_compaction():
+            self.compact()
+
+    def compact(self) -> None:
+        """Сливает дельта-сегмент с основной матрицей (O(nnz), без разбора текстов)"""
+        delta = self._delta
+        if not len(delta.positions):
+            return
+        n, vocab = self.features.shape[0], len(self.idf)
+        base = self.features.copy()
+        base.resize((n, vocab))
+        rows = delta.rows_t.T.tocsr()
+        rows.resize((rows.shape[0], vocab))
+        selection = np.arange(n)
+        selection[delta.positions] = n + np.arange(len(delta.positions))
+        features = sparse.vstack([base, rows], format="csr")[selection]
+        features_t = features.T.tocsr()
+        self.features, self.features_t, self._delta = features, features_t, _Delta(
+            positions=np.empty(0, dtype=np.int64),
+            rows_t=sparse.csr_matrix((0, 0), dtype=np.float32),
+            stale=np.zeros(n, dtype=bool),
+        )
+
+    def save(self, directory: str) -> None:
+        """Массивы в .npy (пригодны для mmap), словарь в JSON; дельта сливается перед записью"""
+        self.compact()
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "search.idf.npy"), self.idf)
+        for name in SEARCH_FILES:
+            matrix = getattr(self, name)
+            for part in ("data", "indices", "indptr"):
+                np.save(os.path.join(directory, f"search.{name}.{part}.npy"), getattr(matrix, part))
+        meta = {"shapes": {name: list(getattr(self, name).shape) for name in SEARCH_FILES}, "vocabulary": self.vocabulary}
+        with open(os.path.join(directory, "search.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory: str, mmap_mode: Optional[str] = "r") -> "SearchIndex":
+        with open(os.path.join(directory, "search.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls.__new__(cls)
+        index.idf = np.load(os.path.join(directory, "search.idf.npy"), mmap_mode=mmap_mode)
+        for name in SEARCH_FILES:
+            parts = [
+                np.load(os.path.join(directory, f"search.{name}.{part}.npy"), mmap_mode=mmap_mode)
+                for part in ("data", "indices", "indptr")
+            ]
+            setattr(index, name, sparse.csr_matrix(tuple(parts), shape=tuple(meta["shapes"][name]), copy=False))
+        index.vocabulary = meta["vocabulary"]
+        index._delta = index._empty_delta()
+        # Отображенный индекс не сливается сам, см. RecommendationIndex.compact
+        index.auto_compact = mmap_mode is None
+        return index
@@ -0,0 +1,319 @@
+"""
+Офлайн-обучение моделей по истории заказов.
+
+История заказов читается пачками ограниченного размера (CSV и Parquet через
+итераторы pandas/pyarrow, Postgres order-service через серверный курсор),
+матрица совместных покупок и ряды цен товаров накапливаются инкрементально,
+поэтому память не зависит от длины истории. Результат - версия в реестре
+моделей, которую сервис загружает через mmap.
+
+Строки выгрузки: order_id, product_id, quantity, unit_price, created_at и
+необязательный status. Строки одного заказа должны идти подряд (выгрузка
+упорядочена по order_id, как в запросе ORDERS_QUERY).
+
+Использование (из каталога services/ai-service):
+    python -m src.training --orders orders.parquet --catalog data/catalog.json --registry models
+    python -m src.training --orders-dsn postgresql://.../order_service \\
+        --catalog-dsn postgresql://.../catalog_service --registry models
+"""
+
+import argparse
+import os
+import time
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from src.copurchase import DEFAULT_MIN_COUNT, DEFAULT_TOP_K, CoPurchaseBuilder
+from src.estimator import catalog_prices, load_norms
+from src.forecaster import ForecastModel, pad_flat
+from src.model_registry import ModelRegistry
+from src.recommender import RecommendationIndex, load_catalog
+
+ORDER_COLUMNS = ["order_id", "product_id", "quantity", "unit_price", "created_at"]
+
+# Заказы в этих статусах не считаются покупками
+EXCLUDED_STATUSES = {"CANCELLED", "REFUNDED"}
+
+DEFAULT_CHUNK_SIZE = 100_000
+
+# Строки заказов order-service, упорядоченные по заказу (таблицы Prisma: orders, order_items)
+ORDERS_QUERY = """
+    SELECT oi."orderId" AS order_id, oi."productId" AS product_id, oi.quantity,
+           oi."unitPrice" AS unit_price, o."createdAt" AS created_at, o.status::text AS status
+    FROM order_items oi
+    JOIN orders o ON o.id = oi."orderId"
+    ORDER BY oi."orderId"
+"""
+
+CATALOG_QUERIES = {
+    "categories": 'SELECT id, name, "parentId" FROM categories WHERE "isActive"',
+    "warehouses": """
+        SELECT w.id, w.name, w.city, w.region, l.latitude, l.longitude
+        FROM warehouses w LEFT JOIN warehouse_locations l ON l."warehouseId" = w.id
+        WHERE w."isActive"
+    """,
+    "products": """
+        SELECT id, name, sku, "categoryId", brand, model, weight, "isActive", "isFeatured", "sortOrder"
+        FROM products
+    """,
+    "attributes": 'SELECT "productId", name, value, unit FROM product_attributes ORDER BY "productId", "sortOrder"',
+    "stock": """
+        SELECT "productId", "warehouseId", available, "unitPrice", currency
+        FROM warehouse_products
+    """,
+}
+
+
+def _connect(dsn: str):
+    try:
+        import psycopg2
+    except ImportError:
+        raise RuntimeError("psycopg2 is required to read from Postgres (pip install psycopg2-binary)")
+    return psycopg2.connect(dsn)
+
+
+def _query_chunks(dsn: str, query: str, chunk_size: int) -> Iterator[pd.DataFrame]:
+    """Результат запроса пачками через серверный курсор (строки не копятся на клиенте)"""
+    connection = _connect(dsn)
+    try:
+        with connection.cursor(name="ai_training") as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(query)
+            columns = None
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if columns is None and cursor.description:
+                    columns = [c[0] for c in cursor.description]
+                if not rows:
+                    break
+                yield pd.DataFrame(rows, columns=columns)
+    finally:
+        connection.close()
+
+
+def order_chunks(path: Optional[str] = None, dsn: Optional[str] = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """Строки заказов пачками не больше chunk_size из CSV, Parquet или Postgres"""
+    if dsn:
+        yield from _query_chunks(dsn, ORDERS_QUERY, chunk_size)
+        return
+    if path is None:
+        raise ValueError("orders source is not specified")
+    name = path.lower()
+    if name.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("pyarrow is required to read Parquet exports")
+        parquet = pq.ParquetFile(path)
+        columns = [c for c in ORDER_COLUMNS + ["status"] if c in parquet.schema_arrow.names]
+        for batch in parquet.iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+    elif name.endswith((".csv", ".csv.gz")):
+        yield from pd.read_csv(
+            path,
+            chunksize=chunk_size,
+            usecols=lambda c: c in ORDER_COLUMNS or c == "status",
+            dtype={"order_id": str, "product_id": str, "status": str},
+        )
+    else:
+        raise ValueError(f"Unsupported orders format: {path}")
+
+
+def load_catalog_postgres(dsn: str) -> dict:
+    """Снимок каталога из базы catalog-service в формате data/catalog.json"""
+    connection = _connect(dsn)
+    try:
+        frames = {name: pd.read_sql_query(query, connection) for name, query in CATALOG_QUERIES.items()}
+    finally:
+        connection.close()
+
+    attributes: Dict[str, List[dict]] = {}
+    for row in frames["attributes"].itertuples(index=False):
+        attributes.setdefault(row.productId, []).append({"name": row.name, "value": row.value, "unit": row.unit})
+    stock: Dict[str, List[dict]] = {}
+    for row in frames["stock"].itertuples(index=False):
+        stock.setdefault(row.productId, []).append({
+            "warehouseId": row.warehouseId,
+            "available": int(row.available),
+            "unitPrice": float(row.unitPrice),
+            "currency": row.currency,
+        })
+    return {
+        "categories": [
+            {"id": r.id, "name": r.name, "parentId": r.parentId}
+            for r in frames["categories"].itertuples(index=False)
+        ],
+        "warehouses": [
+            {
+                "id": r.id, "name": r.name, "city": r.city, "region": r.region,
+                "location": {"latitude": float(r.latitude), "longitude": float(r.longitude)} if pd.notna(r.latitude) else None,
+            }
+            for r in frames["warehouses"].itertuples(index=False)
+        ],
+        "products": [
+            {
+                "id": r.id, "name": r.name, "sku": r.sku, "categoryId": r.categoryId,
+                "brand": r.brand, "model": r.model,
+                "weight": float(r.weight) if pd.notna(r.weight) else None, "isActive": bool(r.isActive),
+                "isFeatured": bool(r.isFeatured), "sortOrder": int(r.sortOrder),
+                "attributes": attributes.get(r.id, []), "warehouses": stock.get(r.id, []),
+            }
+            for r in frames["products"].itertuples(index=False)
+        ],
+    }
+
+
+class PriceSeriesBuilder:
+    """
+    Дневные средневзвешенные цены товаров, накапливаемые по пачкам.
+
+    Хранятся суммы выручки и количества по ключу (товар, день) только в
+    скользящем окне window_days от последнего дня истории, поэтому объем
+    ограничен числом товаров x длиной окна.
+    """
+
+    def __init__(self, product_ids: Sequence[str], window_days: int = 365, max_points: int = 60):
+        self.product_ids = list(product_ids)
+        self.window_days = window_days
+        self.max_points = max_points
+        self._revenue = pd.Series(dtype=np.float64)
+        self._quantity = pd.Series(dtype=np.float64)
+        self._last_day: Optional[int] = None
+
+    def add_chunk(self, items: np.ndarray, days: np.ndarray, quantity: np.ndarray, unit_price: np.ndarray) -> None:
+        valid = (items >= 0) & (quantity > 0) & np.isfinite(unit_price)
+        if not valid.any():
+            return
+        items, days, quantity, unit_price = items[valid], days[valid], quantity[valid], unit_price[valid]
+        # Ключ (товар, день) упакован в int64: позиция товара в старших битах
+        keys = (items.astype(np.int64) << 32) | days.astype(np.int64)
+        chunk = pd.DataFrame({"key": keys, "revenue": quantity * unit_price, "quantity": quantity}).groupby("key").sum()
+        self._revenue = self._revenue.add(chunk["revenue"], fill_value=0.0)
+        self._quantity = self._quantity.add(chunk["quantity"], fill_value=0.0)
+
+        last_day = int(days.max())
+        self._last_day = last_day if self._last_day is None else max(self._last_day, last_day)
+        keep = (self._revenue.index.to_numpy() & 0xFFFFFFFF) > self._last_day - self.window_days
+        if not keep.all():
+            self._revenue = self._revenue[keep]
+            self._quantity = self._quantity[keep]
+
+    def finish(self) -> Optional[ForecastModel]:
+        """Модель прогноза по последним max_points дням истории каждого товара"""
+        if self._revenue.empty:
+            return None
+        keys = self._revenue.index.to_numpy()
+        price = self._revenue.to_numpy() / self._quantity.reindex(self._revenue.index).to_numpy()
+        items, days = keys >> 32, keys & 0xFFFFFFFF
+        order = np.lexsort((days, items))
+        items, price = items[order], price[order]
+
+        present, starts, lengths = np.unique(items, return_index=True, return_counts=True)
+        # Последние max_points точек каждого товара
+        rank_from_end = np.repeat(starts + lengths, lengths) - np.arange(len(items))
+        recent = rank_from_end <= self.max_points
+        values, mask = pad_flat(price[recent], np.minimum(lengths, self.max_points))
+        return ForecastModel.from_histories([self.product_ids[i] for i in present], values, mask)
+
+
+def _days(created_at: pd.Series) -> np.ndarray:
+    # Время с зоной to_numpy() отдает объектами Timestamp: сначала переводим в наивное UTC
+    return pd.to_datetime(created_at, utc=True).dt.tz_convert(None).to_numpy().astype("datetime64[D]").astype(np.int64)
+
+
+def train(
+    chunks: Iterator[pd.DataFrame],
+    catalog: dict,
+    window_days: int = 365,
+    max_points: int = 60,
+    top_k: int = DEFAULT_TOP_K,
+    min_count: int = DEFAULT_MIN_COUNT,
+    progress=None,
+):
+    """Один проход по истории заказов: индекс, матрица совместных покупок, модель цен"""
+    index = RecommendationIndex(catalog)
+    product_index = pd.Index(index.product_ids)
+    copurchase = CoPurchaseBuilder(index.product_ids)
+    prices = PriceSeriesBuilder(index.product_ids, window_days=window_days, max_points=max_points)
+
+    rows = 0
+    for chunk in chunks:
+        if "status" in chunk:
+            chunk = chunk[~chunk["status"].astype(str).str.upper().isin(EXCLUDED_STATUSES)]
+        items = product_index.get_indexer(chunk["product_id"].astype(str))
+        copurchase.add_chunk(chunk["order_id"].astype(str).to_numpy(dtype=object), items)
+        prices.add_chunk(
+            items,
+            _days(chunk["created_at"]),
+            pd.to_numeric(chunk["quantity"], errors="coerce").fillna(0).to_numpy(dtype=np.float64),
+            pd.to_numeric(chunk["unit_price"], errors="coerce").to_numpy(dtype=np.float64),
+        )
+        rows += len(chunk)
+        if progress is not None:
+            progress(rows, copurchase.orders)
+    return index, copurchase.finish(top_k, min_count), prices.finish()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="AI Service offline training")
+    orders = parser.add_mutually_exclusive_group(required=True)
+    orders.add_argument("--orders", help="order lines export (.csv, .csv.gz, .parquet)")
+    orders.add_argument("--orders-dsn", help="order-service Postgres DSN")
+    catalog = parser.add_mutually_exclusive_group(required=True)
+    catalog.add_argument("--catalog", help="catalog snapshot JSON")
+    catalog.add_argument("--catalog-dsn", help="catalog-service Postgres DSN")
+    parser.add_argument("--norms", default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "estimator_norms.json"))
+    parser.add_argument("--registry", default=os.getenv("MODEL_REGISTRY_DIR", "models"))
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="order lines per chunk")
+    parser.add_argument("--price-window-days", type=int, default=365)
+    parser.add_argument("--max-points", type=int, default=60, help="price points per product for the forecaster")
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K, help="co-purchase neighbors kept per product")
+    parser.add_argument("--min-count", type=int, default=DEFAULT_MIN_COUNT, help="minimum shared orders for a co-purchase pair")
+    parser.add_argument("--no-activate", action="store_true")
+    parser.add_argument("--keep", type=int, default=0, help="prune to this many versions (0 = keep all)")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    catalog_data = load_catalog_postgres(args.catalog_dsn) if args.catalog_dsn else load_catalog(args.catalog)
+
+    def progress(rows: int, baskets: int) -> None:
+        print(f"  {rows} order lines, {baskets} orders, {time.perf_counter() - started:.1f}s", flush=True)
+
+    index, copurchase, forecasts = train(
+        order_chunks(args.orders, args.orders_dsn, args.chunk_size),
+        catalog_data,
+        window_days=args.price_window_days,
+        max_points=args.max_points,
+        top_k=args.top_k,
+        min_count=args.min_count,
+        progress=progress,
+    )
+    registry = ModelRegistry(args.registry)
+    version = registry.publish(
+        index,
+        load_norms(args.norms),
+        catalog_prices(catalog_data),
+        forecasts=forecasts,
+        copurchase=copurchase,
+        source={
+            "catalog": "postgres" if args.catalog_dsn else args.catalog,
+            "orders": "postgres" if args.orders_dsn else args.orders,
+            "chunk_size": args.chunk_size,
+            "orders_count": copurchase.orders,
+        },
+        activate=not args.no_activate,
+    )
+    if args.keep:
+        registry.prune(args.keep)
+    print(
+        f"Published {version}: {len(index)} products, {copurchase.orders} orders, "
+        f"{copurchase.counts.nnz} co-purchase pairs, {len(forecasts) if forecasts else 0} price series "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,125 @@
+"""
+Пул процессов для инференса с общими массивами моделей.
+
+Главный процесс сохраняет массивы индекса рекомендаций в хранилище .npy
+(по умолчанию в /dev/shm, то есть в разделяемой памяти), а каждый процесс
+пула отображает их в память через mmap. Страницы с матрицами существуют
+в одном экземпляре на все ядра, процессы держат только свои метаданные.
+
+События каталога процессы пула берут из журнала src.catalog_sync: перед
+каждой задачей дочитываются новые строки и применяются к своему индексу;
+после сжатия журнала он перечитывается с начала.
+"""
+
+import asyncio
+import functools
+import multiprocessing
+import os
+import shutil
+import tempfile
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.catalog_sync import JournalPosition, read_journal
+from src.forecaster import fit_batch
+from src.geo import DEFAULT_RATE_PER_TON_KM
+from src.recommender import RecommendationIndex
+
+# Индекс, загруженный в процессе пула инициализатором, и позиция в журнале событий каталога
+_worker_index: Optional[RecommendationIndex] = None
+_worker_events_path: Optional[str] = None
+_worker_events_position = JournalPosition()
+
+
+def default_store_dir() -> str:
+    """Каталог хранилища массивов: /dev/shm, если доступен, иначе временный каталог"""
+    base = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else tempfile.gettempdir()
+    return os.path.join(base, f"tutuu-ai-models-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+
+
+def _init_worker(store_dir: str, events_path: Optional[str]) -> None:
+    global _worker_index, _worker_events_path
+    _worker_index = RecommendationIndex.load(store_dir, mmap_mode="r")
+    _worker_events_path = events_path
+    _sync_worker()
+
+
+def _sync_worker() -> None:
+    """Применяет события каталога, дописанные в журнал после прошлой задачи"""
+    global _worker_events_position
+    if _worker_events_path is None:
+        return
+    events, _worker_events_position = read_journal(_worker_events_path, _worker_events_position)
+    if events:
+        _worker_index.apply_events(events)
+
+
+def _recommend_batch(
+    search_queries: Sequence[Optional[str]],
+    categories: Sequence[Optional[str]],
+    budgets: Sequence[Optional[float]],
+    limits: Sequence[int],
+    locations: Optional[Sequence[Optional[Tuple[float, float]]]],
+    delivery_rate: float,
+) -> List[List[dict]]:
+    _sync_worker()
+    return _worker_index.recommend_batch(search_queries, categories, budgets, limits, locations, delivery_rate)
+
+
+def _fit_batch(values: np.ndarray, mask: np.ndarray):
+    return fit_batch(values, mask)
+
+
+class InferencePool:
+    """Пул процессов инференса поверх общего хранилища массивов"""
+
+    def __init__(
+        self,
+        index: Optional[RecommendationIndex],
+        workers: int,
+        store_dir: Optional[str] = None,
+        events_path: Optional[str] = None,
+    ):
+        # index=None: массивы уже лежат в store_dir (версия из реестра моделей),
+        # пул только отображает их и не удаляет каталог при остановке
+        self._owns_store = index is not None
+        self.store_dir = store_dir or default_store_dir()
+        self.workers = workers
+        if self._owns_store:
+            shutil.rmtree(self.store_dir, ignore_errors=True)
+            index.save(self.store_dir)
+        # spawn: процессы пула не наследуют потоки и состояние event loop родителя
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.store_dir, events_path),
+        )
+
+    def load_index(self) -> RecommendationIndex:
+        """Индекс для главного процесса, отображенный из того же хранилища"""
+        return RecommendationIndex.load(self.store_dir, mmap_mode="r")
+
+    async def _submit(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args))
+
+    async def recommend_batch(
+        self, search_queries, categories, budgets, limits, locations=None, delivery_rate: float = DEFAULT_RATE_PER_TON_KM
+    ) -> List[List[dict]]:
+        return await self._submit(
+            _recommend_batch, list(search_queries), list(categories), list(budgets), list(limits),
+            list(locations) if locations is not None else None, delivery_rate
+        )
+
+    async def fit_batch(self, values: np.ndarray, mask: np.ndarray):
+        return await self._submit(_fit_batch, values, mask)
+
+    def shutdown(self, cancel_pending: bool = True) -> None:
+        """Останавливает пул; при подмене версии (cancel_pending=False) дожидается запросов в работе"""
+        self._executor.shutdown(wait=True, cancel_futures=cancel_pending)
+        if self._owns_store:
+            shutil.rmtree(self.store_dir, ignore_errors=True)
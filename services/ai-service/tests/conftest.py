@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Тесты запускаются из каталога сервиса или из корня репозитория: src - пакет сервиса
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
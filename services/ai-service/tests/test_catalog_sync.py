@@ -0,0 +1,166 @@
+"""
+Журнал событий каталога: применение, сжатие и повторное применение.
+
+Состояние индекса, в который события применялись по мере поступления, должно
+совпадать с состоянием индекса той же версии, заново применившего сжатый
+журнал (рестарт, подмена версии, процесс пула, перечитавший журнал).
+"""
+
+import json
+import os
+import random
+
+import numpy as np
+import pytest
+
+from src.catalog_sync import CatalogEventLog, JournalPosition, fold_events, read_journal
+from src.recommender import RecommendationIndex, load_catalog
+
+CATALOG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "catalog.json")
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    return load_catalog(CATALOG_PATH)
+
+
+def fresh_index(catalog) -> RecommendationIndex:
+    return RecommendationIndex(json.loads(json.dumps(catalog)))
+
+
+def index_state(index: RecommendationIndex) -> dict:
+    index.compact()
+    offers = [index.geo.product_row(i) for i in range(len(index))]
+    return {
+        "sequence": index.sequence,
+        "names": list(index.names),
+        "arrays": {
+            name: np.asarray(getattr(index, name)).tolist()
+            for name in ("category", "featured", "active", "price", "stock", "prior", "in_stock")
+        },
+        "weight": np.asarray(index.geo.weight).tolist(),
+        "offers": [[np.asarray(part).tolist() for part in row] for row in offers],
+        "search": index.search.features.toarray().tolist(),
+    }
+
+
+def random_events(catalog, count: int, seed: int) -> list:
+    """Поток событий с краевыми случаями: остаток нового предложения до цены, товар без имени и веса"""
+    rng = random.Random(seed)
+    products = catalog["products"]
+    product_ids = [p["id"] for p in products] + ["prod-unknown"]
+    warehouses = [w["id"] for w in catalog["warehouses"]] + ["wh-unknown"]
+    events = []
+    for sequence in range(1, count + 1):
+        kind = rng.choice(("price", "stock", "stock", "product"))
+        if kind == "product":
+            product = dict(rng.choice(products))
+            product["isActive"] = rng.random() > 0.2
+            product["isFeatured"] = rng.random() > 0.5
+            if rng.random() < 0.3:
+                product.pop("name")
+            if rng.random() < 0.3:
+                product.pop("weight")
+            else:
+                product["weight"] = round(rng.uniform(1, 60), 1)
+            if rng.random() < 0.2:
+                product["categoryId"] = rng.choice(["cat-cement", "cat-missing"])
+            events.append({"sequence": sequence, "type": "product", "product": product})
+        elif kind == "price":
+            events.append({
+                "sequence": sequence, "type": "price", "product_id": rng.choice(product_ids),
+                "warehouse_id": rng.choice(warehouses), "unit_price": round(rng.uniform(5, 500), 2)
+            })
+        else:
+            events.append({
+                "sequence": sequence, "type": "stock", "product_id": rng.choice(product_ids),
+                "warehouse_id": rng.choice(warehouses), "available": float(rng.choice([0, 5, 100, 2500]))
+            })
+    return events
+
+
+def apply_live(index: RecommendationIndex, log: CatalogEventLog, events: list, batch: int) -> None:
+    for start in range(0, len(events), batch):
+        fresh = log.fresh(events[start:start + batch])
+        log.append(fresh)
+        index.apply_events(fresh)
+
+
+def test_stock_before_first_price_is_not_merged_into_the_price(catalog, tmp_path):
+    # У prod-brick-silicate нет предложения на wh-msk: остаток до цены пропускается
+    events = [
+        {"sequence": 1, "type": "stock", "product_id": "prod-brick-silicate", "warehouse_id": "wh-msk", "available": 500.0},
+        {"sequence": 2, "type": "price", "product_id": "prod-brick-silicate", "warehouse_id": "wh-msk", "unit_price": 20.0},
+    ]
+    live = fresh_index(catalog)
+    log = CatalogEventLog(str(tmp_path / "journal.ndjson"))
+    apply_live(live, log, events, batch=1)
+    log.compact()
+
+    replayed = fresh_index(catalog)
+    replayed.apply_events(log.read())
+    assert index_state(replayed) == index_state(live)
+    assert fold_events(events) == events
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_compacted_journal_replays_to_live_state(catalog, tmp_path, seed):
+    events = random_events(catalog, 400, seed)
+    live = fresh_index(catalog)
+    log = CatalogEventLog(str(tmp_path / "journal.ndjson"), compact_min_events=50)
+    for start in range(0, len(events), 37):
+        apply_live(live, log, events[start:start + 37], batch=37)
+        if log.needs_compaction():
+            log.compact()
+    log.compact()
+
+    assert log.compactions > 1
+    assert log.events < len(events)
+    replayed = fresh_index(catalog)
+    replayed.apply_events(log.read())
+    assert index_state(replayed) == index_state(live)
+
+
+def test_replay_from_newer_snapshot_matches_live_state(catalog, tmp_path):
+    # Снимок версии моделей уже содержит часть событий журнала (sequence снимка)
+    events = random_events(catalog, 300, seed=11)
+    live = fresh_index(catalog)
+    log = CatalogEventLog(str(tmp_path / "journal.ndjson"))
+    apply_live(live, log, events, batch=25)
+    log.compact()
+
+    snapshot = fresh_index(catalog)
+    snapshot.apply_events(events[:120])
+    snapshot.apply_events(log.read())
+    assert index_state(snapshot) == index_state(live)
+
+
+def test_reader_position_survives_journal_swap(catalog, tmp_path):
+    path = str(tmp_path / "journal.ndjson")
+    events = random_events(catalog, 200, seed=3)
+    live = fresh_index(catalog)
+    log = CatalogEventLog(path)
+    worker = fresh_index(catalog)
+    position = JournalPosition()
+
+    apply_live(live, log, events[:80], batch=20)
+    read, position = read_journal(path, position)
+    assert [e["sequence"] for e in read] == list(range(1, 81))
+    worker.apply_events(read)
+
+    # Без новых строк позиция не двигается, недописанная строка ждет следующего чтения
+    assert read_journal(path, position) == ([], position)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"sequence": 81, "type": "stock"')
+    assert read_journal(path, position) == ([], position)
+    log.compact()
+
+    # После подмены файла (другой inode) журнал читается с начала, примененное отсекается по sequence
+    apply_live(live, log, events[80:], batch=20)
+    read, moved = read_journal(path, position)
+    assert moved.inode != position.inode
+    assert read[-1]["sequence"] == 200
+    worker.apply_events(read)
+    assert index_state(worker) == index_state(live)
+
+    assert read_journal(path, moved) == ([], moved)